@@ -0,0 +1,48 @@
+# benchmarks/import_time.py
+"""
+Measures the cost of `import sampling_planners` in a fresh interpreter.
+
+Usage: python benchmarks/import_time.py [--runs N] [--module NAME]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from os.path import dirname, join, abspath
+
+SRC = join(dirname(dirname(abspath(__file__))), "src")
+
+PROBE = """
+import resource, sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'torch' in sys.modules)
+"""
+
+def measure(module, runs):
+    times, rss, torch_loaded = [], [], False
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE.format(module=module)],
+                             check=True, capture_output=True, text=True,
+                             env=dict(os.environ, PYTHONPATH=SRC)).stdout.split()
+        times.append(float(out[0]))
+        rss.append(int(out[1]))
+        torch_loaded = torch_loaded or out[2] == "True"
+    times.sort()
+    return {
+        "module": module,
+        "runs": runs,
+        "import_seconds_median": times[len(times) // 2],
+        "import_seconds_max": times[-1],
+        "max_rss_kb": max(rss),
+        "torch_loaded": torch_loaded,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--module", default="sampling_planners")
+    args = parser.parse_args()
+    print(json.dumps(measure(args.module, args.runs), indent=2))
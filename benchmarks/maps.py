@@ -0,0 +1,73 @@
+# benchmarks/maps.py
+"""
+Deterministic benchmark maps. Every generator takes a seed and returns
+(cost_map, start, goal) with start and goal on free cells.
+"""
+import numpy as np
+
+def clutter(seed, size=256, n_obstacles=60):
+    """Low-cost noise with random rectangular obstacles."""
+    rng = np.random.default_rng(seed)
+    cost_map = rng.random((size, size)) * 0.5
+    for _ in range(n_obstacles):
+        r, c = rng.integers(0, size, 2)
+        h, w = rng.integers(size // 64 + 1, size // 10 + 2, 2)
+        cost_map[r:r + h, c:c + w] = 1.0
+    start, goal = (size // 20, size // 20), (size - 1 - size // 20, size - 1 - size // 20)
+    return _clear(cost_map, start, goal), start, goal
+
+def maze(seed, cells=12, corridor=8):
+    """Perfect maze carved by a randomized depth-first search."""
+    rng = np.random.default_rng(seed)
+    size = cells * corridor * 2 + corridor
+    cost_map = np.ones((size, size))
+    def carve(i, j):
+        r, c = (2 * i + 1) * corridor, (2 * j + 1) * corridor
+        cost_map[r - corridor // 2:r + corridor // 2 + 1, c - corridor // 2:c + corridor // 2 + 1] = 0.1
+        return r, c
+    visited = np.zeros((cells, cells), dtype=bool)
+    stack = [(0, 0)]
+    visited[0, 0] = True
+    carve(0, 0)
+    while stack:
+        i, j = stack[-1]
+        options = [(i + di, j + dj) for di, dj in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                   if 0 <= i + di < cells and 0 <= j + dj < cells and not visited[i + di, j + dj]]
+        if not options:
+            stack.pop()
+            continue
+        ni, nj = options[rng.integers(len(options))]
+        (r0, c0), (r1, c1) = carve(i, j), carve(ni, nj)
+        half = corridor // 2
+        cost_map[min(r0, r1) - half:max(r0, r1) + half + 1, min(c0, c1) - half:max(c0, c1) + half + 1] = 0.1
+        visited[ni, nj] = True
+        stack.append((ni, nj))
+    return cost_map, carve(0, 0), carve(cells - 1, cells - 1)
+
+def narrow_passage(seed, size=256, gap=4):
+    """Free space split by a wall with one narrow gap at a random height."""
+    rng = np.random.default_rng(seed)
+    cost_map = rng.random((size, size)) * 0.2
+    wall = size // 2
+    cost_map[:, wall - 2:wall + 2] = 1.0
+    r = int(rng.integers(size // 8, size - size // 8 - gap))
+    cost_map[r:r + gap, wall - 2:wall + 2] = 0.2
+    start, goal = (size // 2, size // 8), (size // 2, size - 1 - size // 8)
+    return _clear(cost_map, start, goal), start, goal
+
+def large(seed, size=2048):
+    """A 2048 x 2048 cluttered map."""
+    return clutter(seed, size=size)
+
+MAPS = {
+    'clutter': clutter,
+    'maze': maze,
+    'narrow_passage': narrow_passage,
+    'large': large,
+}
+
+def _clear(cost_map, start, goal, radius=2):
+    # Keep start and goal off obstacles.
+    for r, c in (start, goal):
+        cost_map[max(r - radius, 0):r + radius + 1, max(c - radius, 0):c + radius + 1] = 0.0
+    return cost_map
@@ -0,0 +1,163 @@
+# benchmarks/planners.py
+"""
+Runs every planner and sampler combination on the benchmark maps over
+many seeds and reports wall-time percentiles, success rate, path cost,
+node count and collision checks as JSON. Samplers that cannot run here
+(learning without torch or its model, static without --static-points)
+are reported as skipped, with the reason, in place of their results.
+With --baseline, the results are compared against a stored run and the
+exit status is 1 on a regression.
+
+Usage: python benchmarks/planners.py [--maps M ...] [--planners P ...]
+           [--samplers S ...] [--seeds N] [--time-budget SEC]
+           [--backend B] [--static-points points.npy]
+           [--out results.json] [--baseline baseline.json] [--tolerance F]
+"""
+import argparse
+import json
+import sys
+import time
+from os.path import dirname, join, abspath
+
+import numpy as np
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "src"))
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from sampling_planners import (RRTConnect, BidirectionalEST, BITStar, PRM, PlanningTimeout,
+                               UniformSampling, HybridSampling, StaticSampling, InformedSampling, GuidedSampling,
+                               LearningBasedSampling,
+                               available_backends, get_backend, set_backend)
+from sampling_planners.core.utils import calculate_path_cost
+from maps import MAPS
+
+WEIGHTS = {'length': 0.7, 'cost': 0.3}
+
+PLANNERS = {
+    'rrt_connect': lambda sampler: RRTConnect(step_size=8.0, max_iterations=20000, sampling_method=sampler),
+    'rrt_connect_greedy': lambda sampler: RRTConnect(step_size=8.0, max_iterations=20000, sampling_method=sampler,
+                                                     connect=True),
+    'bidirectional_est': lambda sampler: BidirectionalEST(step_size=8.0, max_iterations=5000, k_samples=5,
+                                                          radius=12.0, sampling_method=sampler),
+    'bit_star': lambda sampler: BITStar(batch_size=400, max_batches=5, step_size=12.0, sampling_method=sampler),
+    'prm': lambda sampler: PRM(n_samples=2000, k_neighbors=10, sampling_method=sampler, lazy=True),
+}
+
+# (N, 2) points for StaticSampling, loaded from --static-points.
+static_points = None
+
+SAMPLERS = {
+    'uniform': UniformSampling,
+    'hybrid': lambda: HybridSampling(goal_bias=0.1),
+    'informed': InformedSampling,
+    'guided': GuidedSampling,
+    'static': lambda: StaticSampling(static_points),
+    'learning': LearningBasedSampling,
+}
+
+def skip_reason(sampler_name):
+    # Why sampler_name cannot run on this installation, or None.
+    if sampler_name == 'static' and static_points is None:
+        return "no static points; pass --static-points points.npy"
+    if sampler_name == 'learning':
+        try:
+            LearningBasedSampling()
+        except (ImportError, OSError, RuntimeError) as e:
+            return str(e)
+    return None
+
+def skipped_case(map_name, planner_name, sampler_name, seeds, reason):
+    return {"map": map_name, "planner": planner_name, "sampler": sampler_name, "seeds": seeds, "skipped": reason}
+
+def run_case(map_name, planner_name, sampler_name, seeds, time_budget):
+    times, costs, nodes, checks, successes = [], [], [], [], 0
+    for seed in range(seeds):
+        cost_map, start, goal = MAPS[map_name](seed)
+        planner = PLANNERS[planner_name](SAMPLERS[sampler_name]())
+        np.random.seed(seed)
+        t = time.perf_counter()
+        try:
+            path = planner.plan(start, goal, cost_map, WEIGHTS, time_budget=time_budget)
+        except PlanningTimeout:
+            path = None
+        times.append(time.perf_counter() - t)
+        nodes.append(planner.stats['nodes'])
+        checks.append(planner.stats['collision_checks'])
+        if path is not None:
+            successes += 1
+            costs.append(calculate_path_cost(path, cost_map, WEIGHTS))
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    return {
+        "map": map_name,
+        "planner": planner_name,
+        "sampler": sampler_name,
+        "seeds": seeds,
+        "time_p50": float(p50),
+        "time_p90": float(p90),
+        "time_p99": float(p99),
+        "success_rate": successes / seeds,
+        "cost_mean": float(np.mean(costs)) if costs else None,
+        "nodes_mean": float(np.mean(nodes)),
+        "collision_checks_mean": float(np.mean(checks)),
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a message for every case that is slower (p50 time), less
+    successful or more expensive than the baseline beyond tolerance.
+    """
+    key = lambda r: (r["map"], r["planner"], r["sampler"])
+    reference = {key(r): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = reference.get(key(r))
+        if old is None or "skipped" in r or "skipped" in old:
+            continue
+        name = "/".join(key(r))
+        if r["time_p50"] > old["time_p50"] * (1 + tolerance):
+            regressions.append("%s: time_p50 %.4fs -> %.4fs" % (name, old["time_p50"], r["time_p50"]))
+        if r["success_rate"] < old["success_rate"] - tolerance:
+            regressions.append("%s: success_rate %.2f -> %.2f" % (name, old["success_rate"], r["success_rate"]))
+        if r["cost_mean"] is not None and old["cost_mean"] is not None and r["cost_mean"] > old["cost_mean"] * (1 + tolerance):
+            regressions.append("%s: cost_mean %.2f -> %.2f" % (name, old["cost_mean"], r["cost_mean"]))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--maps", nargs="+", default=list(MAPS), choices=list(MAPS))
+    parser.add_argument("--planners", nargs="+", default=list(PLANNERS), choices=list(PLANNERS))
+    parser.add_argument("--samplers", nargs="+", default=list(SAMPLERS), choices=list(SAMPLERS))
+    parser.add_argument("--seeds", type=int, default=20)
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="per-query budget; BITStar then refines until it runs out")
+    parser.add_argument("--backend", default=get_backend(), choices=available_backends(),
+                        help="kernel backend (see sampling_planners.core.backend)")
+    parser.add_argument("--static-points",
+                        help=".npy file of (N, 2) points for the static sampler, which is skipped without it")
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    set_backend(args.backend)
+    if args.static_points:
+        static_points = np.load(args.static_points).reshape(-1, 2)
+    reasons = {s: skip_reason(s) for s in args.samplers}
+    for s, reason in reasons.items():
+        if reason is not None:
+            print("SKIPPED %s: %s" % (s, reason), file=sys.stderr)
+    results = [run_case(m, p, s, args.seeds, args.time_budget) if reasons[s] is None
+               else skipped_case(m, p, s, args.seeds, reasons[s])
+               for m in args.maps for p in args.planners for s in args.samplers]
+    report = {"seeds": args.seeds, "time_budget": args.time_budget, "backend": args.backend, "results": results}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,116 @@
+# benchmarks/predictor_cpu.py
+"""
+Compares CPU deployment settings of the UNet predictor against the model
+as it ran before them (unfused, torch.no_grad(), full resolution) and
+reports, per setting, construction time, prediction latency percentiles
+and how closely its samples follow the reference: the IoU of the cells
+LearningBasedSampling samples from (probability > 0.1 on free cells) and
+the mean absolute difference of the probability maps.
+
+Usage: python benchmarks/predictor_cpu.py [--model best_model.pth]
+           [--narrow small_model.pth ...] [--scales S ...] [--threads N]
+           [--maps M ...] [--seeds N] [--runs N] [--out results.json]
+"""
+import argparse
+import json
+import sys
+import time
+from os.path import dirname, join, abspath
+
+import numpy as np
+import torch
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, join(ROOT, "src"))
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from sampling_planners.model import Predictor, UNet
+from maps import MAPS
+
+DEFAULT_MODEL = join(ROOT, "src", "sampling_planners", "model", "best_model.pth")
+
+class Reference:
+    """The predictor as it ran before the CPU deployment options."""
+    def __init__(self, model_path):
+        self.model = UNet()
+        self.model.load_state_dict(torch.load(model_path, map_location='cpu'))
+        self.model.eval()
+
+    def predict(self, obstacle_map, start_map, goal_map):
+        x = torch.from_numpy(np.stack([obstacle_map, start_map, goal_map]).astype(np.float32)).unsqueeze(0)
+        with torch.no_grad():
+            return self.model(x).numpy()[0, 0]
+
+def feature_maps(cost_map, start, goal):
+    # As LearningBasedSampling._generate_feature_maps.
+    obstacle_map = (cost_map == 1.0).astype(np.float32)
+    start_map = np.zeros(cost_map.shape, dtype=np.float32)
+    start_map[start[0], start[1]] = 1.0
+    goal_map = np.zeros(cost_map.shape, dtype=np.float32)
+    goal_map[goal[0], goal[1]] = 1.0
+    return obstacle_map, start_map, goal_map
+
+def build(make_predictor):
+    t = time.perf_counter()
+    predictor = make_predictor()
+    return predictor, time.perf_counter() - t
+
+def run_setting(name, predictor, construction, inputs, reference, runs):
+    times, ious, errors = [], [], []
+    for (cost_map, features), expected in zip(inputs, reference):
+        for _ in range(runs):
+            t = time.perf_counter()
+            prob_map = predictor.predict(*features)
+            times.append(time.perf_counter() - t)
+        free = cost_map < 0.9
+        cells, expected_cells = (prob_map > 0.1) & free, (expected > 0.1) & free
+        union = (cells | expected_cells).sum()
+        ious.append((cells & expected_cells).sum() / union if union else 1.0)
+        errors.append(np.abs(prob_map - expected).mean())
+    p50, p90 = np.percentile(times, [50, 90])
+    return {
+        "setting": name,
+        "construction_seconds": construction,
+        "latency_p50": float(p50),
+        "latency_p90": float(p90),
+        "sample_iou_mean": float(np.mean(ious)),
+        "sample_iou_min": float(np.min(ious)),
+        "prob_abs_error_mean": float(np.mean(errors)),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--narrow", nargs="*", default=[],
+                        help="narrower checkpoints of the same UNet to compare as well")
+    parser.add_argument("--scales", nargs="+", type=float, default=[1.0, 0.5, 0.25])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--maps", nargs="+", default=["clutter", "maze", "narrow_passage"], choices=list(MAPS))
+    parser.add_argument("--seeds", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    inputs = []
+    for m in args.maps:
+        for seed in range(args.seeds):
+            cost_map, start, goal = MAPS[m](seed)
+            inputs.append((cost_map, feature_maps(cost_map, start, goal)))
+
+    reference_model, construction = build(lambda: Reference(args.model))
+    reference = [reference_model.predict(*features) for _, features in inputs]
+    results = [run_setting("reference", reference_model, construction, inputs, reference, args.runs)]
+    for path in [args.model] + args.narrow:
+        for scale in args.scales:
+            name = "%s@%g" % (path if path != args.model else "model", scale)
+            predictor, construction = build(lambda: Predictor(path, 'cpu', scale=scale))
+            results.append(run_setting(name, predictor, construction, inputs, reference, args.runs))
+    report = {"maps": args.maps, "seeds": args.seeds, "runs": args.runs,
+              "threads": torch.get_num_threads(), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
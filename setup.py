@@ -12,6 +12,10 @@ setup(
         "numpy>=1.18.0",
         "scipy>=1.5.0",
     ],
+    extras_require={
+        "learning": ["torch>=1.8"],
+        "fast": ["numba>=0.50"],
+    },
     python_requires=">=3.7",
     license="MIT",
 )
\ No newline at end of file
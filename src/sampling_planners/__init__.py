@@ -1,7 +1,10 @@
 from .algorithms.rrt_connect import RRTConnect
 from .algorithms.bidirectional_est import BidirectionalEST
 from .algorithms.bit_star import BITStar
-from .algorithms.prm import PRM
-from .core.sampling import UniformSampling, HybridSampling, StaticSampling, LearningBasedSampling
+from .algorithms.prm import PRM, Roadmap
+from .core.sampling import UniformSampling, HybridSampling, StaticSampling, InformedSampling, GuidedSampling, LearningBasedSampling
+from .core.planner import PlanningTimeout
+from .core.parallel import plan_many, plan_race
+from .core.backend import get_backend, set_backend, available_backends
 
 __version__ = "0.1.0"
\ No newline at end of file
@@ -1,4 +1,4 @@
 from .rrt_connect import RRTConnect
 from .bidirectional_est import BidirectionalEST
 from .bit_star import BITStar
-from .prm import PRM
\ No newline at end of file
+from .prm import PRM, Roadmap
\ No newline at end of file
@@ -1,11 +1,17 @@
 # algorithms/bidirectional_est.py
 from ..core.planner import Planner
-from ..core.utils import collision_check, calculate_path_cost, nearest_neighbor
+from ..core.costmap import pinned
+from ..core.utils import collision_check, collision_check_batch, calculate_path_cost, edge_costs
+from ..core.tree import Tree
+import math
 import numpy as np
 
 class BidirectionalEST(Planner):
     """
     Bidirectional Expansive Space Trees.
+
+    replan() prunes the subtrees cut off by the changed regions, updates
+    the costs of edges through them and grows the remaining trees again.
     """
     def __init__(self, step_size=5.0, max_iterations=1000, k_samples=10, radius=10.0, sampling_method=None):
         super().__init__(sampling_method)
@@ -14,56 +20,128 @@ class BidirectionalEST(Planner):
         self.k_samples = k_samples
         self.radius = radius
 
-    def plan(self, start, goal, cost_map, weights):
-        tree_a = [start]
-        tree_b = [goal]
-        parents_a = {start: None}
-        parents_b = {goal: None}
+    def plan(self, start, goal, cost_map, weights, time_budget=None):
+        self._start(time_budget)
+        self._query = (start, goal, cost_map, weights)
+        # Node costs are the weighted cost of the tree path from the root,
+        # as calculate_path_cost would compute it.
+        tree_a = Tree(start)
+        tree_b = Tree(goal)
+        self._state = (tree_a, tree_b, None)
+        with pinned(cost_map):
+            return self._grow()
+
+    def _replan(self, regions, time_budget):
+        # Drop the subtrees hanging from edges that are now in collision,
+        # re-integrate the cost of the other edges through the regions and
+        # keep growing; the last connection is reused if it is still free.
+        self._start(time_budget)
+        start, goal, cost_map, weights = self._query
+        tree_a, tree_b, connection = self._state
+        new_ids = []
+        for tree in (tree_a, tree_b):
+            edges = tree.edge_index()
+            hit = np.unique(np.concatenate([edges.query(region) for region in regions] + [np.empty(0, dtype=int)]))
+            self.stats['collision_checks'] += len(hit)
+            free = collision_check_batch(edges.segments[hit], cost_map)
+            kept, segments = hit[free] + 1, edges.segments[hit[free]]
+            points, parent, cost = tree.points, tree.parent, tree.cost
+            old = cost[kept] - cost[parent[kept]] - weights['length'] * np.hypot(*(segments[:, 1] - segments[:, 0]).T)
+            delta = weights['cost'] * edge_costs(segments, cost_map) - old
+            new_ids.append(tree.prune(hit[~free] + 1))
+            # Edges inside pruned subtrees are gone (new id -1).
+            alive = new_ids[-1][kept] >= 0
+            tree.add_cost(new_ids[-1][kept][alive], delta[alive])
+        if connection is not None:
+            connection = (int(new_ids[0][connection[0]]), int(new_ids[1][connection[1]]))
+            if min(connection) >= 0:
+                self.stats['collision_checks'] += 1
+                if collision_check((tree_a.point(connection[0]), tree_b.point(connection[1])), cost_map):
+                    self.stats['nodes'] = len(tree_a) + len(tree_b)
+                    self._state = (tree_a, tree_b, connection)
+                    return self._finish(self._connect(tree_a, tree_b, connection))
+        self._state = (tree_a, tree_b, None)
+        return self._grow()
+
+    def _grow(self):
+        start, goal, cost_map, weights = self._query
+        tree_a, tree_b, _ = self._state
+        from_start = True
 
         for _ in range(self.max_iterations):
-            # Expand tree_a
-            q = tree_a[np.random.randint(len(tree_a))]
-            best_new = None
-            best_cost = float('inf')
-            for _ in range(self.k_samples):
-                theta = np.random.uniform(0, 2 * np.pi)
-                r = np.random.uniform(0, self.radius)
-                sample = (q[0] + r * np.cos(theta), q[1] + r * np.sin(theta))
-                new = self._steer(q, sample)
-                if collision_check((q, new), cost_map):
-                    path = self._trace_path(parents_a, q) + [new]
-                    cost = calculate_path_cost(path, cost_map, weights)
-                    if cost < best_cost:
-                        best_new = new
-                        best_cost = cost
-            if best_new is None:
+            if self._time_up():
+                break
+            # Expand tree_a: steer toward k random points around q and keep
+            # the collision-free one with the lowest cost from the root.
+            q = np.random.randint(len(tree_a))
+            theta = np.random.uniform(0, 2 * np.pi, self.k_samples)
+            r = np.random.uniform(0, self.radius, self.k_samples)
+            origin = tree_a.points[q]
+            new = self._steer_many(origin, origin + r[:, None] * np.column_stack([np.cos(theta), np.sin(theta)]))
+            cells = np.rint(new).astype(int)
+            inside = (cells >= 0).all(axis=1) & (cells < cost_map.shape).all(axis=1)
+            self.stats['collision_checks'] += len(new)
+            free = np.flatnonzero(inside & collision_check_batch(np.stack([np.broadcast_to(origin, new.shape), new], axis=1), cost_map))
+            if len(free) == 0:
                 tree_a, tree_b = tree_b, tree_a
-                parents_a, parents_b = parents_b, parents_a
+                from_start = not from_start
                 continue
+            segments = np.stack([np.broadcast_to(origin, new[free].shape), new[free]], axis=1)
+            cost = tree_a.cost[q] + weights['length'] * np.hypot(*(new[free] - origin).T) + weights['cost'] * edge_costs(segments, cost_map)
+            best = int(np.argmin(cost))
+            best_new = tree_a.add(new[free[best]], q, cost[best])
+            new_pt = tree_a.point(best_new)
+            if self.callbacks:
+                self._emit('edge', tree='start' if from_start else 'goal', parent=tree_a.point(q), child=new_pt)
 
             # Try to connect to tree_b
-            nearest_b = nearest_neighbor(tree_b, best_new)
-            if np.hypot(best_new[0] - nearest_b[0], best_new[1] - nearest_b[1]) < self.step_size:
-                if collision_check((best_new, nearest_b), cost_map):
-                    path = self._trace_path(parents_a, best_new) + self._trace_path(parents_b, nearest_b)[::-1]
-                    if calculate_path_cost(path, cost_map, weights) < float('inf'):
-                        return path
+            nearest_b = tree_b.nearest(new_pt)
+            near_pt = tree_b.point(nearest_b)
+            if math.hypot(new_pt[0] - near_pt[0], new_pt[1] - near_pt[1]) < self.step_size:
+                self.stats['collision_checks'] += 1
+                if collision_check((new_pt, near_pt), cost_map):
+                    connection = (best_new, nearest_b) if from_start else (nearest_b, best_new)
+                    if not from_start:
+                        tree_a, tree_b = tree_b, tree_a
+                    path = self._connect(tree_a, tree_b, connection)
+                    if path is not None:
+                        self.stats['nodes'] = len(tree_a) + len(tree_b)
+                        self._state = (tree_a, tree_b, connection)
+                        return self._finish(path)
+                    if not from_start:
+                        tree_a, tree_b = tree_b, tree_a
 
             # Swap trees
             tree_a, tree_b = tree_b, tree_a
-            parents_a, parents_b = parents_b, parents_a
+            from_start = not from_start
+        if not from_start:
+            tree_a, tree_b = tree_b, tree_a
+        self.stats['nodes'] = len(tree_a) + len(tree_b)
+        self._state = (tree_a, tree_b, None)
+        return self._finish(None)
+
+    def _connect(self, tree_start, tree_goal, connection):
+        # The path through the connected nodes, or None if it is infeasible.
+        start, goal, cost_map, weights = self._query
+        path = tree_start.path(connection[0]) + tree_goal.path(connection[1])[::-1]
+        path[0], path[-1] = start, goal
+        if calculate_path_cost(path, cost_map, weights) < float('inf'):
+            self._emit('solution', path=path)
+            return path
         return None
 
+    def _steer_many(self, from_pt, to_pts):
+        # Vectorized _steer from one point toward each row of to_pts.
+        direction = to_pts - from_pt
+        dist = np.hypot(direction[:, 0], direction[:, 1])
+        far = dist >= self.step_size
+        steered = to_pts.copy()
+        steered[far] = from_pt + direction[far] / dist[far, None] * self.step_size
+        return steered
+
     def _steer(self, from_pt, to_pt):
-        direction = np.array(to_pt) - np.array(from_pt)
-        dist = np.linalg.norm(direction)
+        dx, dy = to_pt[0] - from_pt[0], to_pt[1] - from_pt[1]
+        dist = math.hypot(dx, dy)
         if dist < self.step_size:
-            return tuple(to_pt)
-        return tuple(np.array(from_pt) + direction / dist * self.step_size)
-
-    def _trace_path(self, parents, node):
-        path = [node]
-        while parents[node] is not None:
-            node = parents[node]
-            path.append(node)
-        return path[::-1]
\ No newline at end of file
+            return (float(to_pt[0]), float(to_pt[1]))
+        return (float(from_pt[0] + dx / dist * self.step_size), float(from_pt[1] + dy / dist * self.step_size))
@@ -1,60 +1,181 @@
 # algorithms/bit_star.py
 from ..core.planner import Planner
-from ..core.utils import collision_check, calculate_path_cost, heuristic, nearest_neighbor
+from ..core.costmap import pinned
+from ..core.utils import collision_check_batch, edge_costs, heuristic
+from ..core.spatial import SpatialIndex, EdgeIndex, radius_pairs
+from ..core.sampling import InformedSampling
+from ..core.search import Graph, astar
 import numpy as np
-import heapq
 
 class BITStar(Planner):
     """
     Simplified BIT* planner.
+
+    Samples and edges persist across batches: only pairs involving new
+    samples are connected and collision-checked, and samples that cannot
+    lie on a path cheaper than the best one found are pruned. With
+    informed=True, batches after the first solution are drawn directly
+    from the ellipse of samples that could still improve it. With a
+    time_budget, plan() runs batches until the deadline and returns the
+    best path found by then. replan() rechecks the edges through the
+    changed regions and searches the repaired graph, running new batches
+    only while no path is left (or, with a time_budget, until the deadline).
     """
-    def __init__(self, batch_size=100, max_batches=10, step_size=5.0, sampling_method=None):
+    def __init__(self, batch_size=100, max_batches=10, step_size=5.0, sampling_method=None, informed=True):
         super().__init__(sampling_method)
         self.batch_size = batch_size
         self.max_batches = max_batches
         self.step_size = step_size
+        self.informed = informed
+
+    def plan(self, start, goal, cost_map, weights, time_budget=None):
+        self._start(time_budget)
+        self._query = (start, goal, cost_map, weights)
+        sampler = self.sampling_method
+        if self.informed and not isinstance(sampler, InformedSampling):
+            sampler = InformedSampling(sampler)
+        self._state = state = _Search(sampler, SpatialIndex([start, goal]), EdgeIndex(2 * self.step_size))
+        self._reset_best(state)
+        with pinned(cost_map):
+            return self._refine(state, until_solved=False)
+
+    def _replan(self, regions, time_budget):
+        # Recheck the edges through the changed regions and re-integrate
+        # the cost of those still free, then search the repaired graph.
+        # Samples pruned against the old solution lost their edges; they
+        # are reactivated and connected again.
+        self._start(time_budget)
+        start, goal, cost_map, weights = self._query
+        state = self._state
+        hit = np.unique(np.concatenate([state.edges.query(region) for region in regions] + [np.empty(0, dtype=int)]))
+        self.stats['collision_checks'] += len(hit)
+        free = collision_check_batch(state.edges.segments[hit], cost_map)
+        state.edges.remove(hit[~free])
+        state.keep_edges(~np.isin(state.edge_ids, hit[~free]))
+        hit = hit[free]
+        changed = np.flatnonzero(np.isin(state.edge_ids, hit))
+        if len(changed):
+            state.edge_weights[changed] = self._edge_weights(state.edges.segments[hit], cost_map, weights)[
+                np.searchsorted(hit, state.edge_ids[changed])]
+        state.graph = Graph.from_edges(len(state.index), state.edge_src, state.edge_dst, state.edge_weights)
+        reactivated = np.flatnonzero(~state.active)
+        state.active[:] = True
+        self._connect(state, reactivated)
+        self._reset_best(state)
+        self._search(state)
+        return self._refine(state, until_solved=True)
+
+    def _reset_best(self, state):
+        state.best_cost = float('inf')
+        state.best_path = None
+        if isinstance(state.sampler, InformedSampling):
+            state.sampler.c_best = float('inf')
+
+    def _refine(self, state, until_solved):
+        # Runs batches: max_batches of them, or with a time budget until
+        # the deadline. With until_solved, stops early once a path exists.
+        batches = 0
+        while (batches < self.max_batches or self._deadline is not None) and not self._time_up():
+            if until_solved and state.best_path is not None and self._deadline is None:
+                break
+            batches += 1
+            self._batch(state)
+            self._search(state)
+        self.stats['nodes'] = len(state.index)
+        return self._finish(state.best_path)
+
+    def _batch(self, state):
+        start, goal, cost_map, weights = self._query
+        index, sampler = state.index, state.sampler
+        # Sample a new batch, keeping the samples that could still lie
+        # on a path cheaper than the best one (all of them, when the
+        # batch comes from the informed ellipse).
+        first = len(index)
+        batch = sampler.sample_batch(cost_map, start, goal, self.batch_size)
+        batch = batch[self._lower_bound(start, batch.T, goal, weights) < state.best_cost]
+        index.insert_many(batch)
+        if self.callbacks:
+            self._emit('batch', samples=batch)
+        state.active = np.concatenate([state.active, np.ones(len(batch), dtype=bool)])
+        # Pairs among old samples were handled by earlier batches.
+        self._connect(state, np.arange(first, len(index)))
+
+    def _connect(self, state, ids):
+        # Connects the samples ids to every active sample within step_size.
+        # If the deadline passes first, they are deactivated instead, as
+        # samples without edges.
+        start, goal, cost_map, weights = self._query
+        points = state.index.points
+        state.graph.add_edges([], [], [], n=len(points))
+        src, dst = radius_pairs(state.index, ids, self.step_size, state.active)
+        if self._time_up():
+            state.active[ids] = False
+            return
+        if len(src):
+            self.stats['collision_checks'] += len(src)
+            segments = np.stack([points[src], points[dst]], axis=1)
+            free = collision_check_batch(segments, cost_map)
+            if self.callbacks:
+                self._emit('edges', segments=segments[free])
+            edge_ids = state.edges.insert_many(segments[free])
+            cost = self._edge_weights(segments[free], cost_map, weights)
+            state.edge_src = np.concatenate([state.edge_src, src[free], dst[free]])
+            state.edge_dst = np.concatenate([state.edge_dst, dst[free], src[free]])
+            state.edge_ids = np.concatenate([state.edge_ids, edge_ids, edge_ids])
+            state.edge_weights = np.concatenate([state.edge_weights, cost, cost])
+            state.graph.add_edges(np.concatenate([src[free], dst[free]]), np.concatenate([dst[free], src[free]]),
+                                  np.concatenate([cost, cost]))
+
+    def _search(self, state):
+        # A* over the current edges; keeps the path if it improves on the
+        # best one and prunes the samples that can no longer improve it.
+        start, goal, cost_map, weights = self._query
+        points = state.index.points
+        graph = state.graph
+        path, cost = astar(graph, 0, 1, weights['length'] * np.hypot(*(points - points[1]).T))
+        if path and cost < state.best_cost:
+            state.best_cost = cost
+            if isinstance(state.sampler, InformedSampling) and weights['length'] > 0:
+                state.sampler.c_best = cost / weights['length']
+            state.best_path = [start] + [tuple(float(c) for c in points[i]) for i in path[1:-1]] + [goal]
+            self._emit('solution', path=state.best_path)
+            pruned = state.active & (self._lower_bound(start, points.T, goal, weights) >= cost)
+            pruned[:2] = False
+            state.active &= ~pruned
+            keep = state.active[state.edge_src] & state.active[state.edge_dst]
+            state.edges.remove(state.edge_ids[~keep])
+            state.keep_edges(keep)
+            graph.remove_nodes(np.flatnonzero(pruned))
+
+    def _edge_weights(self, segments, cost_map, weights):
+        # Weighted length plus integrated cost; the same in both directions.
+        length = np.hypot(*(segments[:, 1] - segments[:, 0]).T)
+        return weights['length'] * length + weights['cost'] * edge_costs(segments, cost_map)
+
+    def _lower_bound(self, start, sample, goal, weights):
+        # Cost-map terms are non-negative, so the weighted straight-line
+        # length through sample bounds the cost of any path through it.
+        return weights['length'] * (heuristic(start, sample) + heuristic(sample, goal))
+
+
+class _Search:
+    # BIT* state kept between plan() and replan(). Every collision-free
+    # pair of samples is stored as two directed edges sharing one id in
+    # the EdgeIndex. graph holds the same edges and grows with them, so
+    # that searches do not rebuild it; replan() rebuilds it once.
+    def __init__(self, sampler, index, edges):
+        self.sampler = sampler
+        self.index = index
+        self.edges = edges
+        self.active = np.ones(len(index), dtype=bool)
+        self.edge_src = np.empty(0, dtype=np.int64)
+        self.edge_dst = np.empty(0, dtype=np.int64)
+        self.edge_ids = np.empty(0, dtype=np.int64)
+        self.edge_weights = np.empty(0)
+        self.graph = Graph.from_edges(len(index), [], [], [])
+        self.best_cost = float('inf')
+        self.best_path = None
 
-    def plan(self, start, goal, cost_map, weights):
-        best_cost = float('inf')
-        best_path = None
-        samples = [start, goal]
-        edges = {}
-        for batch in range(self.max_batches):
-            # Sample new batch in informed ellipse
-            for _ in range(self.batch_size):
-                sample = self.sampling_method.sample(cost_map, start, goal)
-                if heuristic(start, sample) + heuristic(sample, goal) < best_cost:
-                    samples.append(sample)
-            # Build edges
-            for i, s1 in enumerate(samples):
-                for j, s2 in enumerate(samples):
-                    if i == j: continue
-                    if heuristic(s1, s2) > self.step_size: continue
-                    if collision_check((s1, s2), cost_map):
-                        cost = weights['length'] * heuristic(s1, s2) + weights['cost'] * cost_map[int(round(s1[0])), int(round(s1[1]))]
-                        edges.setdefault(s1, []).append((s2, cost))
-            # A* search
-            path, cost = self._astar(start, goal, edges, weights)
-            if path and cost < best_cost:
-                best_cost = cost
-                best_path = path
-        return best_path
-
-    def _astar(self, start, goal, edges, weights):
-        open_set = []
-        heapq.heappush(open_set, (0 + heuristic(start, goal), 0, start, [start]))
-        closed = set()
-        while open_set:
-            f, g, node, path = heapq.heappop(open_set)
-            if node == goal:
-                return path, g
-            if node in closed:
-                continue
-            closed.add(node)
-            for neighbor, cost in edges.get(node, []):
-                if neighbor in closed:
-                    continue
-                g_new = g + cost
-                f_new = g_new + heuristic(neighbor, goal)
-                heapq.heappush(open_set, (f_new, g_new, neighbor, path + [neighbor]))
-        return None, float('inf')
\ No newline at end of file
+    def keep_edges(self, keep):
+        self.edge_src, self.edge_dst = self.edge_src[keep], self.edge_dst[keep]
+        self.edge_ids, self.edge_weights = self.edge_ids[keep], self.edge_weights[keep]
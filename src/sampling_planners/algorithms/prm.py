@@ -1,53 +1,287 @@
 # algorithms/prm.py
 from ..core.planner import Planner
-from ..core.utils import collision_check, calculate_path_cost, heuristic, nearest_neighbor
-from scipy.spatial import KDTree
+from ..core.costmap import pinned
+from ..core.utils import collision_check_batch, edge_costs, heuristic
+from ..core.spatial import SpatialIndex, EdgeIndex
+from ..core.search import Graph, astar
+from os.path import join
+import os
 import numpy as np
-import heapq
 
 class PRM(Planner):
     """
     Probabilistic Roadmap Planner.
+
+    Without a roadmap every call to plan() samples and connects a fresh
+    one. For many queries on the same map, call build_roadmap() once (or
+    pass a loaded Roadmap) and plan() only attaches start and goal to it.
+    With lazy=True, edges are not collision-checked when the roadmap is
+    built; only edges on candidate paths are checked (Lazy PRM).
+    replan() keeps the roadmap of the last plan() and rechecks only the
+    edges through the changed regions (see Roadmap.update()).
     """
-    def __init__(self, n_samples=200, k_neighbors=10, sampling_method=None):
+    def __init__(self, n_samples=200, k_neighbors=10, sampling_method=None, roadmap=None, lazy=False):
         super().__init__(sampling_method)
         self.n_samples = n_samples
         self.k_neighbors = k_neighbors
+        self.roadmap = roadmap
+        self.lazy = lazy
+
+    def plan(self, start, goal, cost_map, weights, time_budget=None):
+        self._start(time_budget)
+        self._query = (start, goal, cost_map, weights)
+        roadmap = self.roadmap
+        checks = 0 if roadmap is None else roadmap.collision_checks
+        with pinned(cost_map):
+            if roadmap is None:
+                roadmap = self._sample_roadmap(cost_map, start, goal, stop=self._time_up)
+                if roadmap is None:
+                    return self._finish(None)
+            self._state = roadmap
+            return self._search(roadmap, checks)
+
+    def _replan(self, regions, time_budget):
+        self._start(time_budget)
+        roadmap = self._state
+        checks = roadmap.collision_checks
+        roadmap.update(self._query[2], regions, lazy=self.lazy)
+        return self._search(roadmap, checks)
+
+    def _search(self, roadmap, checks):
+        start, goal, cost_map, weights = self._query
+        path, cost = roadmap.query(start, goal, cost_map, weights, self.k_neighbors, stop=self._time_up)
+        self.stats['nodes'] = len(roadmap)
+        self.stats['collision_checks'] = roadmap.collision_checks - checks
+        if path is not None:
+            self._emit('solution', path=path)
+        return self._finish(path)
+
+    def build_roadmap(self, cost_map, start=None, goal=None):
+        """
+        Builds a roadmap for cost_map and keeps it for subsequent plans.
+        start and goal are only passed on to the sampling method; samplers
+        that ignore them, such as UniformSampling, accept None.
+        """
+        with pinned(cost_map):
+            self.roadmap = self._sample_roadmap(cost_map, start, goal)
+        return self.roadmap
+
+    def _sample_roadmap(self, cost_map, start, goal, stop=None):
+        # None if stop() returned True before the roadmap was complete.
+        samples = self.sampling_method.sample_batch(cost_map, start, goal, self.n_samples)
+        if stop is not None and stop():
+            return None
+        roadmap = Roadmap.build(samples, cost_map, self.k_neighbors, lazy=self.lazy, stop=stop)
+        if roadmap is not None:
+            self._emit('roadmap', roadmap=roadmap)
+        return roadmap
+
+class Roadmap:
+    """
+    Reusable PRM roadmap.
+
+    Nodes are an (N, 2) array and the k-nearest-neighbor edges are stored
+    in CSR form: the edges leaving node i are indptr[i]:indptr[i + 1] of
+    indices (target node), lengths, costs (the cost map integrated along
+    the edge, see edge_costs()) and state (1 collision-free, 0 in collision, -1 not checked yet).
+    Edge weights are applied per query, so one roadmap serves any weights.
+    The arrays other than state may be memory-mapped; see save() and load().
+    """
+    ARRAYS = ('nodes', 'indptr', 'indices', 'lengths', 'costs', 'state')
+
+    def __init__(self, nodes, indptr, indices, lengths, costs, state=None):
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+        self.costs = costs
+        # Lazy validation writes to state, so it is never memory-mapped.
+        self.state = np.ones(len(indices), dtype=np.int8) if state is None else np.array(state, dtype=np.int8)
+        # Number of segments collision-checked by build() and query().
+        self.collision_checks = 0
+        self._index = None
+        self._edges = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @classmethod
+    def build(cls, points, cost_map, k_neighbors=10, lazy=False, stop=None):
+        """
+        Connects every point to its k nearest neighbors. Every edge is
+        kept: in collision ones with state 0, so that update() can reopen
+        them, or with lazy=True all unchecked for query() to validate on
+        demand. Edges are checked and costed in chunks; stop, if given,
+        is called between chunks, and when it returns True build() gives
+        up and returns None.
+        """
+        nodes = np.asarray(points, dtype=float).reshape(-1, 2)
+        _, neighbors = SpatialIndex(nodes).query(nodes, k=k_neighbors + 1)
+        src = np.repeat(np.arange(len(nodes)), neighbors.shape[1] - 1)
+        dst = neighbors[:, 1:].ravel()
+        segments = np.stack([nodes[src], nodes[dst]], axis=1)
+        checks = 0 if lazy else len(src)
+        state = np.full(len(dst), -1, dtype=np.int8)
+        costs = np.empty(len(dst))
+        for i in range(0, len(dst), _BUILD_CHUNK):
+            if stop is not None and stop():
+                return None
+            chunk = segments[i:i + _BUILD_CHUNK]
+            if not lazy:
+                state[i:i + _BUILD_CHUNK] = collision_check_batch(chunk, cost_map)
+            costs[i:i + _BUILD_CHUNK] = edge_costs(chunk, cost_map)
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(nodes)), out=indptr[1:])
+        roadmap = cls(nodes, indptr, dst.astype(np.int64), np.hypot(*(nodes[dst] - nodes[src]).T), costs, state)
+        roadmap.collision_checks = checks
+        return roadmap
+
+    def save(self, path):
+        """
+        Saves the roadmap arrays. A path ending in '.npz' is written as a
+        single archive; any other path is a directory of .npy files, which
+        load() can memory-map so that processes share one copy.
+        """
+        arrays = {name: np.asarray(getattr(self, name)) for name in self.ARRAYS}
+        if str(path).endswith('.npz'):
+            np.savez(path, **arrays)
+            return
+        os.makedirs(path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(join(path, name + '.npy'), array)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads a roadmap written by save(). Directories are memory-mapped
+        with mmap_mode (None reads them into memory); archives are read
+        into memory.
+        """
+        if str(path).endswith('.npz'):
+            with np.load(path) as data:
+                return cls(*(data[name] for name in cls.ARRAYS))
+        return cls(*(np.load(join(path, name + '.npy'), mmap_mode=None if name == 'state' else mmap_mode)
+                     for name in cls.ARRAYS))
+
+    def query(self, start, goal, cost_map, weights, k_neighbors=10, stop=None):
+        """
+        Attaches start and goal to their k nearest nodes and searches.
+        Edges that have not been collision-checked yet, including the new
+        start and goal edges, are checked only when they lie on the best
+        path found; in-collision edges are then removed and the search
+        repeats. Results for roadmap edges are kept in state.
+        Parameters
+        ----------
+        start, goal : tuple
+            Query endpoints.
+        cost_map : np.ndarray
+            2D cost map the roadmap was built on.
+        weights : dict
+            {'length': float, 'cost': float}
+        k_neighbors : int
+            Number of nodes start and goal are connected to.
+        stop : callable, optional
+            Checked before each round of lazy validation; when it returns
+            True the query gives up and returns (None, inf).
+        Returns
+        -------
+        tuple
+            (path, cost), or (None, inf) if no path exists.
+        """
+        if tuple(start) == tuple(goal):
+            return [start], 0.0
+        n = len(self.nodes)
+        s, t = n, n + 1
+        coords = np.vstack([self.nodes, np.array([start, goal], dtype=float)])
+        near = self._spatial_index().query(coords[n:], k=k_neighbors)[1]
+        # Start and goal edges exist for this query only; their collision
+        # state is tracked in `attached`.
+        pairs = [(s, j) for j in near[0].tolist()] + [(j, t) for j in near[1].tolist()]
+        # Connect start and goal directly when goal is among start's neighbors.
+        if len(near[0]) == 0 or heuristic(start, goal) <= heuristic(start, self.nodes[near[0][-1]]):
+            pairs.append((s, t))
+        segments = coords[np.array(pairs, dtype=int).reshape(-1, 2)]
+        pair_costs = (weights['length'] * np.hypot(*(segments[:, 1] - segments[:, 0]).T)
+                      + weights['cost'] * edge_costs(segments, cost_map)).tolist()
+        extra = {s: []}
+        for (u, v), w in zip(pairs, pair_costs):
+            extra.setdefault(u, []).append((v, w))
+        attached = {}
+        edge_weights = weights['length'] * self.lengths + weights['cost'] * self.costs
+        edge_weights[self.state == 0] = np.inf
+        graph = Graph(self.indptr, self.indices, edge_weights)
+        h = weights['length'] * np.hypot(*(coords - coords[t]).T)
+        while True:
+            ids, cost = astar(graph, s, t, h, extra)
+            if ids is None:
+                return None, cost
+            unchecked = []
+            for u, v in zip(ids, ids[1:]):
+                if u >= n or v >= n:
+                    if attached.get((u, v), -1) == -1:
+                        unchecked.append((u, v, -1))
+                else:
+                    e = graph.edge(u, v)
+                    if self.state[e] == -1:
+                        unchecked.append((u, v, e))
+            if not unchecked:
+                break
+            if stop is not None and stop():
+                return None, float('inf')
+            self.collision_checks += len(unchecked)
+            free = collision_check_batch([(coords[u], coords[v]) for u, v, _ in unchecked], cost_map)
+            for (u, v, e), ok in zip(unchecked, free):
+                if e < 0:
+                    attached[(u, v)] = int(ok)
+                    if not ok:
+                        extra[u] = [(j, w) for j, w in extra[u] if j != v]
+                else:
+                    self.state[e] = ok
+                    if not ok:
+                        edge_weights[e] = np.inf
+        path = [start] + [tuple(float(c) for c in self.nodes[i]) for i in ids[1:-1]] + [goal]
+        return path, cost
+
+    def update(self, cost_map, regions, lazy=True):
+        """
+        Repairs the roadmap after cost_map changed within regions, whose
+        derived structures update_cost_map() has already brought up to
+        date. Edges passing through a region, in collision before or not,
+        are marked unchecked, or with lazy=False checked right away, and
+        their costs are integrated again; edges the change cleared are
+        thereby restored.
+        Parameters
+        ----------
+        cost_map : np.ndarray
+            The modified cost map.
+        regions : list of tuple
+            (row0, col0, row1, col1) cell ranges, row1 and col1 exclusive.
+        lazy : bool
+            Leave the affected edges for query() to check.
+        """
+        edges = self._edge_index()
+        hit = np.unique(np.concatenate([edges.query(region) for region in regions] + [np.empty(0, dtype=int)]))
+        if lazy:
+            self.state[hit] = -1
+        elif len(hit):
+            self.collision_checks += len(hit)
+            self.state[hit] = collision_check_batch(edges.segments[hit], cost_map)
+        if len(hit):
+            if not self.costs.flags.writeable:
+                self.costs = np.array(self.costs)
+            self.costs[hit] = edge_costs(edges.segments[hit], cost_map)
+
+    def _edge_index(self):
+        if self._edges is None:
+            src = np.repeat(np.arange(len(self.nodes)), np.diff(self.indptr))
+            self._edges = EdgeIndex()
+            self._edges.insert_many(np.stack([self.nodes[src], self.nodes[self.indices]], axis=1))
+        return self._edges
+
+    def _spatial_index(self):
+        if self._index is None:
+            self._index = SpatialIndex(self.nodes)
+        return self._index
 
-    def plan(self, start, goal, cost_map, weights):
-        samples = [start, goal]
-        while len(samples) < self.n_samples + 2:
-            pt = self.sampling_method.sample(cost_map, start, goal)
-            if cost_map[int(round(pt[0])), int(round(pt[1]))] < 0.99:
-                samples.append(pt)
-        tree = KDTree(samples)
-        edges = {pt: [] for pt in samples}
-        for i, pt in enumerate(samples):
-            dists, idxs = tree.query(pt, k=self.k_neighbors + 1)
-            for j in idxs[1:]:
-                neighbor = samples[j]
-                if collision_check((pt, neighbor), cost_map):
-                    cost = weights['length'] * heuristic(pt, neighbor) + weights['cost'] * cost_map[int(round(pt[0])), int(round(pt[1]))]
-                    edges[pt].append((neighbor, cost))
-        # A* search
-        path, cost = self._astar(start, goal, edges, weights)
-        return path
-
-    def _astar(self, start, goal, edges, weights):
-        open_set = []
-        heapq.heappush(open_set, (0 + heuristic(start, goal), 0, start, [start]))
-        closed = set()
-        while open_set:
-            f, g, node, path = heapq.heappop(open_set)
-            if node == goal:
-                return path, g
-            if node in closed:
-                continue
-            closed.add(node)
-            for neighbor, cost in edges.get(node, []):
-                if neighbor in closed:
-                    continue
-                g_new = g + cost
-                f_new = g_new + heuristic(neighbor, goal)
-                heapq.heappush(open_set, (f_new, g_new, neighbor, path + [neighbor]))
-        return None, float('inf')
\ No newline at end of file
+# Number of edges Roadmap.build() checks between calls to stop().
+_BUILD_CHUNK = 4096
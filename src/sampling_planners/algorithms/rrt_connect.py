@@ -1,6 +1,10 @@
 # algorithms/rrt_connect.py
 from ..core.planner import Planner
-from ..core.utils import collision_check, calculate_path_cost, nearest_neighbor
+from ..core.costmap import pinned
+from ..core.utils import collision_check, collision_check_batch, calculate_path_cost
+from ..core.tree import Tree
+import math
+import warnings
 import numpy as np
 
 # class RRTConnect(Planner):
@@ -55,63 +59,194 @@ import numpy as np
 class RRTConnect(Planner):
     """
     RRT-Connect planner.
+
+    By default every iteration extends the start tree one step toward a
+    sample and the goal tree one step toward the new node. With
+    connect=True the planner runs the classic RRT-Connect instead: the
+    other tree is extended toward the new node step after step until it
+    reaches it or is blocked, and the two trees swap roles after every
+    iteration. All steps of such a connect run are collision-checked as
+    one batch. This needs far fewer iterations, especially on open maps.
+
+    replan() prunes the subtrees cut off by the changed regions and grows
+    the remaining trees again.
     """
-    def __init__(self, step_size=5.0, max_iterations=1000, sampling_method=None):
+    def __init__(self, step_size=5.0, max_iterations=1000, sampling_method=None, connect=False):
         super().__init__(sampling_method)
         self.step_size = step_size
         self.max_iterations = max_iterations
+        self.connect = connect
 
-    def plan(self, start, goal, cost_map, weights, visualize=False):
-        tree_a = [start]
-        tree_b = [goal]
-        parents_a = {start: None}
-        parents_b = {goal: None}
+    def plan(self, start, goal, cost_map, weights, visualize=False, time_budget=None):
+        if visualize:
+            warnings.warn("visualize is deprecated; register a callback with add_callback() instead",
+                          DeprecationWarning, stacklevel=2)
+            return self._plan_recorded(start, goal, cost_map, weights, time_budget)
+        self._start(time_budget)
+        self._query = (start, goal, cost_map, weights)
+        self._state = (Tree(start), Tree(goal), None)
+        with pinned(cost_map):
+            return self._grow()
 
-        sampled_points = []
-        tree_edges_a = []
-        tree_edges_b = []
+    def _replan(self, regions, time_budget):
+        # Drop the subtrees hanging from edges that are now in collision and
+        # keep growing the rest; the last connection is reused if both of
+        # its ends survive and the segment joining them is still free.
+        self._start(time_budget)
+        cost_map = self._query[2]
+        tree_a, tree_b, connection = self._state
+        new_ids = []
+        for tree in (tree_a, tree_b):
+            edges = tree.edge_index()
+            hit = np.unique(np.concatenate([edges.query(region) for region in regions] + [np.empty(0, dtype=int)]))
+            self.stats['collision_checks'] += len(hit)
+            blocked = hit[~collision_check_batch(edges.segments[hit], cost_map)]
+            new_ids.append(tree.prune(blocked + 1))
+        if connection is not None:
+            connection = (int(new_ids[0][connection[0]]), int(new_ids[1][connection[1]]))
+            if min(connection) >= 0:
+                self.stats['collision_checks'] += 1
+                if collision_check((tree_a.point(connection[0]), tree_b.point(connection[1])), cost_map):
+                    self.stats['nodes'] = len(tree_a) + len(tree_b)
+                    self._state = (tree_a, tree_b, connection)
+                    return self._finish(self._connect(tree_a, tree_b, connection))
+        self._state = (tree_a, tree_b, None)
+        return self._grow()
 
+    def _grow(self):
+        if self.connect:
+            return self._grow_connect()
+        start, goal, cost_map, weights = self._query
+        tree_a, tree_b, _ = self._state
         for _ in range(self.max_iterations):
+            if self._time_up():
+                break
             sample = self.sampling_method.sample(cost_map, start, goal)
-            if visualize:
-                sampled_points.append(sample)
-
-            nearest_a = nearest_neighbor(tree_a, sample)
-            new_a = self._steer(nearest_a, sample)
-            if collision_check((nearest_a, new_a), cost_map):
-                tree_a.append(new_a)
-                parents_a[new_a] = nearest_a
-                if visualize:
-                    tree_edges_a.append((nearest_a, new_a))
-
-                nearest_b = nearest_neighbor(tree_b, new_a)
-                new_b = self._steer(nearest_b, new_a)
-                if collision_check((nearest_b, new_b), cost_map):
-                    tree_b.append(new_b)
-                    parents_b[new_b] = nearest_b
-                    if visualize:
-                        tree_edges_b.append((nearest_b, new_b))
-
-                    if np.hypot(new_a[0] - new_b[0], new_a[1] - new_b[1]) < self.step_size:
-                        path = self._trace_path(parents_a, new_a) + self._trace_path(parents_b, new_b)[::-1]
-                        if calculate_path_cost(path, cost_map, weights) < float('inf'):
-                            if visualize:
-                                return path, sampled_points, tree_edges_a, tree_edges_b
-                            return path
-        if visualize:
-            return None, sampled_points, tree_edges_a, tree_edges_b
+            if self.callbacks:
+                self._emit('sample', point=sample)
+
+            nearest_a = tree_a.nearest(sample)
+            from_a = tree_a.point(nearest_a)
+            new_a = self._steer(from_a, sample)
+            self.stats['collision_checks'] += 1
+            if collision_check((from_a, new_a), cost_map):
+                id_a = tree_a.add(new_a, nearest_a)
+                if self.callbacks:
+                    self._emit('edge', tree='start', parent=from_a, child=new_a)
+
+                nearest_b = tree_b.nearest(new_a)
+                from_b = tree_b.point(nearest_b)
+                new_b = self._steer(from_b, new_a)
+                self.stats['collision_checks'] += 1
+                if collision_check((from_b, new_b), cost_map):
+                    id_b = tree_b.add(new_b, nearest_b)
+                    if self.callbacks:
+                        self._emit('edge', tree='goal', parent=from_b, child=new_b)
+
+                    if math.hypot(new_a[0] - new_b[0], new_a[1] - new_b[1]) < self.step_size:
+                        self.stats['collision_checks'] += 1
+                        path = None
+                        if collision_check((new_a, new_b), cost_map):
+                            path = self._connect(tree_a, tree_b, (id_a, id_b))
+                        if path is not None:
+                            self.stats['nodes'] = len(tree_a) + len(tree_b)
+                            self._state = (tree_a, tree_b, (id_a, id_b))
+                            return self._finish(path)
+        self.stats['nodes'] = len(tree_a) + len(tree_b)
+        return self._finish(None)
+
+    def _grow_connect(self):
+        # RRT-Connect: extend one tree a step toward a sample, then the
+        # other one greedily toward the new node, and swap the trees.
+        start, goal, cost_map, weights = self._query
+        tree_start, tree_goal, _ = self._state
+        trees = [(tree_start, 'start'), (tree_goal, 'goal')]
+        for _ in range(self.max_iterations):
+            if self._time_up():
+                break
+            (tree_a, name_a), (tree_b, name_b) = trees
+            trees.reverse()
+            sample = self.sampling_method.sample(cost_map, start, goal)
+            if self.callbacks:
+                self._emit('sample', point=sample)
+
+            nearest_a = tree_a.nearest(sample)
+            from_a = tree_a.point(nearest_a)
+            new_a = self._steer(from_a, sample)
+            self.stats['collision_checks'] += 1
+            if not collision_check((from_a, new_a), cost_map):
+                continue
+            id_a = tree_a.add(new_a, nearest_a)
+            if self.callbacks:
+                self._emit('edge', tree=name_a, parent=from_a, child=new_a)
+
+            id_b = self._extend_to(tree_b, name_b, new_a)
+            if id_b is not None:
+                connection = (id_a, id_b) if tree_a is tree_start else (id_b, id_a)
+                path = self._connect(tree_start, tree_goal, connection)
+                if path is not None:
+                    self.stats['nodes'] = len(tree_start) + len(tree_goal)
+                    self._state = (tree_start, tree_goal, connection)
+                    return self._finish(path)
+        self.stats['nodes'] = len(tree_start) + len(tree_goal)
+        return self._finish(None)
+
+    def _extend_to(self, tree, name, target):
+        # Adds the free part of the straight run of step_size steps from the
+        # node of tree nearest to target toward it. Returns the id of the
+        # node the run ends at if the last step into target is free too,
+        # else None.
+        cost_map = self._query[2]
+        nearest = tree.nearest(target)
+        origin = np.asarray(tree.point(nearest), dtype=float)
+        delta = np.asarray(target, dtype=float) - origin
+        dist = math.hypot(delta[0], delta[1])
+        steps = max(int(math.ceil(dist / self.step_size)), 1)
+        # The intermediate nodes; the last step ends at target itself.
+        points = origin + delta / max(dist, 1e-12) * self.step_size * np.arange(1, steps)[:, None]
+        ends = np.vstack([points, [target]])
+        segments = np.stack([np.vstack([origin, points]), ends], axis=1)
+        self.stats['collision_checks'] += steps
+        blocked = np.flatnonzero(~collision_check_batch(segments, cost_map))
+        free = blocked[0] if len(blocked) else steps
+        added = points[:min(free, steps - 1)]
+        ids = tree.add_chain(added, nearest)
+        if self.callbacks:
+            chain = [tuple(p) for p in np.vstack([origin, added]).tolist()]
+            for parent, child in zip(chain, chain[1:]):
+                self._emit('edge', tree=name, parent=parent, child=child)
+        if free < steps:
+            return None
+        return int(ids[-1]) if len(ids) else int(nearest)
+
+    def _connect(self, tree_a, tree_b, connection):
+        # The path through the connected nodes, or None if it is infeasible.
+        start, goal, cost_map, weights = self._query
+        path = tree_a.path(connection[0]) + tree_b.path(connection[1])[::-1]
+        path[0], path[-1] = start, goal
+        if calculate_path_cost(path, cost_map, weights) < float('inf'):
+            self._emit('solution', path=path)
+            return path
         return None
 
+    def _plan_recorded(self, start, goal, cost_map, weights, time_budget):
+        # The deprecated visualize=True output, collected through callbacks.
+        sampled_points, tree_edges = [], {'start': [], 'goal': []}
+        def record(event, data):
+            if event == 'sample':
+                sampled_points.append(data['point'])
+            elif event == 'edge':
+                tree_edges[data['tree']].append((data['parent'], data['child']))
+        self.add_callback(record)
+        try:
+            path = self.plan(start, goal, cost_map, weights, time_budget=time_budget)
+        finally:
+            self.remove_callback(record)
+        return path, sampled_points, tree_edges['start'], tree_edges['goal']
+
     def _steer(self, from_pt, to_pt):
-        direction = np.array(to_pt) - np.array(from_pt)
-        dist = np.linalg.norm(direction)
+        dx, dy = to_pt[0] - from_pt[0], to_pt[1] - from_pt[1]
+        dist = math.hypot(dx, dy)
         if dist < self.step_size:
-            return tuple(to_pt)
-        return tuple(np.array(from_pt) + direction / dist * self.step_size)
-
-    def _trace_path(self, parents, node):
-        path = [node]
-        while parents[node] is not None:
-            node = parents[node]
-            path.append(node)
-        return path[::-1]
\ No newline at end of file
+            return (float(to_pt[0]), float(to_pt[1]))
+        return (float(from_pt[0] + dx / dist * self.step_size), float(from_pt[1] + dy / dist * self.step_size))
@@ -1,3 +1,10 @@
-from .planner import Planner
-from .sampling import UniformSampling, HybridSampling, StaticSampling, LearningBasedSampling
-from .utils import collision_check, calculate_path_cost, heuristic, nearest_neighbor
+from .planner import Planner, PlanningTimeout
+from .sampling import UniformSampling, HybridSampling, StaticSampling, InformedSampling, GuidedSampling, LearningBasedSampling
+from .utils import collision_check, collision_check_batch, calculate_path_cost, path_costs, edge_costs, heuristic, nearest_neighbor
+from .spatial import SpatialIndex, EdgeIndex, radius_pairs
+from .tree import Tree
+from .costmap import (clearance_field, cost_pyramid, free_cells, invalidate_cost_map, update_cost_map, pinned,
+                      quantize, save_cost_map, load_cost_map)
+from .search import Graph, astar, dijkstra, bidirectional_astar
+from .parallel import plan_many, plan_race
+from .backend import get_backend, set_backend, available_backends
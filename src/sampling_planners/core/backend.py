@@ -0,0 +1,95 @@
+# core/backend.py
+"""
+Kernels for the planners' innermost loops, with an optional Numba backend.
+
+Under the 'numpy' backend the callers run their vectorized NumPy code.
+When numba is installed the 'numba' backend is the default: the scalar
+loops below are compiled on first use and replace that code. Currently
+this is the last stage of the batch collision check, which walks the
+cells the clearance and cost pyramid tests left undecided. Both paths evaluate every test with the same
+floating-point operations in the same order, so they return identical
+results. set_backend() switches between them, e.g. to benchmark both.
+
+Example
+-------
+    from sampling_planners.core import backend
+    print(backend.available_backends())  # ['numpy', 'numba']
+    backend.set_backend('numpy')
+"""
+import importlib.util
+import numpy as np
+
+_backend = None
+_compiled = {}
+
+def available_backends():
+    """
+    Names of the backends that can be selected on this installation.
+    """
+    names = ['numpy']
+    if importlib.util.find_spec('numba') is not None:
+        names.append('numba')
+    return names
+
+def get_backend():
+    """
+    Name of the active backend: 'numba' if installed, else 'numpy',
+    unless set_backend() chose otherwise.
+    """
+    global _backend
+    if _backend is None:
+        _backend = available_backends()[-1]
+    return _backend
+
+def set_backend(name):
+    """
+    Selects the backend used by every planner in this process.
+    """
+    global _backend
+    if name not in available_backends():
+        raise ValueError("backend {!r} is not available; choose from {}".format(name, available_backends()))
+    _backend = name
+
+def kernel(name):
+    """
+    The compiled kernel name under the numba backend, or None under the
+    numpy backend, in which case the caller runs its NumPy code.
+    """
+    if get_backend() != 'numba':
+        return None
+    fn = _compiled.get(name)
+    if fn is None:
+        import numba
+        fn = _compiled[name] = numba.njit(cache=True, nogil=True)(KERNELS[name])
+    return fn
+
+def _runs_blocked(segments, rows, first, last, cost_map, raw, step, blocked):
+    # Scalar final stage of collision_check_batch: walks points first[j]
+    # to last[j] of np.linspace(p0, p1, int(dist / step) + 1) of segment
+    # rows[j], as core.utils._rasterize computes them, and marks
+    # blocked[rows[j]] at the first one outside the map or at cost >= raw.
+    h, w = cost_map.shape
+    for j in range(rows.shape[0]):
+        s = rows[j]
+        if blocked[s]:
+            continue
+        x0, y0 = segments[s, 0, 0], segments[s, 0, 1]
+        x1, y1 = segments[s, 1, 0], segments[s, 1, 1]
+        dx, dy = x1 - x0, y1 - y0
+        num = int(np.hypot(dx, dy) / step) + 1
+        sx, sy = dx / max(num - 1, 1), dy / max(num - 1, 1)
+        for i in range(first[j], last[j] + 1):
+            if i == num - 1 and num > 1:
+                px, py = x1, y1
+            else:
+                px, py = i * sx + x0, i * sy + y0
+            r, c = int(np.rint(px)), int(np.rint(py))
+            if r < 0 or c < 0 or r >= h or c >= w or cost_map[r, c] >= raw:
+                blocked[s] = True
+                break
+    return blocked
+
+# Scalar loops by name; kernel() compiles them.
+KERNELS = {
+    'runs_blocked': _runs_blocked,
+}
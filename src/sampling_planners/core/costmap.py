@@ -0,0 +1,442 @@
+# core/costmap.py
+import weakref
+import zlib
+from contextlib import contextmanager
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+_derived = {}
+# Number of active pinned() blocks per cost map id.
+_pins = {}
+
+def derived(cost_map):
+    """
+    Returns the dict of structures derived from cost_map.
+    Entries are shared by everything that plans on the same array and are
+    dropped when the array is garbage collected. Access costs O(1): the
+    entries are only checked against the map's contents on entering
+    pinned(), which planners do once per plan() or replan(). Code that
+    edits a map in place and reads derived structures outside a planner
+    should call update_cost_map() or invalidate_cost_map(), or read them
+    within pinned().
+    """
+    return _entry(cost_map)[1]
+
+@contextmanager
+def pinned(cost_map):
+    """
+    Checks the structures derived from cost_map against its contents, and
+    drops them if it changed since they were built. The check fingerprints
+    the whole map once, on entering the outermost block for cost_map;
+    read-only maps (e.g. memory-mapped with mode 'r') are trusted. cost_map
+    must not be modified within the block.
+    """
+    key = id(cost_map)
+    if not _pins.get(key):
+        _validate(cost_map, _entry(cost_map))
+    _pins[key] = _pins.get(key, 0) + 1
+    try:
+        yield cost_map
+    finally:
+        _pins[key] -= 1
+        if not _pins[key]:
+            del _pins[key]
+
+def _entry(cost_map):
+    # [weakref to cost_map, derived dict, fingerprint of the contents the
+    # dict was derived from (None until checked)].
+    key = id(cost_map)
+    entry = _derived.get(key)
+    if entry is None or entry[0]() is not cost_map:
+        def evict(ref, key=key):
+            if _derived.get(key, (None,))[0] is ref:
+                del _derived[key]
+        entry = [weakref.ref(cost_map, evict), {}, None]
+        _derived[key] = entry
+    return entry
+
+def _validate(cost_map, entry):
+    # Drops the derived entries if cost_map changed since they were built.
+    if _read_only(cost_map):
+        return
+    fingerprint = _fingerprint(cost_map)
+    if entry[2] != fingerprint:
+        if entry[2] is not None:
+            entry[1].clear()
+        entry[2] = fingerprint
+
+def _fingerprint(cost_map):
+    return (cost_map.shape, cost_map.dtype.str, zlib.crc32(np.ascontiguousarray(cost_map)))
+
+def _read_only(cost_map):
+    # True if neither cost_map nor any array it is a view of is writeable.
+    a = cost_map
+    while isinstance(a, np.ndarray):
+        if a.flags.writeable:
+            return False
+        a = a.base
+    return True
+
+def invalidate_cost_map(cost_map):
+    """
+    Drops every structure derived from cost_map. Planners detect changes
+    to writeable maps anyway; this is needed for read-only maps whose
+    memory changed under them (e.g. a file memory-mapped by another
+    process), and before reading derived structures of an edited map
+    outside a planner.
+    """
+    entry = _derived.get(id(cost_map))
+    if entry is not None and entry[0]() is cost_map:
+        entry[1].clear()
+        entry[2] = None
+
+def update_cost_map(cost_map, regions):
+    """
+    Brings the structures derived from cost_map up to date after it was
+    modified in place within regions. Unlike invalidate_cost_map(), the
+    work is proportional to the size of the regions rather than the map.
+    Parameters
+    ----------
+    cost_map : np.ndarray
+        2D cost map, already modified.
+    regions : list of tuple
+        (row0, col0, row1, col1) cell ranges that changed; row1 and col1
+        are exclusive.
+    Returns
+    -------
+    list of tuple
+        The regions clipped to the map, empty ones dropped.
+    """
+    regions = clip_regions(cost_map, regions)
+    # The map already changed: the entries are taken as derived from its
+    # new contents, which the updates below make true, rather than
+    # dropped by pinned() as stale.
+    entry = _entry(cost_map)
+    if not _read_only(cost_map):
+        entry[2] = _fingerprint(cost_map)
+    fields = entry[1]
+    # The pyramid goes first: other entries are derived from it.
+    for key in sorted(fields, key=lambda key: key != 'pyramid'):
+        if key == 'token' or not regions:
+            continue
+        value = fields[key]
+        if key == 'pyramid':
+            for region in regions:
+                _update_pyramid(value, region)
+        elif isinstance(key, tuple) and key[0] == 'free':
+            fields[key] = _update_free(cost_map, value, key[1], regions)
+        elif isinstance(key, tuple) and key[0] == 'clearance':
+            if isinstance(value, TiledClearance):
+                for region in regions:
+                    value.invalidate(region)
+            else:
+                _update_clearance(cost_map, value, key[1], regions, fields)
+        elif isinstance(key, tuple) and key[0] == 'clearance_capped':
+            continue
+        else:
+            # Anything else is rebuilt on demand; the coarse collision
+            # masks register their own update in core.utils.
+            updater = _updaters.get(key[0] if isinstance(key, tuple) else key)
+            if updater is None:
+                del fields[key]
+            else:
+                for region in regions:
+                    updater(cost_map, key, value, region)
+    if regions:
+        fields['token'] = object()
+    return regions
+
+def clip_regions(cost_map, regions):
+    """
+    regions as (row0, col0, row1, col1) tuples of ints clipped to the
+    map, without empty ones.
+    """
+    h, w = cost_map.shape[:2]
+    clipped = []
+    for r0, c0, r1, c1 in regions:
+        r0, c0 = max(int(r0), 0), max(int(c0), 0)
+        r1, c1 = min(int(r1), h), min(int(c1), w)
+        if r0 < r1 and c0 < c1:
+            clipped.append((r0, c0, r1, c1))
+    return clipped
+
+def register_updater(name, updater):
+    """
+    Registers updater(cost_map, key, value, region) to update in place the
+    derived entries stored under name (or (name, ...) tuple keys) when
+    update_cost_map() is called. Entries without an updater are dropped.
+    """
+    _updaters[name] = updater
+
+_updaters = {}
+
+def cache_token(cost_map):
+    """
+    Returns an object that stays the same until cost_map is invalidated or
+    garbage collected. Caches kept outside this module store the token and
+    compare it with `is` to detect stale entries.
+    """
+    return derived(cost_map).setdefault('token', object())
+
+def free_cells(cost_map, threshold=0.99):
+    """
+    Cells with cost below threshold.
+    Returns
+    -------
+    np.ndarray
+        (K,) flat (row * width + column) indices in increasing order,
+        cached per threshold; int32 unless the map has 2**31 cells or
+        more. np.divmod(cells, width) gives rows and columns.
+    """
+    fields = derived(cost_map)
+    key = ('free', threshold)
+    if key not in fields:
+        h, w = cost_map.shape
+        raw = raw_threshold(cost_map, threshold)
+        dtype = _index_dtype(cost_map)
+        # Strips of rows keep the int64 indices np.flatnonzero() returns
+        # small.
+        strip = max(_STRIP_CELLS // max(w, 1), 1)
+        fields[key] = np.concatenate(
+            [(np.flatnonzero(np.asarray(cost_map[r:r + strip]) < raw) + r * w).astype(dtype)
+             for r in range(0, h, strip)] + [np.empty(0, dtype=dtype)])
+    return fields[key]
+
+def clearance_field(cost_map, threshold=0.99):
+    """
+    Euclidean distance, in cells, from every cell to the nearest obstacle.
+    Parameters
+    ----------
+    cost_map : np.ndarray
+        2D cost map.
+    threshold : float
+        Cells with cost >= threshold are obstacles.
+    Returns
+    -------
+    np.ndarray
+        uint8 clearance field: distances floored to whole cells and capped
+        at 255, 0 on obstacles. Cells outside the map count as obstacles,
+        so every cell closer to (i, j) than clearance[i, j] is inside the
+        map and free. For memory-mapped maps this is a TiledClearance,
+        computed tile by tile as it is indexed.
+    """
+    fields = derived(cost_map)
+    key = ('clearance', threshold)
+    if key not in fields:
+        if isinstance(cost_map, np.memmap):
+            fields[key] = TiledClearance(cost_map, threshold)
+        else:
+            fields[key] = _clearance(cost_map, raw_threshold(cost_map, threshold))
+    return fields[key]
+
+def _clearance(cost_map, raw):
+    # The distance transform runs on strips of rows grown by a halo of
+    # _CLEARANCE_MAX + 1 rows, beyond which obstacles cannot lower a
+    # capped value, so its float64 temporaries stay strip-sized.
+    h, w = cost_map.shape
+    halo = _CLEARANCE_MAX + 1
+    strip = max(_STRIP_CELLS // max(w, 1), halo)
+    field = np.empty((h, w), dtype=np.uint8)
+    for r0 in range(0, h, strip):
+        r1 = min(r0 + strip, h)
+        R0, R1 = max(r0 - halo, 0), min(r1 + halo, h)
+        free = np.pad(~(np.asarray(cost_map[R0:R1]) >= raw), 1, constant_values=False)
+        dist = distance_transform_edt(free)[1 + r0 - R0:1 + r1 - R0, 1:-1]
+        field[r0:r1] = np.minimum(np.floor(dist), _CLEARANCE_MAX)
+    return field
+
+def _index_dtype(cost_map):
+    return np.int32 if cost_map.size < 2 ** 31 else np.int64
+
+# Largest clearance an in-memory field stores, and the number of cells
+# per strip in which fields are built.
+_CLEARANCE_MAX = 255
+_STRIP_CELLS = 1 << 22
+
+class TiledClearance:
+    """
+    Lazily computed clearance field of a memory-mapped cost map.
+
+    Indexing with integer arrays, as field[rows, cols], computes the tiles
+    those cells fall in and reads only those tiles (plus a halo) of the
+    map. Each tile's distance transform sees obstacles only within the
+    halo, and values are floored to whole cells and stored as uint8, so
+    they are lower bounds of the exact clearance (at most halo + 1).
+    """
+    def __init__(self, cost_map, threshold=0.99, tile=256, halo=32):
+        self.cost_map = cost_map
+        self.shape = cost_map.shape
+        self.tile = tile
+        self.halo = halo
+        self._raw = raw_threshold(cost_map, threshold)
+        self._values = np.zeros(self.shape, dtype=np.uint8)
+        self._done = np.zeros((-(-self.shape[0] // tile), -(-self.shape[1] // tile)), dtype=bool)
+
+    def __getitem__(self, index):
+        rows, cols = (np.asarray(i) for i in index)
+        tiles = np.unique((rows // self.tile) * self._done.shape[1] + cols // self.tile)
+        for ti, tj in zip(*np.divmod(tiles[~self._done.ravel()[tiles]], self._done.shape[1])):
+            self._compute(ti, tj)
+        return self._values[rows, cols]
+
+    def invalidate(self, region):
+        """
+        Marks the tiles whose values depend on the cells in region (row0,
+        col0, row1, col1) for recomputation.
+        """
+        r0, c0, r1, c1 = region
+        t = self.tile
+        ti = slice(max(r0 - self.halo, 0) // t, (r1 - 1 + self.halo) // t + 1)
+        tj = slice(max(c0 - self.halo, 0) // t, (c1 - 1 + self.halo) // t + 1)
+        self._done[ti, tj] = False
+
+    def _compute(self, ti, tj):
+        h, w = self.shape
+        r0, c0 = ti * self.tile, tj * self.tile
+        r1, c1 = min(r0 + self.tile, h), min(c0 + self.tile, w)
+        R0, C0 = max(r0 - self.halo, 0), max(c0 - self.halo, 0)
+        R1, C1 = min(r1 + self.halo, h), min(c1 + self.halo, w)
+        # Cells beyond the window count as obstacles, which can only
+        # lower the distances.
+        free = np.pad(~(np.asarray(self.cost_map[R0:R1, C0:C1]) >= self._raw), 1, constant_values=False)
+        dist = distance_transform_edt(free)[1 + r0 - R0:1 + r1 - R0, 1 + c0 - C0:1 + c1 - C0]
+        self._values[r0:r1, c0:c1] = np.minimum(np.floor(dist), 255)
+        self._done[ti, tj] = True
+
+def cost_pyramid(cost_map):
+    """
+    Max- and min-pooled copies of cost_map at halving resolutions.
+    Returns
+    -------
+    list of tuple
+        levels[k] = (max_pool, min_pool), whose cell (i, j) covers the
+        2**k x 2**k block of cells starting at (i * 2**k, j * 2**k). Cells
+        outside the map count as the highest value of its dtype (inf for
+        float maps). Levels keep the map's dtype; levels[0] is
+        (cost_map, cost_map) and the last level is a single cell.
+    """
+    fields = derived(cost_map)
+    if 'pyramid' not in fields:
+        levels = [(cost_map, cost_map)]
+        high, low = cost_map, cost_map
+        while max(high.shape) > 1:
+            high, low = _pool(high, np.maximum), _pool(low, np.minimum)
+            levels.append((high, low))
+        fields['pyramid'] = levels
+    return fields['pyramid']
+
+def _pool(a, op, strip=1024):
+    # 2x2 pooling with op, padding odd edges with the dtype's highest
+    # value; memory-mapped maps are read one strip of rows at a time.
+    h, w = a.shape
+    fill = np.inf if np.issubdtype(a.dtype, np.floating) else np.iinfo(a.dtype).max
+    out = np.empty(((h + 1) // 2, (w + 1) // 2), dtype=a.dtype)
+    for r in range(0, h, strip):
+        block = np.asarray(a[r:r + strip])
+        block = np.pad(block, ((0, len(block) % 2), (0, w % 2)), constant_values=fill)
+        out[r // 2:r // 2 + len(block) // 2] = op.reduce(op.reduce(
+            block.reshape(len(block) // 2, 2, block.shape[1] // 2, 2), axis=3), axis=1)
+    return out
+
+def _update_pyramid(levels, region):
+    # Re-pools the blocks covering region at every level, from fine to
+    # coarse. Block rows [a, b) of level k pool rows [2a, 2b) of level k - 1.
+    r0, c0, r1, c1 = region
+    for k in range(1, len(levels)):
+        r0, c0, r1, c1 = r0 // 2, c0 // 2, (r1 + 1) // 2, (c1 + 1) // 2
+        finer = levels[k - 1]
+        for i, op in ((0, np.maximum), (1, np.minimum)):
+            levels[k][i][r0:r1, c0:c1] = _pool(finer[i][2 * r0:2 * r1, 2 * c0:2 * c1], op)
+
+def _update_free(cost_map, cells, threshold, regions):
+    # Splices the free cells of each region into the sorted flat indices.
+    w = cost_map.shape[1]
+    for r0, c0, r1, c1 in regions:
+        lo, hi = np.searchsorted(cells, [r0 * w, r1 * w])
+        col = cells[lo:hi] % w
+        keep = (col < c0) | (col >= c1)
+        rows, cols = np.nonzero(np.asarray(cost_map[r0:r1, c0:c1]) < raw_threshold(cost_map, threshold))
+        new = ((rows + r0) * w + cols + c0).astype(cells.dtype)
+        merged = np.sort(np.concatenate([cells[lo:hi][keep], new]))
+        cells = np.concatenate([cells[:lo], merged, cells[hi:]])
+    return cells
+
+# Once a full clearance field has been updated it holds
+# min(clearance, _CLEARANCE_CAP), which bounds how far a change reaches.
+_CLEARANCE_CAP = 64
+
+def _update_clearance(cost_map, field, threshold, regions, fields):
+    cap = _CLEARANCE_CAP
+    if not fields.get(('clearance_capped', threshold)):
+        np.minimum(field, cap, out=field)
+        fields[('clearance_capped', threshold)] = True
+    h, w = cost_map.shape
+    raw = raw_threshold(cost_map, threshold)
+    for r0, c0, r1, c1 in regions:
+        # Cells within cap of the region may change. Their capped value
+        # only depends on obstacles within cap of them, so a window grown
+        # by another cap (beyond which counts as obstacle) is enough.
+        W0, V0, W1, V1 = max(r0 - cap, 0), max(c0 - cap, 0), min(r1 + cap, h), min(c1 + cap, w)
+        R0, C0, R1, C1 = max(W0 - cap, 0), max(V0 - cap, 0), min(W1 + cap, h), min(V1 + cap, w)
+        free = np.pad(~(np.asarray(cost_map[R0:R1, C0:C1]) >= raw), 1, constant_values=False)
+        dist = distance_transform_edt(free)[1:-1, 1:-1]
+        field[W0:W1, V0:V1] = np.minimum(np.floor(dist[W0 - R0:W1 - R0, V0 - C0:V1 - C0]), cap)
+
+def is_quantized(cost_map):
+    """
+    True for uint8 cost maps, whose value q stands for the cost q / 255.
+    """
+    return cost_map.dtype == np.uint8
+
+def raw_threshold(cost_map, threshold):
+    """
+    threshold in cost_map's own units: a cell's cost is >= threshold
+    exactly when its stored value is >= the returned value.
+    """
+    if is_quantized(cost_map):
+        return int(np.ceil(threshold * _QUANTIZED_MAX - 1e-9))
+    return threshold
+
+def as_costs(cost_map, values):
+    """
+    Converts values read from cost_map to costs (floats in [0, 1] for
+    quantized maps; unchanged otherwise).
+    """
+    if is_quantized(cost_map):
+        return np.asarray(values, dtype=float) / _QUANTIZED_MAX
+    return values
+
+def cell_costs(cost_map, rows, cols):
+    """
+    Costs of the cells (rows, cols) of cost_map.
+    """
+    return as_costs(cost_map, cost_map[rows, cols])
+
+def quantize(cost_map, threshold=0.99):
+    """
+    uint8 copy of a float cost map storing round(cost * 255), clipped to
+    [0, 255]. Values are nudged across threshold where rounding would
+    move them, so that cells are obstacles exactly when they were before.
+    """
+    cost_map = np.asarray(cost_map, dtype=float)
+    q = np.rint(np.clip(cost_map, 0.0, 1.0) * _QUANTIZED_MAX)
+    raw = np.ceil(threshold * _QUANTIZED_MAX - 1e-9)
+    obstacle = cost_map >= threshold
+    q[obstacle] = np.maximum(q[obstacle], raw)
+    q[~obstacle] = np.minimum(q[~obstacle], raw - 1)
+    return q.astype(np.uint8)
+
+def save_cost_map(path, cost_map):
+    """
+    Writes cost_map as a .npy file that load_cost_map() can memory-map.
+    """
+    np.save(path, np.asarray(cost_map))
+
+def load_cost_map(path, mmap_mode='r'):
+    """
+    Memory-maps a cost map written by save_cost_map(); processes that map
+    the same file share its pages. mmap_mode=None reads it into memory.
+    """
+    return np.load(path, mmap_mode=mmap_mode)
+
+_QUANTIZED_MAX = 255
@@ -0,0 +1,88 @@
+# core/instrument.py
+"""
+Call counters and timers for the planners' hot paths.
+
+Collision checks, nearest-neighbor queries, sampling and graph searches
+are wrapped with timed(). Instrumentation is off by default, in which
+case a wrapped call costs one global lookup on top of the call itself.
+
+Example
+-------
+    from sampling_planners.core import instrument
+    with instrument.instrumented() as stats:
+        planner.plan(start, goal, cost_map, weights)
+    print(stats['collision_check'])  # {'calls': ..., 'seconds': ...}
+"""
+import functools
+import time
+from contextlib import contextmanager
+
+_enabled = False
+_calls = {}
+_seconds = {}
+
+def enable():
+    """Starts counting calls and time."""
+    global _enabled
+    _enabled = True
+
+def disable():
+    """Stops counting; collected numbers are kept until reset()."""
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """Clears every counter and timer."""
+    _calls.clear()
+    _seconds.clear()
+
+def report():
+    """
+    Returns {name: {'calls': int, 'seconds': float}} for every name seen.
+    """
+    return {name: {'calls': _calls[name], 'seconds': _seconds[name]} for name in sorted(_calls)}
+
+def record(name, seconds=0.0, calls=1):
+    """Adds calls and seconds to name."""
+    _calls[name] = _calls.get(name, 0) + calls
+    _seconds[name] = _seconds.get(name, 0.0) + seconds
+
+@contextmanager
+def instrumented():
+    """
+    Enables instrumentation for a block and yields a dict that is filled
+    with the block's report() when it exits.
+    """
+    previous = _enabled
+    saved_calls, saved_seconds = dict(_calls), dict(_seconds)
+    reset()
+    enable()
+    result = {}
+    try:
+        yield result
+    finally:
+        result.update(report())
+        if not previous:
+            disable()
+        for name, calls in saved_calls.items():
+            record(name, saved_seconds[name], calls)
+
+def timed(name):
+    """
+    Decorator counting calls to the function, and their wall time, under name.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - t)
+        return wrapper
+    return decorator
@@ -0,0 +1,249 @@
+# core/parallel.py
+import os
+import mmap
+import multiprocessing
+from contextlib import contextmanager
+import numpy as np
+from .costmap import derived, free_cells
+from .utils import prepare_cost_map
+from .planner import PlanningTimeout
+from .backend import get_backend, set_backend
+
+# Per-process state set up by _init_worker.
+_worker = {}
+
+def plan_many(planner, queries, cost_map, weights, workers=None, seed=None):
+    """
+    Plans a batch of queries on one cost map with a pool of processes.
+    The cost map and the structures derived from it (clearance field,
+    free-cell index, cost pyramid, coarse collision masks) are computed
+    once and placed in shared memory; a cost map memory-mapped from a file
+    (load_cost_map) is instead mapped by every worker, so they share its
+    pages, and only its pyramid and coarse masks are shared. The planner is sent once
+    per worker rather than once per query.
+    Every query runs with numpy's global RNG seeded from its own child of
+    SeedSequence(seed), so results depend only on seed and the query
+    order, not on workers or scheduling.
+    Parameters
+    ----------
+    planner : Planner
+        Planner to run; it must be picklable. A PRM with a roadmap loaded
+        from a directory (Roadmap.load) shares it through the page cache.
+    queries : list of tuple
+        (start, goal) pairs.
+    cost_map : np.ndarray
+        2D cost map shared by all queries.
+    weights : dict
+        {'length': float, 'cost': float}
+    workers : int, optional
+        Number of processes; defaults to os.cpu_count(). With 1, queries
+        run in this process. More than one needs Python 3.8 or later
+        (multiprocessing.shared_memory).
+    seed : int, optional
+        Seed for the per-query RNG streams.
+    Returns
+    -------
+    list
+        planner.plan() result for each query, in order.
+    """
+    queries = list(queries)
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(len(queries))]
+    tasks = [(i, start, goal, s) for i, ((start, goal), s) in enumerate(zip(queries, seeds))]
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+    if workers == 1:
+        _worker.update(planner=planner, cost_map=cost_map, weights=weights)
+        try:
+            return [_run_query(task)[1] for task in tasks]
+        finally:
+            _worker.clear()
+    with _pool(planner, cost_map, weights, workers) as pool:
+        chunksize = max(1, len(tasks) // (4 * workers))
+        results = dict(pool.imap_unordered(_run_query, tasks, chunksize))
+    return [results[i] for i in range(len(tasks))]
+
+def plan_race(planner, start, goal, cost_map, weights, instances=None, workers=None, seed=None, time_budget=None):
+    """
+    Runs independently seeded copies of planner on one query in a pool of
+    processes and returns the first path found. The others are then
+    cancelled: they stop at their next deadline check, as if their time
+    budget had run out. This trims the heavy tail of randomized planners
+    such as RRTConnect, whose time to solution varies a lot between seeds.
+    The cost map is shared as in plan_many().
+    Parameters
+    ----------
+    planner : Planner
+        Planner to run; it must be picklable.
+    start, goal : tuple
+        Query endpoints.
+    cost_map : np.ndarray
+        2D cost map.
+    weights : dict
+        {'length': float, 'cost': float}
+    instances : int, optional
+        Number of copies to run; defaults to the number of workers.
+        Copies beyond the number of workers start as earlier ones fail.
+    workers : int, optional
+        Number of processes; defaults to os.cpu_count(). With 1, copies
+        run one after another in this process.
+    seed : int, optional
+        Seed for the copies' RNG streams; copy i uses the same stream as
+        query i of plan_many(). Which copy wins depends on timing.
+    time_budget : float, optional
+        Budget of every copy, as for plan().
+    Returns
+    -------
+    list of tuple or None
+        The first path found, or None if every copy failed.
+    Raises
+    ------
+    PlanningTimeout
+        If no copy found a path and at least one ran out of time_budget.
+    """
+    workers = workers or os.cpu_count() or 1
+    instances = instances or workers
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(instances)]
+    tasks = [(i, start, goal, s, time_budget) for i, s in enumerate(seeds)]
+    workers = min(workers, instances)
+    timed_out = False
+    if workers == 1:
+        _worker.update(planner=planner, cost_map=cost_map, weights=weights)
+        try:
+            for task in tasks:
+                path, status = _race_query(task)
+                timed_out |= status == 'timeout'
+                if path is not None:
+                    return path
+        finally:
+            _worker.clear()
+    else:
+        cancel = multiprocessing.Event()
+        with _pool(planner, cost_map, weights, workers, cancel) as pool:
+            for path, status in pool.imap_unordered(_race_query, tasks):
+                timed_out |= status == 'timeout'
+                if path is not None:
+                    # Let the other copies notice the cancellation and
+                    # return, rather than killing them mid-step.
+                    cancel.set()
+                    pool.close()
+                    pool.join()
+                    return path
+    if timed_out:
+        raise PlanningTimeout("no path found within the time budget")
+    return None
+
+@contextmanager
+def _pool(planner, cost_map, weights, workers, cancel=None):
+    # Process pool whose workers hold planner, weights and the shared
+    # cost map (see plan_many()).
+    source = _map_file(cost_map)
+    # Build the shared structures before exporting them. The pyramid and
+    # the coarse collision masks read the whole map, so they are built
+    # here even for memory-mapped maps rather than once per worker.
+    prepare_cost_map(cost_map)
+    if source is None:
+        free_cells(cost_map)
+    arrays, entries = [], []
+    if source is None:
+        arrays.append(np.asarray(cost_map))
+        entries.append((None, 0))
+    for key, value in derived(cost_map).items():
+        found = []
+        skeleton = _skeleton(value, cost_map, found)
+        if skeleton is not False:
+            entries.append((key, _offset(skeleton, len(arrays))))
+            arrays.extend(found)
+    # multiprocessing.shared_memory is new in Python 3.8; only pools
+    # need it.
+    from multiprocessing import shared_memory
+    blocks, specs = [], []
+    try:
+        for array in arrays:
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+            specs.append((shm.name, array.shape, array.dtype.str))
+        initargs = (planner, weights, (specs, entries), source, cancel, get_backend())
+        with multiprocessing.Pool(workers, _init_worker, initargs) as pool:
+            yield pool
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+def _skeleton(value, cost_map, arrays):
+    # A derived entry with each array in it replaced by its position in
+    # arrays, where it is appended, and the cost map itself by None (as
+    # in the pyramid's first level). False if the entry holds anything
+    # else, such as a TiledClearance, and cannot be shared.
+    if value is cost_map:
+        return None
+    if isinstance(value, np.ndarray):
+        arrays.append(value)
+        return len(arrays) - 1
+    if isinstance(value, (list, tuple)) and value:
+        items = [_skeleton(item, cost_map, arrays) for item in value]
+        if all(item is not False for item in items):
+            return type(value)(items)
+    return False
+
+def _offset(skeleton, n):
+    if skeleton is None:
+        return None
+    if isinstance(skeleton, int):
+        return skeleton + n
+    return type(skeleton)(_offset(item, n) for item in skeleton)
+
+def _rebuild(skeleton, arrays, cost_map):
+    if skeleton is None:
+        return cost_map
+    if isinstance(skeleton, int):
+        return arrays[skeleton]
+    return type(skeleton)(_rebuild(item, arrays, cost_map) for item in skeleton)
+
+def _map_file(cost_map):
+    # (filename, dtype, shape, offset, order) of a cost map memory-mapped
+    # from a whole file, which workers map themselves instead of copying.
+    if isinstance(cost_map, np.memmap) and isinstance(cost_map.base, mmap.mmap) and cost_map.filename:
+        order = 'F' if cost_map.flags.f_contiguous and not cost_map.flags.c_contiguous else 'C'
+        return (cost_map.filename, cost_map.dtype.str, cost_map.shape, cost_map.offset, order)
+    return None
+
+def _init_worker(planner, weights, specs, source=None, cancel=None, backend=None):
+    if backend is not None:
+        # Spawned workers do not inherit set_backend().
+        set_backend(backend)
+    from multiprocessing import shared_memory
+    specs, entries = specs
+    blocks, arrays = [], []
+    for name, shape, dtype in specs:
+        # Pool workers share the parent's resource tracker, which already
+        # tracks the block, so registering it again on attach is a no-op.
+        shm = shared_memory.SharedMemory(name=name)
+        blocks.append(shm)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+        array.flags.writeable = False
+        arrays.append(array)
+    entries = dict(entries)
+    if source is None:
+        cost_map = arrays[entries.pop(None)]
+    else:
+        filename, dtype, shape, offset, order = source
+        cost_map = np.memmap(filename, np.dtype(dtype), 'r', offset, shape, order)
+    derived(cost_map).update((key, _rebuild(skeleton, arrays, cost_map)) for key, skeleton in entries.items())
+    planner._cancel = cancel
+    _worker.update(planner=planner, cost_map=cost_map, weights=weights, blocks=blocks)
+
+def _run_query(task):
+    i, start, goal, seed = task
+    np.random.seed(seed)
+    return i, _worker['planner'].plan(start, goal, _worker['cost_map'], _worker['weights'])
+
+def _race_query(task):
+    i, start, goal, seed, time_budget = task
+    np.random.seed(seed)
+    planner = _worker['planner']
+    try:
+        path = planner.plan(start, goal, _worker['cost_map'], _worker['weights'], time_budget=time_budget)
+    except PlanningTimeout:
+        path = None
+    return path, planner.status
@@ -1,10 +1,121 @@
 # core/planner.py
+import time
+from .costmap import update_cost_map, pinned
+
+class PlanningTimeout(Exception):
+    """
+    Raised by plan() when its time budget runs out before any path is found.
+    """
+
 class Planner:
     """
     Abstract base class for planners.
+
+    plan() takes an optional time_budget in seconds. When it runs out the
+    planner returns the best path found so far, or raises PlanningTimeout
+    if there is none. status records how the last plan() ended: 'success',
+    'failure' (search exhausted without a path) or 'timeout', and stats
+    holds its node count and number of segments collision-checked.
+
+    Callbacks registered with add_callback() are called as
+    callback(event, data) while planning. Events and their data keys:
+    'sample' (point), 'edge' (tree, parent, child), 'batch' (samples),
+    'edges' (segments), 'roadmap' (roadmap) and 'solution' (path).
+    Planners emit the subset that applies to them.
+
+    Subclasses run plan() within core.costmap.pinned(cost_map), so that
+    the structures derived from the map are checked once per plan rather
+    than on every access. After plan(), the cost map may be modified in
+    place and replan() called with the changed regions; see replan().
     """
     def __init__(self, sampling_method):
         self.sampling_method = sampling_method
+        self.status = None
+        self.stats = {'nodes': 0, 'collision_checks': 0}
+        self.callbacks = []
+        self._deadline = None
+        # Event set by plan_race() to stop this copy once another one won.
+        self._cancel = None
+        # (start, goal, cost_map, weights) of the last plan(), and the
+        # search state subclasses keep for replan().
+        self._query = None
+        self._state = None
+
+    def __getstate__(self):
+        # Planners sent to other processes (plan_many) leave the last
+        # query and its search state behind.
+        state = dict(self.__dict__)
+        state['_query'] = state['_state'] = state['_cancel'] = None
+        return state
+
+    def plan(self, start, goal, cost_map, weights, time_budget=None):
+        raise NotImplementedError
+
+    def replan(self, regions, time_budget=None):
+        """
+        Plans the last query again after its cost map was modified in place.
+        The structures derived from the map are updated around regions only
+        (see update_cost_map()), and planners that keep their search state
+        repair it, rechecking only the nodes and edges the regions can
+        affect, instead of starting over.
+        Parameters
+        ----------
+        regions : list of tuple
+            (row0, col0, row1, col1) cell ranges that changed; row1 and
+            col1 are exclusive.
+        time_budget : float, optional
+            As for plan().
+        Returns
+        -------
+        list of tuple or None
+            As for plan().
+        """
+        if self._query is None:
+            raise RuntimeError("replan() needs a previous call to plan()")
+        cost_map = self._query[2]
+        regions = update_cost_map(cost_map, regions)
+        with pinned(cost_map):
+            return self._replan(regions, time_budget)
+
+    def _replan(self, regions, time_budget):
+        # Planners without reusable state plan from scratch.
+        start, goal, cost_map, weights = self._query
+        return self.plan(start, goal, cost_map, weights, time_budget=time_budget)
+
+    def add_callback(self, callback):
+        """
+        Registers callback(event, data) and returns it.
+        """
+        self.callbacks.append(callback)
+        return callback
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def _emit(self, event, **data):
+        # Hot loops check `if self.callbacks:` first so that nothing is
+        # built when no one is listening.
+        for callback in self.callbacks:
+            callback(event, data)
+
+    def _start(self, time_budget=None):
+        # Called at the top of plan().
+        self.status = None
+        self.stats = {'nodes': 0, 'collision_checks': 0}
+        self._deadline = None if time_budget is None else time.perf_counter() + time_budget
+
+    def _time_up(self):
+        if self._cancel is not None and self._cancel.is_set():
+            return True
+        return self._deadline is not None and time.perf_counter() >= self._deadline
 
-    def plan(self, start, goal, cost_map, weights):
-        raise NotImplementedError
\ No newline at end of file
+    def _finish(self, path):
+        # Called with plan()'s result; sets status and reports timeouts.
+        if path is not None:
+            self.status = 'success'
+        elif self._time_up():
+            self.status = 'timeout'
+            raise PlanningTimeout("no path found within the time budget")
+        else:
+            self.status = 'failure'
+        return path
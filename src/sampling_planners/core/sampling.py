@@ -1,37 +1,84 @@
 # core/sampling.py
 from os.path import dirname, join, abspath
 import numpy as np
-from scipy.ndimage import distance_transform_edt
-from sampling_planners.model.predictor import Predictor
+from .costmap import cache_token, free_cells, cost_pyramid, raw_threshold, as_costs
+from .search import Graph, astar
+from .instrument import timed
 
 class SamplingMethod:
     """Base class for sampling methods."""
     def sample(self, cost_map, start, goal):
         raise NotImplementedError
 
+    def sample_batch(self, cost_map, start, goal, n):
+        """
+        Draws n samples at once.
+        Returns
+        -------
+        np.ndarray
+            (n, 2) float array of samples.
+        """
+        return np.array([self.sample(cost_map, start, goal) for _ in range(n)], dtype=float).reshape(n, 2)
+
+def _free_batch(cost_map, n, threshold=0.99, max_rounds=100):
+    # n cells drawn uniformly from the cached free-cell index. Memory-mapped
+    # maps use rejection sampling instead, which reads only the drawn cells.
+    if isinstance(cost_map, np.memmap):
+        raw = raw_threshold(cost_map, threshold)
+        found, count = [], 0
+        for _ in range(max_rounds):
+            m = max(2 * (n - count), 64)
+            cells = np.column_stack([np.random.randint(0, cost_map.shape[0], m), np.random.randint(0, cost_map.shape[1], m)])
+            cells = cells[cost_map[cells[:, 0], cells[:, 1]] < raw][:n - count]
+            found.append(cells)
+            count += len(cells)
+            if count == n:
+                return np.concatenate(found).astype(float)
+        raise ValueError("cost map has too few free cells to sample")
+    cells = free_cells(cost_map, threshold)
+    if len(cells) == 0:
+        raise ValueError("cost map has no free cells")
+    return np.column_stack(np.divmod(cells[np.random.randint(len(cells), size=n)], cost_map.shape[1])).astype(float)
+
+def _goal_biased(batch, goal, goal_bias):
+    # Replaces a goal_bias fraction of the rows of batch with goal.
+    batch[np.random.rand(len(batch)) < goal_bias] = goal
+    return batch
+
 class UniformSampling(SamplingMethod):
-    """Uniform random sampling."""
+    """Uniform random sampling. Batches are drawn from free cells only."""
+    @timed('sample')
     def sample(self, cost_map, start, goal):
         h, w = cost_map.shape
         return (np.random.randint(0, h), np.random.randint(0, w))
 
+    @timed('sample_batch')
+    def sample_batch(self, cost_map, start, goal, n):
+        return _free_batch(cost_map, n)
+
 class HybridSampling(SamplingMethod):
     """Uniform + goal-biased sampling."""
     def __init__(self, goal_bias=0.1):
         self.goal_bias = goal_bias
 
+    @timed('sample')
     def sample(self, cost_map, start, goal):
         if np.random.rand() < self.goal_bias:
             return goal
         h, w = cost_map.shape
         return (np.random.randint(0, h), np.random.randint(0, w))
 
+    @timed('sample_batch')
+    def sample_batch(self, cost_map, start, goal, n):
+        return _goal_biased(_free_batch(cost_map, n), goal, self.goal_bias)
+
 class StaticSampling(SamplingMethod):
-    """Static, user-provided samples."""
-    def __init__(self):
-        self.points = []
+    """Static, user-provided samples, falling back to uniform sampling."""
+    def __init__(self, points=None):
+        self.points = [] if points is None else list(points)
         self.idx = 0
 
+    @timed('sample')
     def sample(self, cost_map, start, goal):
         if not self.points:
             h, w = cost_map.shape
@@ -40,24 +87,253 @@ class StaticSampling(SamplingMethod):
         self.idx = (self.idx + 1) % len(self.points)
         return pt
 
+    @timed('sample_batch')
+    def sample_batch(self, cost_map, start, goal, n):
+        if not self.points:
+            return _free_batch(cost_map, n)
+        order = (self.idx + np.arange(n)) % len(self.points)
+        self.idx = (self.idx + n) % len(self.points)
+        return np.asarray(self.points, dtype=float).reshape(-1, 2)[order]
+
+class InformedSampling(SamplingMethod):
+    """
+    Informed sampling for planners that improve a known solution.
+
+    While c_best is infinite, samples come from the wrapped sampler. Once
+    a path is known, set c_best to its length: samples are then drawn
+    uniformly from the prolate ellipse of points p with
+    |p - start| + |p - goal| < c_best, keeping those that fall on free
+    cells inside the map. Batches may then hold fewer than n samples when
+    little of the ellipse is free.
+
+    Parameters
+    ----------
+    sampling_method : SamplingMethod, optional
+        Sampler used until a solution exists. Defaults to UniformSampling.
+    max_rounds : int
+        Rounds of rejection against the map per batch.
+    """
+    def __init__(self, sampling_method=None, max_rounds=20):
+        self.sampling_method = UniformSampling() if sampling_method is None else sampling_method
+        self.max_rounds = max_rounds
+        self.c_best = float('inf')
+
+    def sample(self, cost_map, start, goal):
+        if not np.isfinite(self.c_best):
+            return self.sampling_method.sample(cost_map, start, goal)
+        batch = self.sample_batch(cost_map, start, goal, 1)
+        return tuple(batch[0]) if len(batch) else tuple(start)
+
+    def sample_batch(self, cost_map, start, goal, n):
+        if not np.isfinite(self.c_best):
+            return self.sampling_method.sample_batch(cost_map, start, goal, n)
+        return self._sample_ellipse(cost_map, start, goal, n)
+
+    @timed('sample_batch')
+    def _sample_ellipse(self, cost_map, start, goal, n):
+        start = np.asarray(start, dtype=float)
+        goal = np.asarray(goal, dtype=float)
+        c_min = np.hypot(*(goal - start))
+        c_best = max(self.c_best, c_min)
+        # Semi-axes of the ellipse, the major one along start -> goal.
+        a = c_best / 2.0
+        b = np.sqrt(c_best ** 2 - c_min ** 2) / 2.0
+        axis = (goal - start) / c_min if c_min > 0 else np.array([1.0, 0.0])
+        rotation = np.array([[axis[0], -axis[1]], [axis[1], axis[0]]])
+        center = (start + goal) / 2.0
+        found, count = [], 0
+        for _ in range(self.max_rounds):
+            m = 2 * (n - count)
+            # Uniform points in the unit disk, stretched and rotated.
+            r = np.sqrt(np.random.rand(m))
+            theta = np.random.uniform(0, 2 * np.pi, m)
+            pts = center + (np.column_stack([a * r * np.cos(theta), b * r * np.sin(theta)])) @ rotation.T
+            cells = np.rint(pts).astype(int)
+            inside = (cells >= 0).all(axis=1) & (cells < cost_map.shape).all(axis=1)
+            pts, cells = pts[inside], cells[inside]
+            pts = pts[cost_map[cells[:, 0], cells[:, 1]] < raw_threshold(cost_map, 0.99)][:n - count]
+            found.append(pts)
+            count += len(pts)
+            if count == n:
+                break
+        return np.concatenate(found) if found else np.empty((0, 2))
+
+class GuidedSampling(SamplingMethod):
+    """
+    Sampling biased toward a coarse guide path.
+
+    A path from start to goal is first planned on a coarse level of the
+    cost pyramid, with blocks of about max(map shape) / resolution cells;
+    a block is traversable if it contains a free cell. A guide_bias
+    fraction of the samples is then drawn within radius blocks of the
+    guide path and the rest come from the wrapped sampler. The guide is
+    planned once per (cost_map, start, goal).
+
+    Parameters
+    ----------
+    sampling_method : SamplingMethod, optional
+        Sampler for the unguided samples. Defaults to UniformSampling.
+    guide_bias : float
+        Fraction of samples drawn around the guide path.
+    resolution : int
+        Approximate number of blocks along the longer side of the map.
+    radius : float
+        Half-width of the sampled band around the path, in blocks.
+    """
+    def __init__(self, sampling_method=None, guide_bias=0.5, resolution=128, radius=1.0, max_rounds=20):
+        self.sampling_method = UniformSampling() if sampling_method is None else sampling_method
+        self.guide_bias = guide_bias
+        self.resolution = resolution
+        self.radius = radius
+        self.max_rounds = max_rounds
+        self._cache = None
+
+    def sample(self, cost_map, start, goal):
+        if np.random.rand() < self.guide_bias:
+            batch = self._sample_guide(cost_map, start, goal, 1)
+            if len(batch):
+                return (float(batch[0, 0]), float(batch[0, 1]))
+        return self.sampling_method.sample(cost_map, start, goal)
+
+    def sample_batch(self, cost_map, start, goal, n):
+        guided = self._sample_guide(cost_map, start, goal, np.random.binomial(n, self.guide_bias))
+        rest = self.sampling_method.sample_batch(cost_map, start, goal, n - len(guided))
+        return np.concatenate([guided, rest])
+
+    def guide(self, cost_map, start, goal):
+        """
+        The coarse guide path as (M, 2) map coordinates from start to goal,
+        empty if start and goal are not connected at the coarse level.
+        """
+        token = cache_token(cost_map)
+        query = (tuple(start), tuple(goal))
+        if self._cache is None or self._cache[0] is not token or self._cache[1] != query:
+            self._cache = (token, query) + self._plan_guide(cost_map, start, goal)
+        return self._cache[2]
+
+    def _plan_guide(self, cost_map, start, goal):
+        levels = cost_pyramid(cost_map)
+        k = min(max(int(np.ceil(np.log2(max(cost_map.shape) / self.resolution))), 0), len(levels) - 1)
+        bs = 2 ** k
+        low = levels[k][1]
+        h, w = low.shape
+        passable = low < raw_threshold(cost_map, 0.99)
+        low = as_costs(cost_map, low)
+        # 8-connected grid over passable blocks; stepping costs length
+        # times one plus the cheapest cell cost of the two blocks.
+        ids = np.arange(h * w).reshape(h, w)
+        src, dst, weights = [], [], []
+        for di, dj in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            a = ids[max(-di, 0):h - max(di, 0), max(-dj, 0):w - max(dj, 0)]
+            b = ids[max(di, 0):h + min(di, 0) or None, max(dj, 0):w + min(dj, 0) or None]
+            ok = passable.ravel()[a] & passable.ravel()[b]
+            a, b = a[ok], b[ok]
+            cost = np.hypot(di, dj) * bs * (1 + (low.ravel()[a] + low.ravel()[b]) / 2)
+            src += [a, b]
+            dst += [b, a]
+            weights += [cost, cost]
+        graph = Graph.from_edges(h * w, np.concatenate(src), np.concatenate(dst), np.concatenate(weights))
+        s = int(start[0]) // bs * w + int(start[1]) // bs
+        t = int(goal[0]) // bs * w + int(goal[1]) // bs
+        centers = (np.column_stack(np.divmod(np.arange(h * w), w)) + 0.5) * bs - 0.5
+        path, _ = astar(graph, s, t, np.hypot(*(centers - centers[t]).T))
+        if path is None:
+            return (np.empty((0, 2)), bs)
+        points = np.minimum(centers[path], np.array(cost_map.shape) - 1)
+        points[0], points[-1] = start, goal
+        return (points, bs)
+
+    @timed('sample_batch')
+    def _sample_guide(self, cost_map, start, goal, n):
+        # Points within radius blocks of random points on the guide path.
+        path = self.guide(cost_map, start, goal)
+        bs = self._cache[3]
+        if n == 0 or len(path) == 0:
+            return np.empty((0, 2))
+        found, count = [], 0
+        for _ in range(self.max_rounds):
+            m = 2 * (n - count)
+            if len(path) > 1:
+                seg = np.random.randint(len(path) - 1, size=m)
+                t = np.random.rand(m, 1)
+                pts = path[seg] + t * (path[seg + 1] - path[seg])
+            else:
+                pts = np.repeat(path, m, axis=0)
+            pts = pts + np.random.uniform(-self.radius * bs, self.radius * bs, (m, 2))
+            cells = np.rint(pts).astype(int)
+            inside = (cells >= 0).all(axis=1) & (cells < cost_map.shape).all(axis=1)
+            pts, cells = pts[inside], cells[inside]
+            pts = pts[cost_map[cells[:, 0], cells[:, 1]] < raw_threshold(cost_map, 0.99)][:n - count]
+            found.append(pts)
+            count += len(pts)
+            if count == n:
+                break
+        return np.concatenate(found)
+
 class LearningBasedSampling(SamplingMethod):
-    
-    def __init__(self, goal_bias=0.1, device='cuda'):
+    """
+    Sampling from the cells a UNet predicts to be on a good path.
+
+    Parameters
+    ----------
+    goal_bias : float
+        Fraction of samples placed on the goal.
+    device : str, optional
+        Torch device; defaults to 'cuda' if available, else 'cpu'.
+    model_path : str, optional
+        UNet checkpoint; defaults to the bundled model.
+    scale, threads : optional
+        CPU deployment options of Predictor: the model runs on maps
+        downscaled by scale, with threads intra-op threads.
+    """
+    def __init__(self, goal_bias=0.1, device=None, model_path=None, scale=1.0, threads=None):
+        # torch is only imported once a learning-based sampler is created.
+        try:
+            from ..model import Predictor
+        except ImportError as e:
+            raise ImportError("LearningBasedSampling requires torch; install sampling_planners[learning]") from e
         self.goal_bias = goal_bias
-        self.predictor = Predictor(join(dirname(dirname(abspath(__file__))),"model/best_model.pth"), device)
+        if model_path is None:
+            model_path = join(dirname(dirname(abspath(__file__))), "model/best_model.pth")
+        self.predictor = Predictor(model_path, device, scale=scale, threads=threads)
+        self._cache = None
         
+    @timed('sample')
     def sample(self, cost_map, start, goal):
         if np.random.rand() < self.goal_bias:
             return tuple(goal)
-        obstacle_map, start_map, goal_map = self._generate_feature_maps(cost_map, start, goal)
-        prob_map = self.predictor.predict(obstacle_map, start_map, goal_map)
-        sampled_point = self._sample_from_probability(prob_map, cost_map)
+        cells = self._high_probability_cells(cost_map, start, goal)
+        if len(cells) == 0:
+            return self._get_random_free_point(cost_map)
+        sampled_row, sampled_col = cells[np.random.randint(len(cells))]
+        return (sampled_row, sampled_col)
 
-        return sampled_point
+    @timed('sample_batch')
+    def sample_batch(self, cost_map, start, goal, n):
+        cells = self._high_probability_cells(cost_map, start, goal)
+        if len(cells) == 0:
+            batch = _free_batch(cost_map, n, threshold=0.9)
+        else:
+            batch = cells[np.random.randint(len(cells), size=n)].astype(float)
+        return _goal_biased(batch, goal, self.goal_bias)
+
+    def _high_probability_cells(self, cost_map, start, goal):
+        """
+        Free cells (cost < 0.9) with predicted probability > 0.1.
+        The UNet runs once per (cost_map, start, goal); the result is reused
+        until one of them changes or the cost map is invalidated.
+        """
+        token = cache_token(cost_map)
+        query = (tuple(start), tuple(goal))
+        if self._cache is None or self._cache[0] is not token or self._cache[1] != query:
+            obstacle_map, start_map, goal_map = self._generate_feature_maps(cost_map, start, goal)
+            prob_map = self.predictor.predict(obstacle_map, start_map, goal_map)
+            self._cache = (token, query, np.argwhere((prob_map > 0.1) & (cost_map < raw_threshold(cost_map, 0.9))))
+        return self._cache[2]
     
     def _generate_feature_maps(self, cost_map, start, goal):
         h, w = cost_map.shape
-        obstacle_map = (cost_map == 1).astype(np.float32)
+        obstacle_map = (cost_map == raw_threshold(cost_map, 1.0)).astype(np.float32)
         start_map = np.zeros_like(cost_map, dtype=np.float32)
         start_row, start_col = start
         start_map[start_row, start_col] = 1.0
@@ -67,38 +343,13 @@ class LearningBasedSampling(SamplingMethod):
         
         return obstacle_map, start_map, goal_map
 
-    def _sample_from_probability(self, prob_map, cost_map):
-        """
-        Sample from cells with probability > 0.5 with uniform distribution.
-        """
-        h, w = prob_map.shape
-
-        # Get all cells with probability > 0.5
-        high_prob_cells = np.argwhere(prob_map > 0.1)
-
-        # If no high probability cells, fall back
-        if len(high_prob_cells) == 0:
-            return self._get_random_free_point(cost_map)
-
-        max_attempts = 100
-        for attempt in range(max_attempts):
-            # Uniformly sample from high probability cells
-            sampled_idx = np.random.randint(0, len(high_prob_cells))
-            sampled_row, sampled_col = high_prob_cells[sampled_idx]
-
-            # Check if not obstacle
-            if cost_map[sampled_row, sampled_col] < 0.9:
-                return (sampled_row, sampled_col)
-
-        return self._get_random_free_point(cost_map)
-    
     def _get_random_free_point(self, cost_map):
         h, w = cost_map.shape
-        free_points = np.where(cost_map < 0.9) 
+        free_points = free_cells(cost_map, 0.9)
         
-        if len(free_points[0]) > 0:
-            idx = np.random.randint(len(free_points[0]))
-            return (free_points[0][idx], free_points[1][idx])
+        if len(free_points) > 0:
+            row, col = divmod(int(free_points[np.random.randint(len(free_points))]), w)
+            return (row, col)
         else:
             return (h // 2, w // 2)
     
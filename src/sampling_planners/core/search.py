@@ -0,0 +1,330 @@
+# core/search.py
+import heapq
+import numpy as np
+from .instrument import timed
+
+
+class Graph:
+    """
+    Directed graph over integer node ids in compressed sparse row form.
+
+    The edges leaving node u are indptr[u]:ends[u] of indices (target
+    nodes) and weights; ends defaults to indptr[1:]. Edges with infinite
+    weight are ignored by the searches, which lets callers disable edges
+    without rebuilding. add_edges() and remove_edges() change the graph in
+    place, leaving unused slots (infinite weight) between the nodes' edges.
+    """
+    def __init__(self, indptr, indices, weights, ends=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.ends = indptr[1:] if ends is None else ends
+        self._reverse = None
+        # Set by add_edges(): source node of every slot (-1 if unused),
+        # slots reserved per node and number of slots freed by moves and
+        # removals.
+        self._sources = None
+        self._capacity = None
+        self._free = 0
+
+    def __len__(self):
+        return len(self.ends)
+
+    @classmethod
+    def from_edges(cls, n, src, dst, weights):
+        """
+        Builds a graph with n nodes from parallel edge arrays.
+        """
+        src = np.asarray(src, dtype=np.int64)
+        order = np.argsort(src, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        return cls(indptr, np.asarray(dst, dtype=np.int64)[order], np.asarray(weights, dtype=float)[order])
+
+    def sources(self):
+        """
+        Source node of every edge, aligned with indices and weights; -1
+        for the unused slots of a graph changed in place.
+        """
+        if self._sources is not None:
+            return self._sources
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def reverse(self):
+        """
+        Graph with every edge reversed (cached).
+        """
+        if self._reverse is None:
+            used = self.sources() >= 0
+            self._reverse = Graph.from_edges(len(self), self.indices[used], self.sources()[used], self.weights[used])
+            self._reverse._reverse = self
+        return self._reverse
+
+    def edge(self, u, v):
+        """
+        Id of the cheapest edge u -> v, or -1 if there is none.
+        """
+        lo, hi = self.indptr[u], self.ends[u]
+        hits = np.flatnonzero(self.indices[lo:hi] == v)
+        if len(hits) == 0:
+            return -1
+        return int(lo + hits[np.argmin(self.weights[lo + hits])])
+
+    def add_edges(self, src, dst, weights, n=None):
+        """
+        Adds edges in place, first growing the graph to n nodes if n is
+        larger. Every node keeps room after its edges; a node that runs
+        out is moved to the end of the arrays with twice the room it
+        needs, so adding E edges costs O(E log E) overall rather than a
+        rebuild per call. Edge ids of earlier edges may change.
+        """
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        weights = np.asarray(weights, dtype=float)
+        if self._sources is None:
+            degree = np.diff(self.indptr)
+            self._repack(degree, np.repeat(np.arange(len(self)), degree), np.arange(len(self.indices)))
+        grow = max(n or 0, int(src.max()) + 1 if len(src) else 0) - len(self)
+        if grow > 0:
+            end = self.indptr[-1]
+            self.indptr = np.concatenate([self.indptr[:-1], np.full(grow + 1, end)])
+            self.ends = np.concatenate([self.ends, np.full(grow, end)])
+            self._capacity = np.concatenate([self._capacity, np.zeros(grow, dtype=np.int64)])
+        self._reverse = None
+        if len(src) == 0:
+            return
+        order = np.argsort(src, kind='stable')
+        src, dst, weights = src[order], dst[order], weights[order]
+        nodes, first, counts = np.unique(src, return_index=True, return_counts=True)
+        degree = self.ends[nodes] - self.indptr[nodes]
+        move = degree + counts > self._capacity[nodes]
+        if move.any():
+            moved, kept = nodes[move], degree[move]
+            room = 2 * (kept + counts[move])
+            start = self._reserve(room.sum()) + np.cumsum(room) - room
+            old, new = _ranges(self.indptr[moved], kept), _ranges(start, kept)
+            self.indices[new], self.weights[new], self._sources[new] = self.indices[old], self.weights[old], self._sources[old]
+            # Removed edges among old were counted as free already.
+            self._free += int(self._capacity[moved].sum()) - int((self._sources[old] < 0).sum())
+            self.weights[old], self._sources[old] = np.inf, -1
+            self.indptr[moved], self.ends[moved], self._capacity[moved] = start, start + kept, room
+        slots = self.ends[src] + np.arange(len(src)) - np.repeat(first, counts)
+        self.indices[slots], self.weights[slots], self._sources[slots] = dst, weights, src
+        self.ends[nodes] += counts
+        if self._free > len(self.indices) // 2:
+            used = np.flatnonzero(self._sources >= 0)
+            used = used[np.argsort(self._sources[used], kind='stable')]
+            self._repack(2 * np.bincount(self._sources[used], minlength=len(self)), self._sources[used], used)
+
+    def remove_edges(self, edges):
+        """
+        Removes edges, given by id (position in indices), in place.
+        """
+        if self._sources is None:
+            self.add_edges([], [], [])
+        edges = np.asarray(edges, dtype=np.int64)
+        edges = edges[self._sources[edges] >= 0]
+        self.weights[edges] = np.inf
+        self._sources[edges] = -1
+        self._free += len(edges)
+        self._reverse = None
+
+    def remove_nodes(self, nodes):
+        """
+        Removes every edge into or out of nodes, in place. The graph must
+        be symmetric (every edge u -> v has an edge v -> u), so that only
+        the edges of nodes and of their neighbors are visited.
+        """
+        if self._sources is None:
+            self.add_edges([], [], [])
+        nodes = np.asarray(nodes, dtype=np.int64)
+        out = _ranges(self.indptr[nodes], self.ends[nodes] - self.indptr[nodes])
+        out = out[self._sources[out] >= 0]
+        neighbors = np.unique(self.indices[out])
+        near = _ranges(self.indptr[neighbors], self.ends[neighbors] - self.indptr[neighbors])
+        removed = np.zeros(len(self), dtype=bool)
+        removed[nodes] = True
+        self.remove_edges(np.concatenate([out, near[removed[self.indices[near]]]]))
+
+    def _repack(self, capacity, sources, slots):
+        # Lays the edges in slots (grouped by their sources) out again,
+        # node after node, with capacity slots reserved per node.
+        capacity = np.asarray(capacity, dtype=np.int64)
+        degree = np.bincount(sources, minlength=len(capacity))
+        start = np.cumsum(capacity) - capacity
+        size = int(capacity.sum())
+        new = _ranges(start, degree)
+        indices, weights = np.zeros(size, dtype=np.int64), np.full(size, np.inf)
+        self._sources = np.full(size, -1, dtype=np.int64)
+        indices[new], weights[new], self._sources[new] = self.indices[slots], self.weights[slots], sources
+        self.indices, self.weights = indices, weights
+        self.indptr = np.append(start, size)
+        self.ends = start + degree
+        self._capacity = capacity
+        self._free = 0
+
+    def _reserve(self, size):
+        # Offset of size new slots at the end, growing the arrays by at
+        # least half each time they are full.
+        end = int(self.indptr[-1])
+        if end + size > len(self.indices):
+            extra = max(end + size, len(self.indices) * 3 // 2) - len(self.indices)
+            self.indices = np.concatenate([self.indices, np.zeros(extra, dtype=np.int64)])
+            self.weights = np.concatenate([self.weights, np.full(extra, np.inf)])
+            self._sources = np.concatenate([self._sources, np.full(extra, -1, dtype=np.int64)])
+        self.indptr[-1] = end + size
+        return end
+
+def _ranges(starts, lengths):
+    # Concatenation of arange(s, s + l) for every start s and length l.
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(np.asarray(starts, dtype=np.int64) - offsets, lengths) + np.arange(int(lengths.sum()))
+
+@timed('graph_search')
+def astar(graph, source, target, heuristic=None, extra=None):
+    """
+    A* search.
+    Parameters
+    ----------
+    graph : Graph
+        Graph to search.
+    source, target : int
+        Node ids.
+    heuristic : np.ndarray, optional
+        Admissible, consistent estimate of the cost to target for every
+        node id, including the extra nodes. Defaults to 0 (Dijkstra).
+    extra : dict, optional
+        {u: [(v, weight), ...]} edges added for this search only. Their
+        node ids may exceed the graph, e.g. for a query's start and goal.
+    Returns
+    -------
+    tuple
+        (path, cost) with path a list of node ids, or (None, inf).
+    """
+    n = _num_nodes(graph, extra, source, target)
+    h = np.zeros(n) if heuristic is None else heuristic
+    dist, parent = _run(graph, source, target, h, extra or {}, n)
+    if not np.isfinite(dist[target]):
+        return None, float('inf')
+    return trace_path(parent, target), float(dist[target])
+
+@timed('graph_search')
+def dijkstra(graph, source, target=None, extra=None):
+    """
+    Dijkstra's algorithm from source, stopping early once target is settled.
+    Returns
+    -------
+    tuple of np.ndarray
+        (dist, parent) for every node id; dist is inf and parent -1 for
+        nodes that were not reached.
+    """
+    n = _num_nodes(graph, extra, source, -1 if target is None else target)
+    return _run(graph, source, target, np.zeros(n), extra or {}, n)
+
+@timed('graph_search')
+def bidirectional_astar(graph, source, target, heuristic=None, reverse_heuristic=None, extra=None):
+    """
+    Bidirectional A* with average potentials.
+    Parameters
+    ----------
+    graph : Graph
+        Graph to search; its reverse is built once and cached.
+    source, target : int
+        Node ids.
+    heuristic, reverse_heuristic : np.ndarray, optional
+        Consistent estimates of the cost to target and from source for
+        every node id. Both default to 0 (bidirectional Dijkstra).
+    extra : dict, optional
+        {u: [(v, weight), ...]} edges added for this search only.
+    Returns
+    -------
+    tuple
+        (path, cost) with path a list of node ids, or (None, inf).
+    """
+    extra = extra or {}
+    n = _num_nodes(graph, extra, source, target)
+    h_t = np.zeros(n) if heuristic is None else heuristic
+    h_s = np.zeros(n) if reverse_heuristic is None else reverse_heuristic
+    # With potential p = (h_t - h_s) / 2 both searches use non-negative
+    # reduced costs, and they can stop once the two smallest keys add up
+    # to the best meeting cost.
+    p = (h_t - h_s) / 2.0
+    reverse_extra = {}
+    for u, out in extra.items():
+        for v, w in out:
+            reverse_extra.setdefault(v, []).append((u, w))
+    sides = [(graph, extra, p), (graph.reverse(), reverse_extra, -p)]
+    dist = [np.full(n, np.inf), np.full(n, np.inf)]
+    parent = [np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64)]
+    closed = [np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)]
+    heaps = [[(p[source], source)], [(-p[target], target)]]
+    dist[0][source] = 0.0
+    dist[1][target] = 0.0
+    best, meet = (0.0, source) if source == target else (np.inf, -1)
+    while heaps[0] and heaps[1] and heaps[0][0][0] + heaps[1][0][0] < best:
+        d = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+        key, u = heapq.heappop(heaps[d])
+        if closed[d][u]:
+            continue
+        closed[d][u] = True
+        g, potential = dist[d], sides[d][2]
+        for v, g_v in _relax(sides[d][0], sides[d][1], u, g):
+            if g_v < g[v]:
+                g[v] = g_v
+                parent[d][v] = u
+                heapq.heappush(heaps[d], (g_v + potential[v], v))
+            if g[v] + dist[1 - d][v] < best:
+                best, meet = g[v] + dist[1 - d][v], v
+    if meet < 0:
+        return None, float('inf')
+    path = trace_path(parent[0], meet) + trace_path(parent[1], meet)[::-1][1:]
+    return path, float(best)
+
+def trace_path(parent, node):
+    """
+    Follows parent pointers back from node; returns the root-to-node ids.
+    """
+    path = [int(node)]
+    while parent[path[-1]] >= 0:
+        path.append(int(parent[path[-1]]))
+    return path[::-1]
+
+def _num_nodes(graph, extra, *ids):
+    n = max(len(graph), max(ids) + 1)
+    for u, out in (extra or {}).items():
+        n = max(n, u + 1, *(v + 1 for v, _ in out))
+    return n
+
+def _relax(graph, extra, u, dist):
+    # Tentative distances through u for u's outgoing edges.
+    out = []
+    if u < len(graph):
+        lo, hi = graph.indptr[u], graph.ends[u]
+        if hi > lo:
+            g_new = dist[u] + graph.weights[lo:hi]
+            better = g_new < dist[graph.indices[lo:hi]]
+            out = list(zip(graph.indices[lo:hi][better].tolist(), g_new[better].tolist()))
+    for v, w in extra.get(u, ()):
+        out.append((v, dist[u] + w))
+    return out
+
+def _run(graph, source, target, h, extra, n):
+    dist = np.full(n, np.inf)
+    parent = np.full(n, -1, dtype=np.int64)
+    closed = np.zeros(n, dtype=bool)
+    dist[source] = 0.0
+    heap = [(h[source], source)]
+    while heap:
+        f, u = heapq.heappop(heap)
+        if closed[u]:
+            continue
+        if u == target:
+            break
+        closed[u] = True
+        for v, g_v in _relax(graph, extra, u, dist):
+            if g_v < dist[v]:
+                dist[v] = g_v
+                parent[v] = u
+                heapq.heappush(heap, (g_v + h[v], v))
+    return dist, parent
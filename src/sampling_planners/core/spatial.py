@@ -0,0 +1,365 @@
+# core/spatial.py
+import numpy as np
+from scipy.spatial import KDTree
+from .instrument import timed
+
+
+class SpatialIndex:
+    """
+    Incremental nearest-neighbor index over 2D points.
+
+    Points are identified by their insertion order (0, 1, 2, ...). The index
+    is a forest of static KDTrees over contiguous id ranges whose sizes
+    follow a binary counter, plus a short buffer of recent points that is
+    scanned linearly. Inserts cost amortized O(log n) and queries visit
+    O(log n) trees, so query time stays flat as the point set grows.
+
+    Parameters
+    ----------
+    points : array_like, optional
+        Initial (N, 2) points.
+    leaf_size : int
+        Number of buffered points before they are bulk-built into a KDTree.
+    """
+    def __init__(self, points=None, leaf_size=64):
+        self.leaf_size = leaf_size
+        self._points = np.empty((max(leaf_size, 16), 2))
+        self._n = 0
+        self._indexed = 0
+        self._trees = []
+        if points is not None:
+            self.insert_many(points)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def points(self):
+        """(N, 2) view of the indexed points, ordered by id."""
+        return self._points[:self._n]
+
+    def insert(self, point):
+        """
+        Adds a point and returns its id.
+        """
+        self._reserve(self._n + 1)
+        self._points[self._n] = point
+        self._n += 1
+        if self._n - self._indexed >= self.leaf_size:
+            self._flush()
+        return self._n - 1
+
+    def insert_many(self, points):
+        """
+        Adds (M, 2) points and returns their ids.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        first = self._n
+        self._reserve(first + len(points))
+        self._points[first:first + len(points)] = points
+        self._n += len(points)
+        if self._n - self._indexed >= self.leaf_size:
+            self._flush()
+        return np.arange(first, self._n)
+
+    @timed('nearest_neighbor')
+    def nearest(self, point):
+        """
+        Finds the nearest point.
+        Parameters
+        ----------
+        point : tuple
+            Query point.
+        Returns
+        -------
+        tuple
+            (id, distance) of the nearest point, or (-1, inf) if empty.
+        """
+        q = np.asarray(point, dtype=float)
+        if q.shape != (2,):
+            raise ValueError("point must have 2 coordinates")
+        best_i, best_d = -1, np.inf
+        buf = self._points[self._indexed:self._n]
+        if len(buf):
+            d2 = (buf[:, 0] - q[0]) ** 2 + (buf[:, 1] - q[1]) ** 2
+            j = int(np.argmin(d2))
+            best_i, best_d = self._indexed + j, float(np.sqrt(d2[j]))
+        for start, tree in self._trees:
+            d, i = tree.query(q, distance_upper_bound=best_d)
+            if d < best_d:
+                best_i, best_d = start + int(i), float(d)
+        return best_i, best_d
+
+    @timed('nearest_neighbor')
+    def query(self, points, k=1):
+        """
+        Finds the k nearest points for each query point.
+        Parameters
+        ----------
+        points : array_like
+            (M, 2) query points.
+        k : int
+            Number of neighbors.
+        Returns
+        -------
+        tuple of np.ndarray
+            (M, k') distances and ids sorted by distance, k' = min(k, N).
+        """
+        q = np.asarray(points, dtype=float).reshape(-1, 2)
+        k = min(k, self._n)
+        if k == 0:
+            return np.empty((len(q), 0)), np.empty((len(q), 0), dtype=int)
+        dists, ids = [], []
+        for start, tree in self._trees:
+            kk = min(k, tree.n)
+            d, i = tree.query(q, k=kk)
+            dists.append(np.reshape(d, (len(q), kk)))
+            ids.append(np.reshape(i, (len(q), kk)) + start)
+        buf = self._points[self._indexed:self._n]
+        if len(buf):
+            d = np.sqrt(((q[:, None, :] - buf[None, :, :]) ** 2).sum(axis=2))
+            dists.append(d)
+            ids.append(np.broadcast_to(np.arange(self._indexed, self._n), d.shape))
+        dists = np.concatenate(dists, axis=1)
+        ids = np.concatenate(ids, axis=1)
+        order = np.argsort(dists, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(dists, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    @timed('radius_query')
+    def query_radius(self, point, r):
+        """
+        Returns the ids of all points within distance r of point, sorted.
+        """
+        q = np.asarray(point, dtype=float)
+        found = []
+        for start, tree in self._trees:
+            hits = tree.query_ball_point(q, r)
+            if hits:
+                found.append(np.asarray(hits, dtype=int) + start)
+        buf = self._points[self._indexed:self._n]
+        if len(buf):
+            d2 = (buf[:, 0] - q[0]) ** 2 + (buf[:, 1] - q[1]) ** 2
+            found.append(np.flatnonzero(d2 <= r * r) + self._indexed)
+        if not found:
+            return np.empty(0, dtype=int)
+        return np.sort(np.concatenate(found))
+
+    @timed('radius_query')
+    def query_radius_many(self, points, r):
+        """
+        Finds the points within distance r of each query point.
+        Parameters
+        ----------
+        points : array_like
+            (M, 2) query points.
+        r : float
+            Radius.
+        Returns
+        -------
+        tuple of np.ndarray
+            (rows, ids): ids[k] is within r of points[rows[k]], sorted by
+            row, then id.
+        """
+        q = np.asarray(points, dtype=float).reshape(-1, 2)
+        rows, found = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for start, tree in self._trees:
+            hits = tree.query_ball_point(q, r)
+            rows.append(np.repeat(np.arange(len(q)), [len(h) for h in hits]))
+            found.append(np.concatenate([np.asarray(h, dtype=np.int64) for h in hits] + [found[0]]) + start)
+        buf = self._points[self._indexed:self._n]
+        if len(buf):
+            d2 = (q[:, None, 0] - buf[None, :, 0]) ** 2 + (q[:, None, 1] - buf[None, :, 1]) ** 2
+            row, j = np.nonzero(d2 <= r * r)
+            rows.append(row)
+            found.append(j + self._indexed)
+        rows, found = np.concatenate(rows), np.concatenate(found)
+        order = np.argsort(rows * max(self._n, 1) + found, kind='stable')
+        return rows[order], found[order]
+
+    def query_cells(self, region):
+        """
+        Returns the sorted ids of the points that round to a cell in region,
+        (row0, col0, row1, col1) with row1 and col1 exclusive.
+        """
+        r0, c0, r1, c1 = region
+        center = ((r0 + r1 - 1) / 2.0, (c0 + c1 - 1) / 2.0)
+        ids = self.query_radius(center, np.hypot(r1 - r0, c1 - c0) / 2.0 + 1.0)
+        cells = np.rint(self._points[ids]).astype(int)
+        inside = (cells[:, 0] >= r0) & (cells[:, 0] < r1) & (cells[:, 1] >= c0) & (cells[:, 1] < c1)
+        return ids[inside]
+
+    def _reserve(self, n):
+        if n > len(self._points):
+            grown = np.empty((max(n, 2 * len(self._points)), 2))
+            grown[:self._n] = self._points[:self._n]
+            self._points = grown
+
+    def _flush(self):
+        # Bulk-build the buffer into a tree, then merge trailing trees while
+        # the older one is not larger, keeping tree sizes strictly decreasing.
+        start = self._indexed
+        while self._trees and self._trees[-1][1].n <= self._n - start:
+            start = self._trees.pop()[0]
+        self._trees.append((start, KDTree(self._points[start:self._n].copy())))
+        self._indexed = self._n
+
+
+def radius_pairs(index, ids, r, active):
+    """
+    Pairs of indexed points within distance r of each other, for
+    connecting the points ids to the others.
+    Parameters
+    ----------
+    index : SpatialIndex
+        Index holding all the points.
+    ids : np.ndarray
+        Sorted ids of the points to connect, e.g. a batch just inserted.
+    r : float
+        Connection radius.
+    active : np.ndarray
+        (N,) mask of the points that may be connected to.
+    Returns
+    -------
+    tuple of np.ndarray
+        (src, dst) with src in ids, dst active and either not in ids or
+        after src, sorted by src then dst.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    rows, dst = index.query_radius_many(index.points[ids], r)
+    src = ids[rows]
+    connecting = np.zeros(len(index), dtype=bool)
+    connecting[ids] = True
+    keep = active[dst] & (~connecting[dst] | (dst > src))
+    return src[keep], dst[keep]
+
+
+class EdgeIndex:
+    """
+    Uniform-grid index over 2D line segments, for finding the edges that a
+    changed rectangle of the map can affect.
+
+    Segments are identified by their insertion order and registered in
+    every grid bucket their bounding box overlaps; buckets are sorted
+    lazily on the first query after an insert. Removed segments keep
+    their id and are skipped by queries.
+
+    Parameters
+    ----------
+    cell_size : float
+        Side of the square buckets, in map cells. About the typical
+        segment length works well.
+    """
+    def __init__(self, cell_size=32.0):
+        self.cell_size = float(cell_size)
+        self._segments = np.empty((16, 2, 2))
+        self._alive = np.empty(16, dtype=bool)
+        self._n = 0
+        self._keys = [np.empty(0, dtype=np.int64)]
+        self._ids = [np.empty(0, dtype=np.int64)]
+        self._sorted = True
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def segments(self):
+        """(N, 2, 2) segments, ordered by id."""
+        return self._segments[:self._n]
+
+    def insert_many(self, segments):
+        """
+        Adds (M, 2, 2) segments and returns their ids.
+        """
+        segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        first, m = self._n, len(segments)
+        if first + m > len(self._alive):
+            capacity = max(first + m, 2 * len(self._alive))
+            for name in ('_segments', '_alive'):
+                old = getattr(self, name)
+                new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:first] = old[:first]
+                setattr(self, name, new)
+        self._segments[first:first + m] = segments
+        self._alive[first:first + m] = True
+        self._n += m
+        ids = np.arange(first, first + m)
+        lo = np.floor(segments.min(axis=1) / self.cell_size).astype(np.int64)
+        hi = np.floor(segments.max(axis=1) / self.cell_size).astype(np.int64)
+        keys, owner = self._buckets(lo, hi)
+        self._keys.append(keys)
+        self._ids.append(ids[owner])
+        self._sorted = False
+        return ids
+
+    def remove(self, ids):
+        """
+        Removes the segments ids from the index.
+        """
+        self._alive[np.asarray(ids, dtype=np.int64)] = False
+
+    @timed('edge_query')
+    def query(self, region, margin=0.0):
+        """
+        Finds the segments passing through a block of map cells.
+        Parameters
+        ----------
+        region : tuple
+            (row0, col0, row1, col1) cell ranges, row1 and col1 exclusive.
+            Cell (i, j) covers the points that round to it.
+        margin : float
+            Distance by which the block is grown on every side.
+        Returns
+        -------
+        np.ndarray
+            Sorted ids of the segments that intersect the grown block.
+        """
+        r0, c0, r1, c1 = region
+        box_lo = np.array([r0 - 0.5 - margin, c0 - 0.5 - margin])
+        box_hi = np.array([r1 - 0.5 + margin, c1 - 0.5 + margin])
+        lo = np.floor(box_lo / self.cell_size).astype(np.int64)
+        hi = np.floor(box_hi / self.cell_size).astype(np.int64)
+        keys, _ = self._buckets(lo[None], hi[None])
+        if not self._sorted:
+            keys_all, ids_all = np.concatenate(self._keys), np.concatenate(self._ids)
+            order = np.argsort(keys_all, kind='stable')
+            self._keys, self._ids = [keys_all[order]], [ids_all[order]]
+            self._sorted = True
+        left = np.searchsorted(self._keys[0], keys, side='left')
+        right = np.searchsorted(self._keys[0], keys, side='right')
+        count = right - left
+        pos = np.repeat(left - (np.cumsum(count) - count), count) + np.arange(count.sum())
+        ids = np.unique(self._ids[0][pos])
+        ids = ids[self._alive[ids]]
+        return ids[_segments_hit_box(self._segments[ids], box_lo, box_hi)]
+
+    def _buckets(self, lo, hi):
+        # Keys of every bucket in the (M, 2) inclusive bucket ranges
+        # [lo, hi], and the range each key belongs to. Keys pack the two
+        # bucket coordinates into one int64.
+        span = hi - lo + 1
+        count = span[:, 0] * span[:, 1]
+        owner = np.repeat(np.arange(len(lo)), count)
+        j = np.arange(len(owner)) - (np.cumsum(count) - count)[owner]
+        row = lo[owner, 0] + j // span[owner, 1]
+        col = lo[owner, 1] + j % span[owner, 1]
+        return (row << 32) + (col & 0xFFFFFFFF), owner
+
+
+def _segments_hit_box(segments, box_lo, box_hi):
+    # Slab test: clip each segment's parameter range [0, 1] to the box
+    # along both axes and check that something is left.
+    p0 = segments[:, 0]
+    d = segments[:, 1] - p0
+    t0 = np.zeros(len(segments))
+    t1 = np.ones(len(segments))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for axis in range(2):
+            a = (box_lo[axis] - p0[:, axis]) / d[:, axis]
+            b = (box_hi[axis] - p0[:, axis]) / d[:, axis]
+            flat = d[:, axis] == 0
+            inside = (p0[:, axis] >= box_lo[axis]) & (p0[:, axis] <= box_hi[axis])
+            a[flat] = np.where(inside[flat], -np.inf, np.inf)
+            b[flat] = np.inf
+            t0 = np.maximum(t0, np.minimum(a, b))
+            t1 = np.minimum(t1, np.maximum(a, b))
+    return t0 <= t1
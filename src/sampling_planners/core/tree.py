@@ -0,0 +1,188 @@
+# core/tree.py
+import numpy as np
+from .spatial import SpatialIndex, EdgeIndex
+
+
+class Tree:
+    """
+    Growable, array-backed search tree with integer node ids.
+
+    Coordinates live in the tree's SpatialIndex as an (N, 2) float array;
+    parent ids, root-path costs and depths live in parallel arrays that
+    double in size when full. The root has id 0 and parent -1, and every
+    node's parent has a smaller id than the node.
+
+    Parameters
+    ----------
+    root : tuple
+        Root coordinates.
+    cost : float
+        Cost stored for the root.
+    capacity : int
+        Initial number of node slots.
+    """
+    def __init__(self, root, cost=0.0, capacity=1024):
+        self.index = SpatialIndex()
+        self._parent = np.empty(capacity, dtype=np.int64)
+        self._cost = np.empty(capacity)
+        self._depth = np.empty(capacity, dtype=np.int32)
+        self._n = 0
+        self._edges = None
+        self.add(root, -1, cost)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def points(self):
+        """(N, 2) node coordinates, indexed by id."""
+        return self.index.points
+
+    @property
+    def parent(self):
+        """(N,) parent ids, -1 for the root."""
+        return self._parent[:self._n]
+
+    @property
+    def cost(self):
+        """(N,) cost stored with each node."""
+        return self._cost[:self._n]
+
+    @property
+    def depth(self):
+        """(N,) number of edges between each node and the root."""
+        return self._depth[:self._n]
+
+    def add(self, point, parent, cost=0.0):
+        """
+        Adds a node under parent and returns its id.
+        """
+        if self._n == len(self._parent):
+            self._grow(2 * self._n)
+        i = self._n
+        self._parent[i] = parent
+        self._cost[i] = cost
+        self._depth[i] = 0 if parent < 0 else self._depth[parent] + 1
+        self._n += 1
+        self.index.insert(point)
+        return i
+
+    def add_chain(self, points, parent, costs=None):
+        """
+        Adds points as a chain hanging from parent (each point is the child
+        of the previous one) and returns their ids.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        m = len(points)
+        if self._n + m > len(self._parent):
+            self._grow(max(2 * len(self._parent), self._n + m))
+        ids = np.arange(self._n, self._n + m)
+        self._parent[ids] = np.concatenate([[parent], ids[:-1]]) if m else ids
+        self._cost[ids] = 0.0 if costs is None else costs
+        self._depth[ids] = self._depth[parent] + 1 + np.arange(m)
+        self._n += m
+        self.index.insert_many(points)
+        return ids
+
+    def nearest(self, point):
+        """
+        Id of the node nearest to point.
+        """
+        return self.index.nearest(point)[0]
+
+    def near(self, point, r):
+        """
+        Ids of the nodes within distance r of point.
+        """
+        return self.index.query_radius(point, r)
+
+    def point(self, i):
+        """
+        Coordinates of node i as a tuple of floats.
+        """
+        x, y = self.index.points[i]
+        return (float(x), float(y))
+
+    def path(self, i):
+        """
+        Coordinates from the root to node i.
+        """
+        ids = [i]
+        while self._parent[ids[-1]] >= 0:
+            ids.append(int(self._parent[ids[-1]]))
+        return [self.point(j) for j in reversed(ids)]
+
+    def subtree(self, ids):
+        """
+        (N,) mask of the nodes ids and all their descendants.
+        """
+        mask = np.zeros(self._n, dtype=bool)
+        mask[ids] = True
+        first = int(np.argmax(mask)) if mask.any() else self._n
+        # Parents come before children, so one pass in id order suffices.
+        parent, hit = self._parent[:self._n].tolist(), mask.tolist()
+        for i in range(max(first, 1), self._n):
+            if hit[parent[i]]:
+                hit[i] = True
+        return np.array(hit, dtype=bool)
+
+    def add_cost(self, ids, delta):
+        """
+        Adds delta to the cost of the nodes ids and of all their
+        descendants, as when the cost of reaching ids changes.
+        """
+        shift = np.zeros(self._n)
+        np.add.at(shift, ids, delta)
+        nonzero = np.flatnonzero(shift)
+        if len(nonzero) == 0:
+            return
+        parent, total = self._parent[:self._n].tolist(), shift.tolist()
+        for i in range(max(int(nonzero[0]), 1), self._n):
+            total[i] += total[parent[i]]
+        self._cost[:self._n] += total
+
+    def prune(self, ids):
+        """
+        Removes the nodes ids and all their descendants; the root is kept.
+        Remaining nodes are renumbered in their original order.
+        Returns
+        -------
+        np.ndarray
+            (N,) new id of every old node, -1 for removed ones.
+        """
+        removed = self.subtree(ids)
+        removed[0] = False
+        new_ids = np.cumsum(~removed) - 1
+        new_ids[removed] = -1
+        if not removed.any():
+            return new_ids
+        keep = np.flatnonzero(~removed)
+        points = self.points[keep]
+        parent = self._parent[keep]
+        parent[1:] = new_ids[parent[1:]]
+        cost, depth = self._cost[keep], self._depth[keep]
+        self._n = len(keep)
+        self._parent[:self._n], self._cost[:self._n], self._depth[:self._n] = parent, cost, depth
+        self.index = SpatialIndex(points)
+        self._edges = None
+        return new_ids
+
+    def edge_index(self, cell_size=32.0):
+        """
+        EdgeIndex over the tree's edges, kept up to date as nodes are
+        added. Edge id i is the edge from node i + 1 to its parent.
+        """
+        if self._edges is None:
+            self._edges = EdgeIndex(cell_size)
+        n = len(self._edges) + 1
+        if n < self._n:
+            points = self.points
+            self._edges.insert_many(np.stack([points[self._parent[n:self._n]], points[n:self._n]], axis=1))
+        return self._edges
+
+    def _grow(self, capacity):
+        for name in ('_parent', '_cost', '_depth'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
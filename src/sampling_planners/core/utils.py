@@ -1,7 +1,12 @@
 # core/utils.py
 import numpy as np
 from scipy.spatial import KDTree
+from scipy.ndimage import maximum_filter
+from .costmap import derived, clearance_field, cost_pyramid, raw_threshold, as_costs, register_updater
+from .instrument import timed
+from . import backend
 
+@timed('collision_check')
 def collision_check(line, cost_map, threshold=0.99, step=1.0):
     """
     Checks if the line segment is collision-free.
@@ -20,19 +25,212 @@ def collision_check(line, cost_map, threshold=0.99, step=1.0):
     bool
         True if collision-free, False otherwise.
     """
-    x0, y0 = line[0]
-    x1, y1 = line[1]
-    dist = np.hypot(x1 - x0, y1 - y0)
-    num = int(dist / step) + 1
-    xs = np.linspace(x0, x1, num)
-    ys = np.linspace(y0, y1, num)
-    for x, y in zip(xs, ys):
-        xi, yi = int(round(x)), int(round(y))
-        if xi < 0 or yi < 0 or xi >= cost_map.shape[0] or yi >= cost_map.shape[1]:
-            return False
-        if cost_map[xi, yi] >= threshold:
-            return False
-    return True
+    return bool(collision_check_batch([line], cost_map, threshold, step)[0])
+
+@timed('collision_check_batch')
+def collision_check_batch(segments, cost_map, threshold=0.99, step=1.0):
+    """
+    Checks many line segments for collisions at once.
+    Parameters
+    ----------
+    segments : array_like
+        (N, 2, 2) array of ((x0, y0), (x1, y1)) endpoints.
+    cost_map : np.ndarray
+        2D cost map.
+    threshold : float
+        Maximum allowed cost value.
+    step : float
+        Step size for interpolation.
+    Returns
+    -------
+    np.ndarray
+        (N,) boolean mask, True where the segment is collision-free.
+    """
+    segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+    free = np.zeros(len(segments), dtype=bool)
+    if len(segments) == 0:
+        return free
+    delta = segments[:, 1] - segments[:, 0]
+    length = np.hypot(delta[:, 0], delta[:, 1])
+    num = _num_points(length, step)
+    # Endpoints are the first and last interpolated points (only the first
+    # when a single point is taken); look up their clearance, which is 0 on
+    # obstacles and outside the map.
+    ends = np.rint(segments).astype(int)
+    ends[num == 1, 1] = ends[num == 1, 0]
+    inside = ((ends >= 0) & (ends < cost_map.shape[:2])).all(axis=(1, 2))
+    clear = np.zeros((len(segments), 2))
+    clear[inside] = clearance_field(cost_map, threshold)[ends[inside, :, 0], ends[inside, :, 1]]
+    # A point at distance s from an endpoint rounds to a cell within
+    # s + sqrt(2) of the endpoint's cell, so it is free if s < reach.
+    reach = np.maximum(clear - _ROUNDING_SLACK, 0.0)
+    todo = (clear > 0).all(axis=1)
+    free[todo & (reach.sum(axis=1) > length)] = True
+    todo &= ~free
+    if not todo.any():
+        return free
+    # Only the points beyond both endpoints' reach need a cell lookup.
+    idx = np.flatnonzero(todo)
+    spacing = np.full(len(idx), np.inf)
+    multi = num[idx] > 1
+    spacing[multi] = length[idx][multi] / (num[idx][multi] - 1)
+    first = np.minimum(np.ceil(reach[idx, 0] / spacing), num[idx]).astype(int)
+    last = num[idx] - 1 - np.ceil(reach[idx, 1] / spacing).astype(int)
+    # Long segments are first checked against the cost pyramid; only the
+    # stretches that pass near obstacles are rasterized.
+    rows = np.arange(len(idx))
+    rejected = np.zeros(len(idx), dtype=bool)
+    long = np.flatnonzero(last - first + 1 >= _COARSE_MIN_POINTS)
+    if len(long):
+        run_rows, run_first, run_last, rejected[long] = _coarse_runs(
+            segments[idx[long]], length[idx[long]], spacing[long], first[long], last[long], cost_map, threshold)
+        short = np.ones(len(idx), dtype=bool)
+        short[long] = False
+        rows = np.concatenate([rows[short], long[run_rows]])
+        first = np.concatenate([first[short], run_first])
+        last = np.concatenate([last[short], run_last])
+    kernel = backend.kernel('runs_blocked')
+    if kernel is not None:
+        blocked = kernel(segments[idx], rows, first, last, np.asarray(cost_map), raw_threshold(cost_map, threshold),
+                         float(step), np.zeros(len(idx), dtype=bool))
+        free[idx] = ~blocked & ~rejected
+        return free
+    cells, run = _rasterize(segments[idx[rows]], step, first, last)
+    inside = (cells[:, 0] >= 0) & (cells[:, 1] >= 0) & (cells[:, 0] < cost_map.shape[0]) & (cells[:, 1] < cost_map.shape[1])
+    blocked = ~inside
+    blocked[inside] = cost_map[cells[inside, 0], cells[inside, 1]] >= raw_threshold(cost_map, threshold)
+    free[idx] = (np.bincount(rows[run[blocked]], minlength=len(idx)) == 0) & ~rejected
+    return free
+
+def prepare_cost_map(cost_map, threshold=0.99):
+    """
+    Builds the structures collision checks derive from cost_map (clearance
+    field, cost pyramid and coarse block masks) ahead of the first check,
+    e.g. before sharing them with worker processes.
+    """
+    clearance_field(cost_map, threshold)
+    _coarse_levels(cost_map, threshold)
+
+_ROUNDING_SLACK = np.sqrt(2.0) + 1e-6
+
+# Segments with fewer points left to check are rasterized directly.
+_COARSE_MIN_POINTS = 32
+
+def _coarse_levels(cost_map, threshold):
+    # Per pyramid level k >= 1: (unsafe, solid) block masks. unsafe marks
+    # blocks with an obstacle in their 3x3 neighborhood, solid blocks made
+    # only of obstacles (or cells outside the map).
+    fields = derived(cost_map)
+    key = ('coarse', threshold)
+    if key not in fields:
+        raw = raw_threshold(cost_map, threshold)
+        fields[key] = [(maximum_filter(high >= raw, size=3, mode='constant', cval=True), low >= raw)
+                       for high, low in cost_pyramid(cost_map)[1:]]
+    return fields[key]
+
+def _update_coarse_levels(cost_map, key, levels, region):
+    # Recomputes the masks of the blocks covering region; the pyramid has
+    # already been updated. unsafe depends on the 3x3 neighborhood, so one
+    # more block on each side is read.
+    raw = raw_threshold(cost_map, key[1])
+    pyramid = cost_pyramid(cost_map)
+    r0, c0, r1, c1 = region
+    for k, (unsafe, solid) in enumerate(levels, 1):
+        r0, c0, r1, c1 = r0 // 2, c0 // 2, (r1 + 1) // 2, (c1 + 1) // 2
+        high, low = pyramid[k]
+        h, w = high.shape
+        a0, b0, a1, b1 = max(r0 - 1, 0), max(c0 - 1, 0), min(r1 + 1, h), min(c1 + 1, w)
+        A0, B0 = max(a0 - 1, 0), max(b0 - 1, 0)
+        window = maximum_filter(high[A0:a1 + 1, B0:b1 + 1] >= raw, size=3, mode='constant', cval=True)
+        unsafe[a0:a1, b0:b1] = window[a0 - A0:a1 - A0, b0 - B0:b1 - B0]
+        solid[r0:r1, c0:c1] = low[r0:r1, c0:c1] >= raw
+
+register_updater('coarse', _update_coarse_levels)
+
+def _coarse_runs(segments, length, spacing, first, last, cost_map, threshold):
+    """
+    Coarse-to-fine pass over the points first..last of each segment.
+
+    The stretch left to check is kept as runs [a, b] of arc length. At each
+    pyramid level, from coarse to fine, every run is sampled at spacing
+    cs <= block size bs. Each sample point p stands for the stretch within
+    cs / 2 of it. The rounded cells of the segment's points on that
+    stretch lie within bs / 2 + 0.5 <= bs of p on each axis, so they fall
+    in the 3x3 blocks around p's block. If none of those blocks holds an
+    obstacle, the stretch is free and is dropped. If p's block is solid
+    and the nearest segment point (within spacing / 2) must round into
+    it, the segment is blocked. The runs that are left are returned as
+    point index ranges for _rasterize.
+    Returns
+    -------
+    tuple of np.ndarray
+        (rows, first, last) of the runs, rows indexing segments, and the
+        (N,) mask of segments found blocked.
+    """
+    p0 = segments[:, 0]
+    direction = (segments[:, 1] - p0) / length[:, None]
+    rejected = np.zeros(len(segments), dtype=bool)
+    rows = np.arange(len(segments))
+    a, b = first * spacing, last * spacing
+    levels = _coarse_levels(cost_map, threshold)
+    for k in range(len(levels), 0, -1):
+        bs = float(2 ** k)
+        unsafe, solid = levels[k - 1]
+        active = (b - a >= 2 * bs) & ~rejected[rows]
+        if not active.any():
+            continue
+        run = np.flatnonzero(active)
+        n = np.ceil((b[run] - a[run]) / bs).astype(int) + 1
+        cs = (b[run] - a[run]) / (n - 1)
+        owner = np.repeat(np.arange(len(run)), n)
+        j = np.arange(len(owner)) - (np.cumsum(n) - n)[owner]
+        s = a[run][owner] + j * cs[owner]
+        seg = rows[run][owner]
+        p = p0[seg] + s[:, None] * direction[seg]
+        block = np.floor(p / bs).astype(int)
+        inside = ((block >= 0) & (block < unsafe.shape)).all(axis=1)
+        hit = np.ones(len(p), dtype=bool)
+        hit[inside] = unsafe[block[inside, 0], block[inside, 1]]
+        margin = spacing[seg, None] / 2 + 1e-6
+        deep = inside & ((p - margin > block * bs - 0.5) & (p + margin < (block + 1) * bs - 0.5)).all(axis=1)
+        deep[deep] = solid[block[deep, 0], block[deep, 1]]
+        rejected[seg[deep]] = True
+        # Merge consecutive unsafe sample points of a run into new runs.
+        starts = np.flatnonzero(hit & ((j == 0) | ~np.concatenate([[False], hit[:-1]])))
+        ends = np.flatnonzero(hit & ((j == n[owner] - 1) | ~np.concatenate([hit[1:], [False]])))
+        lo = np.maximum(s[starts] - cs[owner[starts]] / 2, a[run][owner[starts]])
+        hi = np.minimum(s[ends] + cs[owner[ends]] / 2, b[run][owner[ends]])
+        keep = ~active
+        rows = np.concatenate([rows[keep], seg[starts]])
+        a = np.concatenate([a[keep], lo])
+        b = np.concatenate([b[keep], hi])
+    # One extra point on each side absorbs rounding of the run bounds.
+    run_first = np.maximum(np.ceil(a / spacing[rows]).astype(int) - 1, first[rows])
+    run_last = np.minimum(np.floor(b / spacing[rows]).astype(int) + 1, last[rows])
+    keep = ~rejected[rows]
+    return rows[keep], run_first[keep], run_last[keep], rejected
+
+def _num_points(length, step):
+    return (length / step).astype(int) + 1
+
+def _rasterize(segments, step=1.0, first=None, last=None):
+    """
+    Rounds the points of np.linspace(p0, p1, int(dist / step) + 1) for every
+    segment to grid cells, optionally only points first..last (inclusive).
+    Returns the (M, 2) cells and the segment index of each cell.
+    """
+    p0, p1 = segments[:, 0], segments[:, 1]
+    delta = p1 - p0
+    num = _num_points(np.hypot(delta[:, 0], delta[:, 1]), step)
+    first = np.zeros_like(num) if first is None else first
+    last = num - 1 if last is None else last
+    count = np.maximum(last - first + 1, 0)
+    seg = np.repeat(np.arange(len(segments)), count)
+    i = np.arange(len(seg)) - (np.cumsum(count) - count)[seg] + first[seg]
+    pts = i[:, None] * (delta / np.maximum(num - 1, 1)[:, None])[seg] + p0[seg]
+    at_end = (i == num[seg] - 1) & (num[seg] > 1)
+    pts[at_end] = p1[seg[at_end]]
+    return np.rint(pts).astype(int), seg
 
 def calculate_path_cost(path, cost_map, weights):
     """
@@ -48,16 +246,97 @@ def calculate_path_cost(path, cost_map, weights):
     Returns
     -------
     float
-        Weighted cost J.
+        Weighted cost J = w_length * length + w_cost * (integral of the
+        cost map along the path); see edge_costs().
+    """
+    return float(path_costs([path], cost_map, weights)[0])
+
+@timed('path_costs')
+def path_costs(paths, cost_map, weights):
+    """
+    Calculates the weighted costs of many paths in one pass.
+    Parameters
+    ----------
+    paths : list
+        Paths, each a sequence of (x, y) points.
+    cost_map : np.ndarray
+        2D cost map.
+    weights : dict
+        {'length': float, 'cost': float}
+    Returns
+    -------
+    np.ndarray
+        (M,) cost of every path, as calculate_path_cost() computes it.
+    """
+    paths = [np.asarray(p, dtype=float).reshape(-1, 2) for p in paths]
+    counts = np.array([max(len(p) - 1, 0) for p in paths], dtype=int)
+    segments = np.concatenate([np.stack([p[:-1], p[1:]], axis=1) for p in paths] + [np.empty((0, 2, 2))])
+    delta = segments[:, 1] - segments[:, 0]
+    cost = weights['length'] * np.hypot(delta[:, 0], delta[:, 1]) + weights['cost'] * edge_costs(segments, cost_map)
+    return np.bincount(np.repeat(np.arange(len(paths)), counts), weights=cost, minlength=len(paths))
+
+@timed('edge_costs')
+def edge_costs(segments, cost_map):
     """
-    length = 0.0
-    cost = 0.0
-    for i in range(len(path) - 1):
-        p0, p1 = path[i], path[i+1]
-        length += np.hypot(p1[0] - p0[0], p1[1] - p0[1])
-        cost += cost_map[int(round(p0[0])), int(round(p0[1]))]
-    cost += cost_map[int(round(path[-1][0])), int(round(path[-1][1]))]
-    return weights['length'] * length + weights['cost'] * cost
+    Integrates the cost map along line segments.
+
+    The map is taken as piecewise constant, cell (i, j) covering the
+    points that round to it, and each segment is split where it crosses
+    cell boundaries; the integral is the sum of cost times length over
+    the pieces. Work is proportional to the number of cells crossed.
+    Parameters
+    ----------
+    segments : array_like
+        (N, 2, 2) array of ((x0, y0), (x1, y1)) endpoints.
+    cost_map : np.ndarray
+        2D cost map. Points outside it take the cost of the nearest cell.
+    Returns
+    -------
+    np.ndarray
+        (N,) integral of cost over arc length for every segment.
+    """
+    segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+    # Bound memory by splitting the batch into chunks of about
+    # _EDGE_CHUNK pieces.
+    pieces = np.cumsum(np.abs(segments[:, 1] - segments[:, 0]).sum(axis=1) + 3)
+    if len(pieces) and pieces[-1] > _EDGE_CHUNK:
+        bounds = np.searchsorted(pieces, np.arange(_EDGE_CHUNK, pieces[-1], _EDGE_CHUNK))
+        return np.concatenate([_edge_costs(chunk, cost_map)
+                               for chunk in np.split(segments, np.unique(np.maximum(bounds, 1)))])
+    return _edge_costs(segments, cost_map)
+
+_EDGE_CHUNK = 1 << 20
+
+def _edge_costs(segments, cost_map):
+    n = len(segments)
+    p0 = segments[:, 0]
+    delta = segments[:, 1] - p0
+    # Split parameters t in (0, 1) where a coordinate crosses k + 0.5,
+    # plus 0 and 1 for every segment.
+    seg, t = [np.arange(n), np.arange(n)], [np.zeros(n), np.ones(n)]
+    for axis in range(2):
+        a, b = p0[:, axis], p0[:, axis] + delta[:, axis]
+        first = np.floor(np.minimum(a, b) - 0.5) + 1
+        count = np.maximum(np.ceil(np.maximum(a, b) - 0.5) - first, 0).astype(int)
+        owner = np.repeat(np.arange(n), count)
+        k = first[owner] + np.arange(len(owner)) - (np.cumsum(count) - count)[owner]
+        seg.append(owner)
+        t.append((k + 0.5 - a[owner]) / delta[owner, axis])
+    seg, t = np.concatenate(seg), np.concatenate(t)
+    # t lies in [0, 1], so seg * 2 + t orders by segment, then by t.
+    order = np.argsort(seg * 2.0 + t)
+    seg, t = seg[order], t[order]
+    # Consecutive parameters of the same segment bound one piece; its
+    # midpoint tells the cell.
+    piece = np.flatnonzero(seg[1:] == seg[:-1])
+    owner = seg[piece]
+    mid = (t[piece] + t[piece + 1]) / 2
+    cells = np.rint(p0[owner] + mid[:, None] * delta[owner]).astype(int)
+    rows = np.clip(cells[:, 0], 0, cost_map.shape[0] - 1)
+    cols = np.clip(cells[:, 1], 0, cost_map.shape[1] - 1)
+    length = np.hypot(delta[:, 0], delta[:, 1])
+    values = as_costs(cost_map, cost_map[rows, cols]) * (t[piece + 1] - t[piece]) * length[owner]
+    return np.bincount(owner, weights=values, minlength=n)
 
 def heuristic(node, goal):
     """
@@ -65,6 +344,7 @@ def heuristic(node, goal):
     """
     return np.hypot(goal[0] - node[0], goal[1] - node[1])
 
+@timed('nearest_neighbor')
 def nearest_neighbor(nodes, point):
     """
     Finds nearest node using KDTree.
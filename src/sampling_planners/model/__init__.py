@@ -0,0 +1,14 @@
+# model/__init__.py
+# The model classes need torch, so they are imported on first access only.
+_lazy = {'Predictor': '.predictor', 'UNet': '.unet', 'ConvBlock': '.blocks'}
+
+__all__ = list(_lazy)
+
+def __getattr__(name):
+    if name in _lazy:
+        from importlib import import_module
+        return getattr(import_module(_lazy[name], __name__), name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
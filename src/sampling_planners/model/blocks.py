@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 class ConvBlock(nn.Module):
     def __init__(self, in_channels, out_channels):
@@ -14,4 +15,14 @@ class ConvBlock(nn.Module):
         )
 
     def forward(self, x):
-        return self.conv(x)
\ No newline at end of file
+        return self.conv(x)
+
+    def fuse(self):
+        """
+        Folds each BatchNorm into the convolution before it. Only valid in
+        eval mode, where the block then computes the same function with
+        half the layers.
+        """
+        conv1, bn1, relu1, conv2, bn2, relu2 = self.conv
+        self.conv = nn.Sequential(fuse_conv_bn_eval(conv1, bn1), relu1, fuse_conv_bn_eval(conv2, bn2), relu2)
+        return self
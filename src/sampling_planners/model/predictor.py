@@ -1,14 +1,60 @@
 import torch
+import torch.nn.functional as F
 import numpy as np
 from .unet import UNet
 
+# torch.inference_mode() is new in torch 1.9.
+_inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
 class Predictor:
-    def __init__(self, model_path, device='cpu'):
+    """
+    Runs the UNet on (obstacle, start, goal) maps.
+
+    The model is prepared for inference only: BatchNorm is folded into the
+    convolutions, forward passes run under torch.inference_mode() and, on
+    CPU, tensors use the channels_last layout. The model width is read
+    from the checkpoint, so a narrower UNet (e.g. base_channels=16),
+    trained for CPU-only deployment, is loaded the same way.
+
+    Parameters
+    ----------
+    model_path : str
+        UNet state dict.
+    device : str, optional
+        Torch device; defaults to 'cuda' if available, else 'cpu'.
+    scale : float
+        Resolution, relative to the input maps, at which the model runs,
+        in (0, 1]. Below 1 the maps are max-pooled, which keeps every
+        obstacle and the start and goal cells, and the prediction is
+        upsampled back to the input size. Compute drops with scale ** 2.
+    threads : int, optional
+        Number of intra-op threads, set with torch.set_num_threads() for
+        the whole process; by default torch's choice is kept.
+    warmup : tuple, optional
+        (H, W) of a dummy prediction made at construction, so that the
+        first real one does not pay for one-time setup; None to skip.
+    """
+    def __init__(self, model_path, device=None, scale=1.0, threads=None, warmup=(128, 128)):
+        if not 0 < scale <= 1:
+            raise ValueError("scale must be in (0, 1], got {}".format(scale))
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        if threads is not None:
+            torch.set_num_threads(threads)
         self.device = torch.device(device)
-        self.model = UNet()
-        self.model.load_state_dict(torch.load(model_path, map_location=self.device))
+        self.scale = scale
+        state = torch.load(model_path, map_location=self.device)
+        self.model = UNet(base_channels=state['final.weight'].shape[1])
+        self.model.load_state_dict(state)
         self.model.eval()
+        self.model.fuse()
         self.model.to(self.device)
+        self.channels_last = self.device.type == 'cpu'
+        if self.channels_last:
+            self.model.to(memory_format=torch.channels_last)
+        if warmup is not None:
+            empty = np.zeros(warmup, dtype=np.float32)
+            self.predict(empty, empty, empty)
 
     def preprocess(self, obstacle_map, start_map, goal_map,):
         x = np.stack([obstacle_map, start_map, goal_map], axis=0).astype(np.float32)
@@ -17,6 +63,18 @@ class Predictor:
 
     def predict(self, obstacle_map, start_map, goal_map):
         x = self.preprocess(obstacle_map, start_map, goal_map)
-        with torch.no_grad():
-            prob_map = self.model(x).cpu().numpy()[0, 0]
-        return prob_map
\ No newline at end of file
+        size = tuple(x.shape[-2:])
+        with _inference_mode():
+            if self.scale != 1:
+                x = F.adaptive_max_pool2d(x, _scaled_size(size, self.scale))
+            if self.channels_last:
+                x = x.contiguous(memory_format=torch.channels_last)
+            prob_map = self.model(x)
+            if tuple(prob_map.shape[-2:]) != size:
+                prob_map = F.interpolate(prob_map, size=size, mode='bilinear', align_corners=True)
+            prob_map = prob_map.cpu().numpy()[0, 0]
+        return prob_map
+
+def _scaled_size(size, scale):
+    # The UNet pools three times, so both sides must be multiples of 8.
+    return tuple(max(8, int(round(n * scale / 8)) * 8) for n in size)
@@ -35,4 +35,13 @@ class UNet(nn.Module):
 
         out = torch.sigmoid(out)
 
-        return out
\ No newline at end of file
+        return out
+
+    def fuse(self):
+        """
+        Fuses the BatchNorm layers of every ConvBlock for inference; see
+        ConvBlock.fuse().
+        """
+        for block in [m for m in self.modules() if isinstance(m, ConvBlock)]:
+            block.fuse()
+        return self
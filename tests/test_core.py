@@ -0,0 +1,324 @@
+# tests/test_core.py
+import subprocess
+import sys
+from os.path import dirname, join, abspath
+path = dirname(dirname(abspath(__file__)))
+sys.path.append(path)
+import numpy as np
+import pytest
+from scipy.spatial import KDTree
+from src.sampling_planners.core.spatial import SpatialIndex, EdgeIndex, radius_pairs
+from src.sampling_planners.core import backend, costmap
+from src.sampling_planners.core.tree import Tree
+from src.sampling_planners.core.utils import collision_check, collision_check_batch, edge_costs, path_costs, calculate_path_cost
+from src.sampling_planners.core.costmap import (invalidate_cost_map, quantize, save_cost_map, load_cost_map, update_cost_map,
+                                                 clearance_field, cost_pyramid, free_cells)
+from src.sampling_planners.core.sampling import UniformSampling, HybridSampling, StaticSampling, InformedSampling, GuidedSampling, LearningBasedSampling
+from src.sampling_planners.core.search import Graph, astar, dijkstra, bidirectional_astar
+
+def test_spatial_index_matches_kdtree():
+    rng = np.random.default_rng(0)
+    points = rng.random((1000, 2)) * 100
+    index = SpatialIndex(leaf_size=16)
+    for p in points:
+        index.insert(p)
+    reference = KDTree(points)
+    for q in rng.random((20, 2)) * 100:
+        idx, dist = index.nearest(q)
+        assert np.isclose(dist, reference.query(q)[0])
+        assert list(index.query_radius(q, 10.0)) == sorted(reference.query_ball_point(q, 10.0))
+    dists, _ = index.query(points[:5], k=3)
+    assert np.allclose(dists, reference.query(points[:5], k=3)[0])
+    ids = np.sort(rng.choice(1000, 200, replace=False))
+    active = rng.random(1000) > 0.2
+    src, dst = radius_pairs(index, ids, 5.0, active)
+    d = np.hypot(*(points[ids, None] - points[None]).transpose(2, 0, 1))
+    connecting = np.isin(np.arange(1000), ids)
+    mask = (d <= 5.0) & active & (~connecting | (np.arange(1000) > ids[:, None]))
+    rows, expected = np.nonzero(mask)
+    assert (src == ids[rows]).all() and (dst == expected).all()
+
+def _reference_collision_check(line, cost_map, threshold=0.99, step=1.0):
+    (x0, y0), (x1, y1) = line
+    num = int(np.hypot(x1 - x0, y1 - y0) / step) + 1
+    for x, y in zip(np.linspace(x0, x1, num), np.linspace(y0, y1, num)):
+        xi, yi = int(round(x)), int(round(y))
+        if xi < 0 or yi < 0 or xi >= cost_map.shape[0] or yi >= cost_map.shape[1]:
+            return False
+        if cost_map[xi, yi] >= threshold:
+            return False
+    return True
+
+def test_collision_check_batch_matches_reference():
+    rng = np.random.default_rng(1)
+    cost_map = rng.random((40, 40))
+    cost_map[cost_map > 0.95] = 1.0
+    segments = rng.random((300, 2, 2)) * 44 - 2
+    mask = collision_check_batch(segments, cost_map)
+    assert mask.shape == (300,)
+    assert list(mask) == [_reference_collision_check(s, cost_map) for s in segments]
+    assert collision_check(((3.0, 3.0), (3.0, 3.0)), np.zeros((8, 8)))
+    assert not collision_check(((3.0, 3.0), (3.0, 9.0)), np.zeros((8, 8)))
+
+def test_collision_check_batch_sparse_map_long_segments():
+    rng = np.random.default_rng(2)
+    cost_map = rng.random((120, 100)) * 0.5
+    cost_map[rng.integers(0, 120, 30), rng.integers(0, 100, 30)] = 0.99
+    segments = rng.random((500, 2, 2)) * 124 - 2
+    segments[:250, 1] = segments[:250, 0] + rng.normal(size=(250, 2)) * 6
+    for step in (1.0, 2.5):
+        mask = collision_check_batch(segments, cost_map, step=step)
+        assert list(mask) == [_reference_collision_check(s, cost_map, step=step) for s in segments]
+
+def test_collision_check_batch_coarse_pass_is_exact():
+    rng = np.random.default_rng(3)
+    cost_map = rng.random((300, 260)) * 0.5
+    for r, c, h, w in rng.integers(0, 60, (40, 4)) * [5, 4, 1, 1]:
+        cost_map[r:r + h, c:c + w] = 1.0
+    segments = rng.random((400, 2, 2)) * [310, 270] - 5
+    segments[:100] = np.round(segments[:100] * 2) / 2
+    for step in (1.0, 0.7):
+        mask = collision_check_batch(segments, cost_map, step=step)
+        assert list(mask) == [_reference_collision_check(s, cost_map, step=step) for s in segments]
+
+def test_guided_sampling_follows_coarse_path():
+    np.random.seed(0)
+    cost_map = np.zeros((128, 128))
+    cost_map[:, 60:68] = 1.0
+    cost_map[100:110, 60:68] = 0.0
+    sampler = GuidedSampling(guide_bias=1.0, resolution=32, radius=1.0)
+    guide = sampler.guide(cost_map, (10, 10), (10, 120))
+    assert tuple(guide[0]) == (10, 10) and tuple(guide[-1]) == (10, 120)
+    assert guide[:, 0].max() > 95
+    batch = sampler.sample_batch(cost_map, (10, 10), (10, 120), 200)
+    rows, cols = np.rint(batch).astype(int).T
+    assert batch.shape == (200, 2) and (cost_map[rows, cols] < 0.99).all()
+    near = np.hypot(*(batch[:, None] - guide[None]).transpose(2, 0, 1)).min(axis=1)
+    assert near.max() < 12
+
+class _CountingPredictor:
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, obstacle_map, start_map, goal_map):
+        self.calls += 1
+        return 1.0 - obstacle_map
+
+def test_learning_based_sampling_reuses_prediction():
+    sampler = LearningBasedSampling.__new__(LearningBasedSampling)
+    sampler.goal_bias = 0.0
+    sampler.predictor = _CountingPredictor()
+    sampler._cache = None
+    cost_map = np.zeros((16, 16))
+    cost_map[4:8, 4:8] = 1.0
+    points = [sampler.sample(cost_map, (0, 0), (15, 15)) for _ in range(50)]
+    assert sampler.predictor.calls == 1
+    assert all(cost_map[p] < 0.9 for p in points)
+    sampler.sample(cost_map, (0, 0), (14, 14))
+    assert sampler.predictor.calls == 2
+    invalidate_cost_map(cost_map)
+    sampler.sample(cost_map, (0, 0), (14, 14))
+    assert sampler.predictor.calls == 3
+
+def test_sample_batch():
+    np.random.seed(0)
+    cost_map = np.zeros((32, 32))
+    cost_map[8:24, 8:24] = 1.0
+    start, goal = (0, 0), (31, 31)
+    learning = LearningBasedSampling.__new__(LearningBasedSampling)
+    learning.goal_bias = 0.2
+    learning.predictor = _CountingPredictor()
+    learning._cache = None
+    for sampler in [UniformSampling(), HybridSampling(goal_bias=0.2), StaticSampling(), learning]:
+        batch = sampler.sample_batch(cost_map, start, goal, 500)
+        assert batch.shape == (500, 2)
+        rows, cols = batch.astype(int).T
+        assert (cost_map[rows, cols] < 0.99).all()
+    assert 50 < (batch == goal).all(axis=1).sum() < 150
+    assert learning.predictor.calls == 1
+    static = StaticSampling([(1, 2), (3, 4), (5, 6)])
+    static.sample(cost_map, start, goal)
+    assert static.sample_batch(cost_map, start, goal, 4).tolist() == [[3, 4], [5, 6], [1, 2], [3, 4]]
+    assert static.sample(cost_map, start, goal) == (5, 6)
+
+def test_informed_sampling_stays_in_ellipse():
+    np.random.seed(0)
+    cost_map = np.zeros((100, 100))
+    cost_map[40:60, 40:60] = 1.0
+    start, goal = (10, 20), (80, 70)
+    sampler = InformedSampling(UniformSampling())
+    assert sampler.sample_batch(cost_map, start, goal, 10).shape == (10, 2)
+    sampler.c_best = 1.2 * np.hypot(70, 50)
+    batch = sampler.sample_batch(cost_map, start, goal, 1000)
+    assert batch.shape == (1000, 2)
+    assert (np.hypot(*(batch - start).T) + np.hypot(*(batch - goal).T) < sampler.c_best).all()
+    rows, cols = np.rint(batch).astype(int).T
+    assert (cost_map[rows, cols] < 0.99).all()
+
+def test_import_does_not_load_torch():
+    code = "import sys, sampling_planners; print('torch' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=join(path, "src"),
+                         check=True, capture_output=True, text=True).stdout
+    assert out.strip() == "False"
+
+def test_graph_searches_agree():
+    rng = np.random.default_rng(3)
+    points = rng.random((150, 2)) * 100
+    src = rng.integers(0, 150, 900)
+    dst = rng.integers(0, 150, 900)
+    graph = Graph.from_edges(150, src, dst, np.hypot(*(points[src] - points[dst]).T) * 1.5)
+    dist, parent = dijkstra(graph, 0)
+    for target in np.flatnonzero(np.isfinite(dist))[1:20]:
+        h = np.hypot(*(points - points[target]).T)
+        h_source = np.hypot(*(points - points[0]).T)
+        for path, cost in (astar(graph, 0, target, h), bidirectional_astar(graph, 0, target, h, h_source)):
+            assert path[0] == 0 and path[-1] == target
+            assert np.isclose(cost, dist[target])
+    assert astar(graph, 150, 151, extra={150: [(0, 1.0)], 0: [(151, 2.0)]}) == ([150, 0, 151], 3.0)
+
+def test_graph_grows_in_place():
+    rng = np.random.default_rng(4)
+    graph = Graph.from_edges(3, [0, 1], [1, 2], [1.0, 2.0])
+    src, dst, weights = [np.array([0, 1]), np.array([1, 2]), np.array([1.0, 2.0])]
+    n = 3
+    for step in range(40):
+        n += int(rng.integers(0, 10))
+        s, d = rng.integers(0, n, (2, 60))
+        w = rng.random(60)
+        graph.add_edges(np.concatenate([s, d]), np.concatenate([d, s]), np.concatenate([w, w]), n=n)
+        src, dst, weights = np.concatenate([src, s, d]), np.concatenate([dst, d, s]), np.concatenate([weights, w, w])
+        if step % 4 == 3:
+            nodes = rng.choice(n, 5, replace=False)
+            graph.remove_nodes(nodes)
+            keep = ~np.isin(src, nodes) & ~np.isin(dst, nodes)
+            src, dst, weights = src[keep], dst[keep], weights[keep]
+        reference = Graph.from_edges(n, src, dst, weights)
+        assert len(graph) == n and (graph.sources() >= 0).sum() == len(src)
+        for source in rng.integers(0, n, 3):
+            assert np.array_equal(dijkstra(graph, int(source))[0], dijkstra(reference, int(source))[0])
+            assert np.array_equal(dijkstra(graph.reverse(), int(source))[0], dijkstra(reference.reverse(), int(source))[0])
+
+def test_tree_grows_and_traces_paths():
+    tree = Tree((0, 0), capacity=2)
+    parent = 0
+    for i in range(1, 50):
+        parent = tree.add((i, 0), parent, cost=float(i))
+    ids = tree.add_chain([(49, 1), (49, 2)], parent, costs=[50.0, 51.0])
+    assert len(tree) == 52
+    assert tree.path(ids[-1]) == [(float(i), 0.0) for i in range(50)] + [(49.0, 1.0), (49.0, 2.0)]
+    assert list(tree.depth[-3:]) == [49, 50, 51]
+    assert tree.cost[ids[0]] == 50.0
+    assert tree.nearest((10.2, 0.4)) == 10
+    assert list(tree.near((49, 2), 1.0)) == [50, 51]
+
+def test_quantized_and_memory_mapped_maps(tmp_path):
+    rng = np.random.default_rng(5)
+    cost_map = rng.random((300, 300)) * 0.6
+    cost_map[rng.random(cost_map.shape) > 0.995] = 0.99
+    cost_map[100:180, 60:240] = 1.0
+    quantized = quantize(cost_map)
+    assert quantized.dtype == np.uint8
+    assert ((quantized >= 253) == (cost_map >= 0.99)).all()
+    save_cost_map(str(tmp_path / "map.npy"), quantized)
+    mapped = load_cost_map(str(tmp_path / "map.npy"))
+    assert isinstance(mapped, np.memmap)
+    segments = rng.random((2000, 2, 2)) * 310 - 5
+    expected = collision_check_batch(segments, cost_map)
+    assert (collision_check_batch(segments, quantized) == expected).all()
+    assert (collision_check_batch(segments, mapped) == expected).all()
+    for line in segments[:50]:
+        assert collision_check(line, mapped) == collision_check(line, cost_map)
+    batch = UniformSampling().sample_batch(mapped, (0, 0), (299, 299), 500)
+    rows, cols = np.rint(batch).astype(int).T
+    assert (cost_map[rows, cols] < 0.99).all()
+
+def test_compact_free_cells_and_clearance(monkeypatch):
+    from scipy.ndimage import distance_transform_edt
+    # Strips of 30 rows, shorter than the 256-row halo.
+    monkeypatch.setattr(costmap, '_STRIP_CELLS', 30 * 200)
+    rng = np.random.default_rng(8)
+    cost_map = quantize(rng.random((700, 200)) * 0.6)
+    cost_map[rng.random(cost_map.shape) > 0.999] = 255
+    cells = free_cells(cost_map)
+    assert cells.dtype == np.int32 and (cells == np.flatnonzero(cost_map < 253)).all()
+    clearance = clearance_field(cost_map)
+    exact = distance_transform_edt(np.pad(cost_map < 253, 1, constant_values=False))[1:-1, 1:-1]
+    assert clearance.dtype == np.uint8 and (clearance == np.minimum(np.floor(exact), 255)).all()
+
+def test_update_cost_map_matches_rebuild():
+    rng = np.random.default_rng(6)
+    cost_map = rng.random((300, 200)) * 0.5
+    cost_map[50:90, 20:160] = 1.0
+    clearance_field(cost_map), cost_pyramid(cost_map), free_cells(cost_map)
+    collision_check_batch(rng.random((10, 2, 2)) * 200, cost_map)
+    for region in [(40, 60, 70, 120), (-5, 190, 30, 230), (120, 0, 121, 200)]:
+        r0, c0, r1, c1 = region
+        cost_map[max(r0, 0):r1, max(c0, 0):c1] = rng.choice([0.1, 1.0])
+        update_cost_map(cost_map, [region])
+        fresh = cost_map.copy()
+        assert (np.minimum(clearance_field(fresh), 64) == clearance_field(cost_map)).all()
+        for (high, low), (high_ref, low_ref) in zip(cost_pyramid(cost_map), cost_pyramid(fresh)):
+            assert (high == high_ref).all() and (low == low_ref).all()
+        assert (free_cells(cost_map) == free_cells(fresh)).all()
+        segments = rng.random((2000, 2, 2)) * 310 - 5
+        assert (collision_check_batch(segments, cost_map) == collision_check_batch(segments, fresh)).all()
+
+def test_edge_index_and_tree_pruning():
+    rng = np.random.default_rng(7)
+    segments = rng.random((500, 2, 2)) * 100
+    index = EdgeIndex(cell_size=8)
+    index.insert_many(segments)
+    index.remove([3])
+    region = (40, 30, 55, 60)
+    found = set(index.query(region).tolist())
+    for i, (p0, p1) in enumerate(segments):
+        cells = np.rint(np.linspace(p0, p1, 200)).astype(int)
+        inside = ((cells >= (40, 30)) & (cells < (55, 60))).all(axis=1).any()
+        assert (i in found) >= (inside and i != 3)
+    tree = Tree((0, 0))
+    for i in range(1, 10):
+        tree.add((i, i % 3), (i - 1) // 2, cost=float(i))
+    tree.add_cost([1], 10.0)
+    assert list(tree.cost[[1, 3, 4, 7, 2]]) == [11.0, 13.0, 14.0, 17.0, 2.0]
+    new_ids = tree.prune([1])
+    assert len(tree) == 4 and list(new_ids[[0, 2, 5, 6, 1, 3]]) == [0, 1, 2, 3, -1, -1]
+    assert tree.path(3) == [(0.0, 0.0), (2.0, 2.0), (6.0, 0.0)]
+    assert len(tree.edge_index()) == 3 and tree.nearest((5.9, 0.1)) == 3
+
+def test_edge_costs_integrate_along_segments():
+    rng = np.random.default_rng(8)
+    cost_map = rng.random((60, 80))
+    segments = rng.random((100, 2, 2)) * (59, 79)
+    segments[:5, 1] = segments[:5, 0]
+    segments[5:10, 1, 0] = segments[5:10, 0, 0]
+    t = (np.arange(20000) + 0.5) / 20000
+    for (p0, p1), cost in zip(segments, edge_costs(segments, cost_map)):
+        cells = np.rint(p0 + t[:, None] * (p1 - p0)).astype(int)
+        assert np.isclose(cost, cost_map[cells[:, 0], cells[:, 1]].mean() * np.hypot(*(p1 - p0)), atol=0.02)
+    quantized = np.rint(cost_map * 255).astype(np.uint8)
+    assert np.allclose(edge_costs(segments, quantized), edge_costs(segments, quantized / 255.0))
+    weights = {'length': 0.7, 'cost': 0.3}
+    paths = [rng.random((k, 2)) * 59 for k in (1, 2, 7)]
+    assert np.allclose(path_costs(paths, cost_map, weights), [calculate_path_cost(p, cost_map, weights) for p in paths])
+    assert calculate_path_cost([(0, 0), (0, 10)], np.ones((5, 20)), weights) == 10.0
+
+def test_backend_kernels_match_numpy(monkeypatch):
+    # The loops the numba backend compiles, run as plain Python, agree
+    # exactly with the NumPy code of the numpy backend.
+    rng = np.random.default_rng(9)
+    cost_map = rng.random((80, 60))
+    cost_map[cost_map > 0.95] = 1.0
+    segments = rng.random((400, 2, 2)) * (90, 70) - 5
+    segments[:100] = np.round(segments[:100] * 2) / 2
+    segments[100:110, 1] = segments[100:110, 0]
+    segments[110:150] = np.array([[2, 2], [78, 57]]) + rng.random((40, 2, 2))
+    monkeypatch.setattr(backend, '_backend', 'numpy')
+    expected = [collision_check_batch(segments, cmap) for cmap in (cost_map, quantize(cost_map))]
+    monkeypatch.setattr(backend, 'kernel', lambda name: backend.KERNELS[name])
+    for cmap, free in zip((cost_map, quantize(cost_map)), expected):
+        assert (collision_check_batch(segments, cmap) == free).all()
+    monkeypatch.undo()
+    assert 'numpy' in backend.available_backends()
+    assert backend.get_backend() in backend.available_backends()
+    with pytest.raises(ValueError):
+        backend.set_backend('fortran')
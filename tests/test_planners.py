@@ -5,13 +5,21 @@ from os.path import dirname, join, abspath
 path = dirname(dirname(abspath(__file__)))
 sys.path.append(path)
 print(os.path)
+import time
 import numpy as np
 import pytest
 from src.sampling_planners.core.sampling import UniformSampling, HybridSampling, StaticSampling, LearningBasedSampling
 from src.sampling_planners.algorithms.rrt_connect import RRTConnect
 from src.sampling_planners.algorithms.bidirectional_est import BidirectionalEST
 from src.sampling_planners.algorithms.bit_star import BITStar
-from src.sampling_planners.algorithms.prm import PRM
+from src.sampling_planners.algorithms.prm import PRM, Roadmap
+from src.sampling_planners.core.tree import Tree
+from src.sampling_planners.core.parallel import plan_many, plan_race
+from src.sampling_planners.core.planner import Planner, PlanningTimeout
+from src.sampling_planners.core.search import Graph, astar
+from src.sampling_planners.core import instrument
+from src.sampling_planners.core.costmap import derived, pinned, save_cost_map, load_cost_map
+from src.sampling_planners.core.utils import collision_check, collision_check_batch, calculate_path_cost
 
 @pytest.fixture
 def cost_map():
@@ -47,3 +55,361 @@ def test_prm(cost_map, start_goal):
     planner = PRM(n_samples=100, k_neighbors=5, sampling_method=LearningBasedSampling())
     path = planner.plan(start, goal, cost_map, {'length': 0.7, 'cost': 0.3})
     assert path is None or (path[0] == start and path[-1] == goal)
+
+def test_prm_roadmap_save_load(tmp_path, cost_map, start_goal):
+    start, goal = start_goal
+    weights = {'length': 0.7, 'cost': 0.3}
+    planner = PRM(n_samples=300, k_neighbors=8, sampling_method=UniformSampling())
+    roadmap = planner.build_roadmap(cost_map)
+    path = planner.plan(start, goal, cost_map, weights)
+    assert path is None or (path[0] == start and path[-1] == goal)
+    roadmap.save(str(tmp_path / "roadmap"))
+    loaded = Roadmap.load(str(tmp_path / "roadmap"))
+    assert isinstance(loaded.indices, np.memmap)
+    assert PRM(k_neighbors=8, roadmap=loaded).plan(start, goal, cost_map, weights) == path
+
+def test_lazy_prm_matches_eager(cost_map, start_goal):
+    start, goal = start_goal
+    weights = {'length': 0.7, 'cost': 0.3}
+    np.random.seed(0)
+    eager = PRM(n_samples=300, k_neighbors=8, sampling_method=UniformSampling()).build_roadmap(cost_map)
+    np.random.seed(0)
+    lazy = PRM(n_samples=300, k_neighbors=8, sampling_method=UniformSampling(), lazy=True).build_roadmap(cost_map)
+    assert (lazy.state == -1).all()
+    path, cost = lazy.query(start, goal, cost_map, weights, 8)
+    expected_path, expected_cost = eager.query(start, goal, cost_map, weights, 8)
+    assert np.isclose(cost, expected_cost)
+    assert (lazy.state == -1).sum() > 0.5 * len(lazy.state)
+    assert 0 < lazy.collision_checks < eager.collision_checks
+
+def test_bit_star_uniform(cost_map, start_goal):
+    start, goal = start_goal
+    np.random.seed(0)
+    planner = BITStar(batch_size=100, max_batches=4, step_size=8.0, sampling_method=UniformSampling())
+    path = planner.plan(start, goal, cost_map, {'length': 0.7, 'cost': 0.3})
+    assert path is None or (path[0] == start and path[-1] == goal)
+
+def test_bidirectional_est_open_map():
+    np.random.seed(0)
+    open_map = np.random.rand(60, 60) * 0.3
+    start, goal = (5, 5), (15, 18)
+    planner = BidirectionalEST(step_size=5.0, max_iterations=2000, k_samples=5, sampling_method=UniformSampling())
+    path = planner.plan(start, goal, open_map, {'length': 0.7, 'cost': 0.3})
+    assert path is not None and path[0] == start and path[-1] == goal
+
+def test_plan_many_is_reproducible():
+    open_map = np.random.RandomState(1).rand(64, 64) * 0.3
+    queries = [((5, 5), (50, 40)), ((60, 3), (2, 60)), ((30, 30), (31, 55))]
+    planner = RRTConnect(step_size=5.0, max_iterations=2000, sampling_method=UniformSampling())
+    serial = plan_many(planner, queries, open_map, {'length': 0.7, 'cost': 0.3}, workers=1, seed=7)
+    pooled = plan_many(planner, queries, open_map, {'length': 0.7, 'cost': 0.3}, workers=2, seed=7)
+    assert serial == pooled
+    assert all(p is not None and p[0] == s and p[-1] == g for p, (s, g) in zip(serial, queries))
+
+def test_time_budget():
+    blocked = np.zeros((64, 64))
+    blocked[:, 30:34] = 1.0
+    planner = RRTConnect(step_size=5.0, max_iterations=10 ** 9, sampling_method=UniformSampling())
+    with pytest.raises(PlanningTimeout):
+        planner.plan((5, 5), (5, 60), blocked, {'length': 0.7, 'cost': 0.3}, time_budget=0.2)
+    assert planner.status == 'timeout'
+    planner.max_iterations = 50
+    assert planner.plan((5, 5), (5, 60), blocked, {'length': 0.7, 'cost': 0.3}) is None
+    assert planner.status == 'failure'
+    np.random.seed(0)
+    planner = BITStar(batch_size=50, max_batches=1, step_size=8.0, sampling_method=UniformSampling())
+    t = time.perf_counter()
+    path = planner.plan((5, 5), (60, 20), blocked * 0.5, {'length': 0.7, 'cost': 0.3}, time_budget=0.3)
+    assert time.perf_counter() - t >= 0.3
+    assert planner.status == 'success' and path[0] == (5, 5) and path[-1] == (60, 20)
+
+def test_prm_roadmap_build_checks_the_deadline():
+    cost_map = np.random.RandomState(0).rand(64, 64) * 0.3
+    points = np.random.RandomState(1).rand(2000, 2) * 63
+    calls = []
+    def stop():
+        calls.append(1)
+        return False
+    roadmap = Roadmap.build(points, cost_map, k_neighbors=8, stop=stop)
+    assert roadmap is not None and len(calls) > 1
+    assert Roadmap.build(points, cost_map, k_neighbors=8, stop=lambda: True) is None
+    planner = PRM(n_samples=2000, k_neighbors=8, sampling_method=UniformSampling())
+    with pytest.raises(PlanningTimeout):
+        planner.plan((5, 5), (60, 60), cost_map, {'length': 0.7, 'cost': 0.3}, time_budget=0.0)
+    assert planner.status == 'timeout'
+
+def test_instrumentation_and_callbacks():
+    open_map = np.random.RandomState(0).rand(64, 64) * 0.3
+    np.random.seed(0)
+    planner = RRTConnect(step_size=5.0, max_iterations=2000, sampling_method=UniformSampling())
+    events = []
+    planner.add_callback(lambda event, data: events.append(event))
+    with instrument.instrumented() as stats:
+        path = planner.plan((5, 5), (50, 40), open_map, {'length': 0.7, 'cost': 0.3})
+    assert not instrument.is_enabled()
+    assert stats['collision_check']['calls'] == planner.stats['collision_checks']
+    assert stats['sample']['calls'] == events.count('sample')
+    assert events.count('edge') == planner.stats['nodes'] - 2
+    assert events[-1] == 'solution'
+    planner.callbacks.clear()
+    np.random.seed(0)
+    with pytest.warns(DeprecationWarning):
+        recorded, samples, edges_a, edges_b = planner.plan((5, 5), (50, 40), open_map, {'length': 0.7, 'cost': 0.3},
+                                                           visualize=True)
+    assert recorded == path and len(samples) == events.count('sample')
+    assert len(edges_a) + len(edges_b) == events.count('edge')
+
+def test_plan_after_editing_the_map_in_place():
+    cost_map = np.random.RandomState(0).rand(64, 64) * 0.3
+    weights = {'length': 0.7, 'cost': 0.3}
+    np.random.seed(0)
+    planner = RRTConnect(step_size=5.0, max_iterations=5000, sampling_method=UniformSampling())
+    assert planner.plan((5, 5), (60, 60), cost_map, weights) is not None
+    assert collision_check(((30, 5), (30, 60)), cost_map)
+    # No invalidate_cost_map(): the cached clearance field must not be
+    # trusted once the map is checked, as planners do on entry.
+    cost_map[28:36, 10:64] = 1.0
+    with pinned(cost_map):
+        assert not collision_check(((30, 20), (30, 25)), cost_map)
+    path = planner.plan((5, 5), (60, 60), cost_map, weights)
+    assert path is not None
+    assert collision_check_batch(np.stack([path[:-1], path[1:]], axis=1), cost_map.copy()).all()
+
+class _FixedSampling:
+    def __init__(self, point):
+        self.point = point
+
+    def sample(self, cost_map, start, goal):
+        return self.point
+
+def test_rrt_connect_checks_the_joining_segment():
+    # The tips (20, 31) and (20, 33), closer than step_size, straddle a
+    # one-cell wall; each was reached by a free step.
+    cost_map = np.full((40, 64), 0.1)
+    cost_map[:, 32] = 1.0
+    planner = RRTConnect(step_size=5.0, max_iterations=1, sampling_method=_FixedSampling((20, 31)))
+    assert planner.plan((20, 30), (20, 38), cost_map, {'length': 0.7, 'cost': 0.3}) is None
+    assert len(planner._state[0]) == 2 and len(planner._state[1]) == 2
+
+def test_rrt_connect_greedy_connect():
+    cost_map = np.random.RandomState(0).rand(128, 128) * 0.3
+    weights = {'length': 0.7, 'cost': 0.3}
+    planner = RRTConnect(step_size=5.0, max_iterations=5000, sampling_method=UniformSampling(), connect=True)
+    events = []
+    planner.add_callback(lambda event, data: events.append(event))
+    # On an open map the first connect run reaches the other tree.
+    np.random.seed(0)
+    assert planner.plan((5, 5), (120, 120), cost_map, weights) is not None
+    assert events.count('sample') == 1
+    blocked = cost_map.copy()
+    blocked[50:70, 40:90] = 1.0
+    events.clear()
+    np.random.seed(0)
+    path = planner.plan((5, 5), (120, 120), blocked, weights)
+    assert path is not None and path[0] == (5, 5) and path[-1] == (120, 120)
+    # Checked against a copy, so no structure cached while planning is used.
+    assert collision_check_batch(np.stack([path[:-1], path[1:]], axis=1), blocked.copy()).all()
+    assert events.count('edge') == planner.stats['nodes'] - 2
+
+@pytest.mark.parametrize("make_planner", [
+    lambda: RRTConnect(step_size=5.0, max_iterations=5000, sampling_method=UniformSampling()),
+    lambda: RRTConnect(step_size=5.0, max_iterations=5000, sampling_method=UniformSampling(), connect=True),
+    lambda: BITStar(batch_size=200, max_batches=3, step_size=10.0, sampling_method=UniformSampling()),
+    lambda: PRM(n_samples=600, k_neighbors=8, sampling_method=UniformSampling(), lazy=True),
+    lambda: PRM(n_samples=600, k_neighbors=8, sampling_method=UniformSampling()),
+])
+def test_replan_after_obstacle_moves(make_planner):
+    rng = np.random.default_rng(0)
+    cost_map = rng.random((128, 128)) * 0.5
+    start, goal = (5, 5), (120, 120)
+    weights = {'length': 0.7, 'cost': 0.3}
+    np.random.seed(0)
+    planner = make_planner()
+    path = planner.plan(start, goal, cost_map, weights)
+    assert path is not None
+    r, c = np.rint(path[len(path) // 2]).astype(int)
+    region = (r - 6, c - 6, r + 6, c + 6)
+    cost_map[max(r - 6, 0):r + 6, max(c - 6, 0):c + 6] = 1.0
+    path = planner.replan([region])
+    assert path is not None and path[0] == start and path[-1] == goal
+    assert collision_check_batch(np.stack([path[:-1], path[1:]], axis=1), cost_map).all()
+    assert planner.stats['collision_checks'] > 0
+
+@pytest.mark.parametrize("make_planner, goal", [
+    (lambda: RRTConnect(step_size=5.0, max_iterations=5000, sampling_method=UniformSampling()), (58, 10)),
+    (lambda: BidirectionalEST(step_size=5.0, max_iterations=5000, k_samples=5, sampling_method=UniformSampling()),
+     (25, 25)),
+])
+def test_replan_repeatedly_reuses_connection(make_planner, goal):
+    cost_map = np.random.RandomState(0).rand(64, 64) * 0.3
+    cost_map[40:44, 0:48] = 1.0
+    weights = {'length': 0.7, 'cost': 0.3}
+    np.random.seed(0)
+    planner = make_planner()
+    path = planner.plan((5, 5), goal, cost_map, weights)
+    for _ in range(3):
+        # Prune a branch away from the path; the connection survives.
+        on_path = np.rint(path).astype(int)
+        nodes = np.rint(planner._state[0].points[1:]).astype(int)
+        far = nodes[np.abs(nodes[:, None] - on_path[None]).sum(axis=2).min(axis=1) > 8]
+        r, c = far[0]
+        cost_map[r - 2:r + 2, c - 2:c + 2] = 1.0
+        path = planner.replan([(r - 2, c - 2, r + 2, c + 2)])
+        assert path is not None
+    # Block the segment joining the trees but neither of its ends.
+    tree_a, tree_b, connection = planner._state
+    p0, p1 = np.array(tree_a.point(connection[0])), np.array(tree_b.point(connection[1]))
+    r, c = np.rint(p0 + 0.5 * (p1 - p0)).astype(int)
+    assert (r, c) not in {tuple(np.rint(p0).astype(int)), tuple(np.rint(p1).astype(int))}
+    cost_map[r, c] = 1.0
+    path = planner.replan([(r, c, r + 1, c + 1)])
+    assert path is not None and path[0] == (5, 5) and path[-1] == goal
+    assert collision_check_batch(np.stack([path[:-1], path[1:]], axis=1), cost_map.copy()).all()
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_prm_replan_reopens_cleared_edges(lazy):
+    cost_map = np.random.RandomState(0).rand(64, 64) * 0.3
+    cost_map[30:34, :] = 1.0
+    weights = {'length': 0.7, 'cost': 0.3}
+    np.random.seed(0)
+    planner = PRM(n_samples=400, k_neighbors=8, sampling_method=UniformSampling(), lazy=lazy)
+    assert planner.plan((5, 5), (58, 58), cost_map, weights) is None
+    cost_map[30:34, :] = 0.1
+    path = planner.replan([(30, 0, 34, 64)])
+    assert path is not None and path[0] == (5, 5) and path[-1] == (58, 58)
+    assert collision_check_batch(np.stack([path[:-1], path[1:]], axis=1), cost_map.copy()).all()
+
+def test_bit_star_batches_search_the_grown_graph():
+    cost_map = np.random.RandomState(0).rand(64, 64) * 0.3
+    cost_map[20:24, 0:50] = 1.0
+    weights = {'length': 0.7, 'cost': 0.3}
+    np.random.seed(0)
+    planner = BITStar(batch_size=100, max_batches=8, step_size=10.0, sampling_method=UniformSampling())
+    costs = []
+    def check(event, data):
+        if event != 'batch':
+            return
+        # Before each batch: the graph grown in place gives the same
+        # search result as one built afresh from the edge arrays.
+        state = planner._state
+        fresh = Graph.from_edges(len(state.index), state.edge_src, state.edge_dst, state.edge_weights)
+        h = np.zeros(len(state.index))
+        assert np.isclose(astar(state.graph, 0, 1, h)[1], astar(fresh, 0, 1, h)[1])
+        assert np.isclose(astar(fresh, 0, 1, h)[1], state.best_cost) or state.best_cost == float('inf')
+        costs.append(state.best_cost)
+    planner.add_callback(check)
+    path = planner.plan((5, 5), (58, 10), cost_map, weights)
+    assert path is not None and len(costs) == 8
+    assert all(b <= a for a, b in zip(costs, costs[1:])) and np.isfinite(costs[-1])
+    assert np.isclose(calculate_path_cost(path, cost_map, weights), planner._state.best_cost)
+
+def test_bit_star_replan_reconnects_pruned_samples():
+    cost_map = np.random.RandomState(0).rand(64, 64) * 0.3
+    weights = {'length': 0.7, 'cost': 0.3}
+    np.random.seed(0)
+    planner = BITStar(batch_size=300, max_batches=3, step_size=10.0, sampling_method=UniformSampling())
+    assert planner.plan((5, 5), (58, 58), cost_map, weights) is not None
+    assert not planner._state.active.all()
+    # A wall across the diagonal leaves a gap only in the corner, where
+    # the samples were pruned; without new batches, the detour must use them.
+    r, c = np.indices(cost_map.shape)
+    cost_map[(np.abs(r + c - 63) < 4) & (r > 8)] = 1.0
+    planner.max_batches = 0
+    path = planner.replan([(0, 0, 64, 64)])
+    assert path is not None and path[0] == (5, 5) and path[-1] == (58, 58)
+    assert collision_check_batch(np.stack([path[:-1], path[1:]], axis=1), cost_map.copy()).all()
+
+def test_bidirectional_est_replan_keeps_node_costs():
+    cost_map = np.full((40, 40), 0.2)
+    weights = {'length': 0.7, 'cost': 0.3}
+    planner = BidirectionalEST(step_size=5.0, max_iterations=0, sampling_method=UniformSampling())
+    planner.plan((5, 5), (35, 35), cost_map, weights)
+    tree = Tree((5, 5))
+    for point, parent in [((5, 10), 0), ((5, 15), 1), ((5, 20), 2), ((10, 5), 0)]:
+        tree.add(point, parent, calculate_path_cost(tree.path(parent) + [point], cost_map, weights))
+    planner._state = (tree, Tree((35, 35)), None)
+    # Blocks the edge into (5, 15) and raises the cost of the edge below it.
+    cost_map[3:8, 11:19] = 0.5
+    cost_map[5, 12] = 1.0
+    planner.replan([(3, 11, 8, 19)])
+    assert len(tree) == 3
+    for i in range(len(tree)):
+        assert np.isclose(tree.cost[i], calculate_path_cost(tree.path(i), cost_map, weights))
+
+def test_roadmap_query_cost_matches_path_cost(start_goal):
+    start, goal = start_goal
+    weights = {'length': 0.7, 'cost': 0.3}
+    np.random.seed(1)
+    cost_map = np.random.rand(64, 64) * 0.5
+    cost_map[20:30, 10:50] = 1.0
+    roadmap = PRM(n_samples=400, k_neighbors=8, sampling_method=UniformSampling()).build_roadmap(cost_map)
+    path, cost = roadmap.query(start, goal, cost_map, weights, k_neighbors=8)
+    assert path is not None
+    assert np.isclose(cost, calculate_path_cost(path, cost_map, weights))
+
+class _Lottery(Planner):
+    # Solves the query after a short delay for some seeds and otherwise
+    # keeps going until stopped.
+    def plan(self, start, goal, cost_map, weights, time_budget=None):
+        self._start(time_budget)
+        if np.random.rand() < 0.5:
+            time.sleep(0.2)
+            return self._finish([start, goal])
+        while not self._time_up():
+            time.sleep(0.01)
+        return self._finish(None)
+
+class _SharedProbe(Planner):
+    # Reports whether the cost pyramid and the coarse collision masks a
+    # plan_many() worker sees came from the parent's shared memory.
+    def plan(self, start, goal, cost_map, weights, time_budget=None):
+        fields = derived(cost_map)
+        pyramid, coarse = fields['pyramid'], fields[('coarse', 0.99)]
+        return [pyramid[0][0] is cost_map, not pyramid[1][0].flags.writeable, not coarse[0][0].flags.writeable]
+
+def test_plan_many_shares_pyramid_and_coarse_masks(tmp_path):
+    cost_map = np.random.RandomState(0).rand(64, 64)
+    save_cost_map(str(tmp_path / "map.npy"), cost_map)
+    for shared in (cost_map, load_cost_map(str(tmp_path / "map.npy"))):
+        results = plan_many(_SharedProbe(None), [((0, 0), (1, 1))] * 2, shared, {}, workers=2)
+        assert results == [[True, True, True]] * 2
+
+def test_plan_race_cancels_the_losers():
+    free_map = np.zeros((16, 16))
+    # A seed for which exactly one of the two copies wins.
+    seed = next(s for s in range(100)
+                if sum(np.random.RandomState(int(c.generate_state(1)[0])).rand() < 0.5
+                       for c in np.random.SeedSequence(s).spawn(2)) == 1)
+    t = time.perf_counter()
+    path = plan_race(_Lottery(None), (1, 1), (9, 9), free_map, {}, instances=2, workers=2, seed=seed, time_budget=30.0)
+    assert path == [(1, 1), (9, 9)]
+    assert time.perf_counter() - t < 10.0
+    assert plan_race(_Lottery(None), (1, 1), (9, 9), free_map, {}, instances=2, workers=1, seed=seed, time_budget=0.05) == [(1, 1), (9, 9)]
+    with pytest.raises(PlanningTimeout):
+        blocked = np.zeros((16, 16))
+        blocked[:, 5:7] = 1.0
+        plan_race(RRTConnect(max_iterations=10 ** 9, sampling_method=UniformSampling()), (1, 1), (9, 9), blocked,
+                  {'length': 0.7, 'cost': 0.3}, instances=2, workers=2, time_budget=0.2)
+
+def test_predictor_cpu_mode(tmp_path):
+    torch = pytest.importorskip("torch")
+    from src.sampling_planners.model import Predictor, UNet
+    torch.manual_seed(0)
+    model = UNet(base_channels=8)
+    for m in model.modules():
+        if isinstance(m, torch.nn.BatchNorm2d):
+            m.running_mean.uniform_(-0.5, 0.5)
+            m.running_var.uniform_(0.5, 2.0)
+    model.eval()
+    torch.save(model.state_dict(), str(tmp_path / "narrow.pth"))
+    maps = [np.random.RandomState(i).rand(64, 48).astype(np.float32) for i in range(3)]
+    with torch.no_grad():
+        expected = model(torch.from_numpy(np.stack(maps))[None]).numpy()[0, 0]
+    predictor = Predictor(str(tmp_path / "narrow.pth"), 'cpu', threads=1)
+    assert np.allclose(predictor.predict(*maps), expected, atol=1e-5)
+    assert Predictor(str(tmp_path / "narrow.pth"), 'cpu', scale=0.5).predict(*maps).shape == (64, 48)
+    with pytest.raises(ValueError):
+        Predictor(str(tmp_path / "narrow.pth"), scale=2.0)
+    sampler = LearningBasedSampling(device='cpu', model_path=str(tmp_path / "narrow.pth"), scale=0.5)
+    batch = sampler.sample_batch(np.zeros((64, 64)), (5, 5), (50, 50), 10)
+    assert batch.shape == (10, 2)